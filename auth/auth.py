@@ -1,14 +1,84 @@
-import json
-from flask import request
+from flask import g, request
 from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
-import os
+import logging
 
+from auth.jwks import JWKSKeyStore
+from auth.token_cache import VerifiedTokenCache
+from metrics import JWT_VERIFY_SECONDS, TOKEN_CACHE_LOOKUPS, timed
+
+
+logger = logging.getLogger(__name__)
+
+# Set from the app's configuration by init_auth().
+AUTH0_DOMAIN = None
+ALGORITHMS = ['RS256']
+API_AUDIENCE = None
+JWKS_URL = None
+
+# Shared by every request handled in this process.
+jwks_store = None
+
+# Verified payloads of recently seen tokens. TOKEN_CACHE_SIZE=0 disables it.
+token_cache = None
+
+# Initialize Auth
+# Configures token verification when the app is created rather than at import.
+
+def init_auth(app):
+    """
+    Configures token verification from the app's settings.
+
+    Args:
+        app: Flask app whose config holds AUTH0_DOMAIN, ALGORITHMS, API_AUDIENCE,
+            AUTH0_JWKS_URL (defaults to the Auth0 tenant's JWKS), JWKS_CACHE_TTL,
+            JWKS_MIN_REFRESH_INTERVAL and TOKEN_CACHE_SIZE.
+
+    Process:
+        - The key store and token cache are process-wide. An app created later in
+          the same process keeps them, and the keys already fetched, unless its
+          JWKS URL or cache size differs.
+    """
+    global AUTH0_DOMAIN, ALGORITHMS, API_AUDIENCE, JWKS_URL, jwks_store, token_cache
+    config = app.config
+    AUTH0_DOMAIN = config['AUTH0_DOMAIN']
+    ALGORITHMS = [config['ALGORITHMS']]
+    API_AUDIENCE = config['API_AUDIENCE']
+    JWKS_URL = config['AUTH0_JWKS_URL'] or \
+        f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+    if not AUTH0_DOMAIN or not API_AUDIENCE:
+        logger.warning('AUTH0_DOMAIN and API_AUDIENCE are not set; every '
+                       'protected request will be rejected')
+
+    if jwks_store is None or jwks_store.url != JWKS_URL:
+        jwks_store = JWKSKeyStore(
+            JWKS_URL,
+            ttl=config['JWKS_CACHE_TTL'],
+            min_refresh_interval=config['JWKS_MIN_REFRESH_INTERVAL'])
+    if token_cache is None or token_cache.max_size != config['TOKEN_CACHE_SIZE']:
+        token_cache = VerifiedTokenCache(max_size=config['TOKEN_CACHE_SIZE'])
+
+# Reset After Fork
+# Gives a forked worker its own key store and token cache.
+
+def reset_after_fork():
+    """
+    Replaces the key store and token cache inherited from the parent process.
+
+    Process:
+        - Called by the server in each new worker (see gunicorn.conf.py). A key
+          set the parent fetched is dropped along with any lock its threads held,
+          so each worker fetches the JWKS once on its first protected request.
+    """
+    global jwks_store, token_cache
+    if jwks_store is not None:
+        jwks_store = JWKSKeyStore(
+            jwks_store.url,
+            ttl=jwks_store.ttl,
+            min_refresh_interval=jwks_store.min_refresh_interval,
+            timeout=jwks_store.timeout)
+    if token_cache is not None:
+        token_cache = VerifiedTokenCache(max_size=token_cache.max_size)
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = [os.environ['ALGORITHMS']]
-API_AUDIENCE = os.environ['API_AUDIENCE']
 
 # AuthError Exception
 # A standardized way to handle and communicate authentication and authorization errors.
@@ -114,9 +184,11 @@ def verify_decode_jwt(token):
         token (str): The JWT token to verify.
 
     Process:
-        - Fetches the JWKS from the Auth0 domain.
         - Extracts the token's header and validates the key ID (kid).
-        - Uses the appropriate RSA key to verify the token's signature.
+        - Looks the key up in the cached JWKS, which is only fetched from Auth0
+          when stale or when the kid is unknown.
+        - Verifies the token's signature with the key's parsed public key, which
+          is built once per kid rather than on every call.
         - Decodes the token and validates its claims (audience and issuer).
 
     Returns:
@@ -125,34 +197,28 @@ def verify_decode_jwt(token):
     Raises:
         AuthError: For invalid headers, expired tokens, incorrect claims, or any other verification issues.
     """
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    # Imported on first use: jose and its crypto backend are only needed once a
+    # token has to be verified, not to start a worker or collect tests.
+    from jose import jwt
+
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    key = jwks_store.get_key(unverified_header['kid'])
+    if key:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with timed(JWT_VERIFY_SECONDS, 'jwt'):
+                payload = jwt.decode(
+                    token,
+                    jwks_store.get_public_key(key, ALGORITHMS[0]),
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
 
             return payload
 
@@ -184,18 +250,42 @@ def verify_decode_jwt(token):
 # Requires Authorization
 # A decorator to enforce authentication and authorization for protected routes.
 
+def _cached_payload(token):
+    payload = token_cache.get(token)
+    TOKEN_CACHE_LOOKUPS.labels('miss' if payload is None else 'hit').inc()
+    return payload
+
+
+def _authorize(token, payload, permission):
+    """
+    Verifies an uncached token, checks the permission unless it is None and
+    keeps the payload as g.jwt_payload. Shared by both decorators, so a view
+    sees the same checks under WSGI and ASGI.
+    """
+    if payload is None:
+        payload = verify_decode_jwt(token)
+        token_cache.put(token, payload)
+    if permission is not None:
+        check_permissions(permission, payload)
+    g.jwt_payload = payload
+    return payload
+
+
 def requires_auth(permission=''):
     """
     Decorator to enforce authentication and authorization.
 
     Args:
-        permission (str): The required permission string (e.g., 'post:actors').
+        permission (str): The required permission string (e.g., 'post:actors'). None only
+            authenticates the caller, for views that check permissions themselves.
 
     Process:
         - Retrieves the token using get_token_auth_header().
-        - Verifies and decodes the token using verify_decode_jwt().
+        - Returns the cached payload if the token was already verified and has not
+          expired, otherwise verifies and decodes it using verify_decode_jwt().
         - Validates the required permission using check_permissions().
-        - Passes the decoded payload to the decorated function.
+        - Passes the decoded payload to the decorated function, and keeps it as
+          g.jwt_payload for the request's after_request hooks.
 
     Returns:
         function: The decorated function with validated payload passed as an argument.
@@ -207,8 +297,45 @@ def requires_auth(permission=''):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = _authorize(token, _cached_payload(token), permission)
             return f(payload, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
+
+
+# Requires Authorization (async)
+# The same checks for the coroutine views of the ASGI entry point.
+
+def requires_auth_async(permission=''):
+    """
+    Decorator enforcing authentication and authorization on a coroutine view.
+
+    Args:
+        permission (str): The required permission string (e.g., 'view:movies'), or
+            None, as for requires_auth().
+
+    Process:
+        - Same as requires_auth(), except that the signing key of an uncached
+          token is looked up with jwks_store.get_key_async() first, so a JWKS
+          fetch never blocks the event loop.
+
+    Raises:
+        AuthError: For missing tokens, invalid permissions, or JWT verification issues.
+    """
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = get_token_auth_header()
+            payload = _cached_payload(token)
+            if payload is None:
+                from jose import jwt, JWTError
+                try:
+                    kid = jwt.get_unverified_header(token).get('kid')
+                except JWTError:
+                    kid = None
+                if kid:
+                    await jwks_store.get_key_async(kid)
+            payload = _authorize(token, payload, permission)
+            return await f(payload, *args, **kwargs)
+        return wrapper
+    return requires_auth_decorator
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+
+from metrics import JWKS_FETCH_SECONDS, timed
+
+
+logger = logging.getLogger(__name__)
+
+
+_backend_checked = False
+
+
+def _check_backend():
+    global _backend_checked
+    if _backend_checked:
+        return
+    from jose.backends import RSAKey
+    if RSAKey.__name__ != 'CryptographyRSAKey':
+        logger.warning('python-jose is using the pure-Python %s backend; install '
+                       "python-jose[cryptography] for fast signature verification",
+                       RSAKey.__module__)
+    _backend_checked = True
+
+
+# JWKSFetchError Exception
+# Raised when the key set cannot be fetched and no previously fetched keys are available.
+
+class JWKSFetchError(Exception):
+    """
+    Raised when the JWKS document cannot be retrieved or parsed.
+    """
+    pass
+
+
+# JWKS Key Store
+# Process-wide cache of the identity provider's JSON Web Key Set.
+
+class JWKSKeyStore:
+    """
+    Caches the JSON Web Key Set so protected requests do not fetch it every time.
+
+    Args:
+        url (str): Location of the JWKS document. Any URL understood by urlopen
+            works, so tests can point it at a local file:// path or a stub server.
+        ttl (float): Seconds a fetched key set is considered fresh.
+        min_refresh_interval (float): Minimum seconds between forced refreshes
+            triggered by an unknown 'kid'.
+        timeout (float): Socket timeout for the fetch.
+
+    Process:
+        - The first lookup fetches the key set synchronously.
+        - Once the key set is older than the TTL it is still served, and a single
+          background thread refreshes it.
+        - A 'kid' that is not in the key set forces one synchronous refresh,
+          at most once per min_refresh_interval.
+        - Only one fetch runs at a time; concurrent callers wait for it and reuse
+          its result instead of fetching again.
+        - A failed refresh keeps serving the last good key set.
+    """
+    def __init__(self, url, ttl=600, min_refresh_interval=30, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = None
+        self._public_keys = {}
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        self._generation = 0
+        self._fetch_lock = threading.Lock()
+        self.fetch_count = 0
+        self.error_count = 0
+
+    def get_key(self, kid):
+        """
+        Returns the JWK with the given key id, or None if the provider does not publish it.
+
+        Raises:
+            JWKSFetchError: If no key set has ever been fetched successfully.
+        """
+        keys = self._keys
+        if keys is None:
+            self._refresh_sync(self._generation)
+            keys = self._keys
+        elif self._is_stale() and self._may_retry():
+            self._refresh_background()
+
+        key = keys.get(kid)
+        if key is None and self._may_retry():
+            self._refresh_sync(self._generation)
+            key = self._keys.get(kid)
+        return key
+
+    def get_public_key(self, key, algorithm):
+        """
+        Returns the parsed key object for a JWK returned by get_key(), ready to
+        verify signatures. Each JWK is parsed once per fetched key set; jose's
+        cryptography backend then verifies with OpenSSL.
+
+        Raises:
+            KeyError, JWKError: If the JWK is not a usable RSA public key.
+        """
+        cached = self._public_keys.get(key['kid'])
+        if cached is not None and cached[0] is key:
+            return cached[1]
+
+        from jose import jwk
+        _check_backend()
+        public_key = jwk.construct({
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }, algorithm)
+        self._public_keys[key['kid']] = (key, public_key)
+        return public_key
+
+    async def get_key_async(self, kid):
+        """
+        get_key() for coroutines. A cached key is returned without blocking the
+        event loop; the rare lookups that must fetch the key set run get_key()
+        in a worker thread, so they share its single-flight fetch.
+        """
+        keys = self._keys
+        if keys is not None and kid in keys:
+            return self.get_key(kid)
+        return await asyncio.to_thread(self.get_key, kid)
+
+    def refresh(self):
+        """
+        Fetches the key set now, unless another thread is already doing so.
+        """
+        self._refresh_sync(self._generation)
+
+    def clear(self):
+        """
+        Drops the cached key set so the next lookup fetches it again.
+        """
+        self._keys = None
+        self._public_keys = {}
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+
+    def _is_stale(self):
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+    def _may_retry(self):
+        return time.monotonic() - self._attempted_at >= self.min_refresh_interval
+
+    def _refresh_sync(self, generation):
+        with self._fetch_lock:
+            # Another thread completed a fetch while we waited for the lock.
+            if self._generation != generation:
+                return
+            self._fetch()
+
+    def _refresh_background(self):
+        if not self._fetch_lock.acquire(blocking=False):
+            return
+        thread = threading.Thread(target=self._background_fetch, daemon=True)
+        try:
+            thread.start()
+        except Exception:
+            self._fetch_lock.release()
+            raise
+
+    def _background_fetch(self):
+        try:
+            self._fetch()
+        except JWKSFetchError:
+            pass
+        finally:
+            self._fetch_lock.release()
+
+    def _fetch(self):
+        self._attempted_at = time.monotonic()
+        try:
+            with timed(JWKS_FETCH_SECONDS, 'jwks'):
+                with urlopen(self.url, timeout=self.timeout) as response:
+                    jwks = json.loads(response.read())
+            keys = {key['kid']: key for key in jwks['keys'] if 'kid' in key}
+        except Exception as e:
+            self.error_count += 1
+            if self._keys is None:
+                raise JWKSFetchError(f'Unable to fetch JWKS from {self.url}: {e}')
+            logger.warning('JWKS refresh failed, serving cached keys: %s', e)
+            self._generation += 1
+            return
+
+        self.fetch_count += 1
+        self._keys = keys
+        self._public_keys = {}
+        self._fetched_at = time.monotonic()
+        self._generation += 1
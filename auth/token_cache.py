@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+# Verified Token Cache
+# Bounded LRU cache of JWT payloads that already passed signature and claim checks.
+
+class VerifiedTokenCache:
+    """
+    Remembers decoded payloads of verified tokens until they expire.
+
+    Args:
+        max_size (int): Maximum number of tokens kept. 0 disables the cache.
+
+    Process:
+        - Entries are keyed by the SHA-256 of the raw token, so bearer tokens are
+          never held in memory as dictionary keys.
+        - Each entry expires at the token's 'exp' claim; tokens without one are
+          not cached.
+        - When full, the least recently used entry is evicted.
+
+    Attributes:
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that required a full verification.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """
+        Returns the cached payload for the token, or None on a miss or expiry.
+        """
+        if not self.enabled:
+            return None
+
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, token, payload):
+        """
+        Caches a verified payload until its 'exp' claim.
+        """
+        if not self.enabled:
+            return
+
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the current size and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,103 @@
+"""
+Benchmark: ASGI vs. WSGI serving
+Starts the app twice on the same database, under gunicorn with
+gunicorn.conf.py (the Procfile deployment) and under uvicorn with the ASGI
+entry point, and
+drives GET /movies at increasing numbers of concurrent connections. Reports
+requests per second, p50/p99 latency and errors for each.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/asgi_throughput.py --concurrency 10 100 500
+    python benchmarks/asgi_throughput.py            # SQLite file in a temp directory
+
+Tokens are minted locally and verified against a stub JWKS server, so no Auth0
+tenant is needed. The response cache is disabled so that every request reads
+the database. The target database is dropped and recreated, never point it at
+real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+
+
+async def drive(port, path, headers, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        connection = harness.HTTPConnection('127.0.0.1', port)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = await connection.request('GET', path, headers)
+            except Exception:
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        connection.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    summary = harness.summarize(latencies, errors, duration)
+    return {key: summary[key] for key in
+            ('requests_per_second', 'p50_ms', 'p99_ms', 'errors')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--cast-size', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 300])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--path', default='/movies?limit=20')
+    args = parser.parse_args()
+
+    stub = harness.JWKSStub().start()
+    headers = {'Authorization': 'Bearer ' + stub.mint(['view:movies', 'view:actors'])}
+    app = create_app()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        harness.seed(args.movies, args.cast_size)
+        db.engine.dispose()
+
+    servers = {'wsgi_gunicorn': 'gunicorn', 'asgi_uvicorn': 'uvicorn'}
+    results = {}
+    for name, kind in servers.items():
+        port = harness.free_port()
+        process = harness.start_server(kind, port, args.workers)
+        try:
+            results[name] = {
+                str(concurrency): asyncio.run(drive(
+                    port, args.path, headers, concurrency, args.duration))
+                for concurrency in args.concurrency}
+        finally:
+            process.terminate()
+            process.wait()
+    stub.stop()
+
+    print(json.dumps({
+        'database': dialect,
+        'workers': args.workers,
+        'path': args.path,
+        'duration_s': args.duration,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark: gunicorn worker profiles
+Runs the mixed workload of load_test.py against gunicorn.conf.py with each
+worker profile: sync workers, gthread with a few thread counts, and gevent.
+Each database statement is delayed by --db-latency-ms to stand in for the
+network round trip to a remote Postgres. Reports throughput, latency and
+errors per profile, the time from starting gunicorn to the first response,
+and the memory of the master and workers (PSS, so pages they share are
+counted once).
+
+Usage:
+    python benchmarks/gunicorn_profiles.py --concurrency 50 --db-latency-ms 5
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/gunicorn_profiles.py --db-latency-ms 0
+
+The target database is dropped and recreated, never point it at real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+import load_test  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+
+# Served instead of flaskr:create_app() so that every statement pays the
+# simulated round trip; time.sleep yields to other greenlets under gevent.
+LATENCY_APP = '''
+import os
+import time
+from sqlalchemy import event
+from flaskr import create_app
+from models import db
+
+DELAY = float(os.environ['BENCH_DB_LATENCY_MS']) / 1000
+
+app = create_app()
+with app.app_context():
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute',
+                     lambda *args: time.sleep(DELAY))
+'''
+
+PROFILES = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync'},
+    'gthread_2_threads': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '2'},
+    'gthread_default': {'GUNICORN_WORKER_CLASS': 'gthread'},
+    'gthread_15_threads': {'GUNICORN_WORKER_CLASS': 'gthread',
+                           'GUNICORN_THREADS': '15'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent'},
+    'gthread_default_no_preload': {'GUNICORN_WORKER_CLASS': 'gthread',
+                                   'GUNICORN_PRELOAD': 'false'}
+}
+
+
+def pss_mb(pid):
+    """
+    Proportional set size of a process and its children, in megabytes.
+    """
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+        total = 0
+        for each in pids:
+            with open(f'/proc/{each}/smaps_rollup') as f:
+                total += next(int(line.split()[1]) for line in f
+                              if line.startswith('Pss:'))
+        return round(total / 1024, 1)
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES),
+                        choices=list(PROFILES))
+    parser.add_argument('--workers', type=int,
+                        help='Defaults to the worker count of gunicorn.conf.py')
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--cast-size', type=int, default=5)
+    parser.add_argument('--mix', default=load_test.DEFAULT_MIX)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--db-latency-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    weights = load_test.parse_mix(args.mix)
+    stub = harness.JWKSStub().start()
+    tokens = stub.role_tokens()
+    app = create_app()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        harness.seed(args.movies, args.cast_size)
+        db.engine.dispose()
+
+    with open(os.path.join(harness.WORKDIR, 'latency_app.py'), 'w') as f:
+        f.write(LATENCY_APP)
+    env = {'BENCH_DB_LATENCY_MS': str(args.db_latency_ms)}
+
+    results = {}
+    for name in args.profiles:
+        port = harness.free_port()
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--pythonpath', f'{harness.ROOT},{harness.WORKDIR}'] \
+            + (['--workers', str(args.workers)] if args.workers else []) \
+            + ['latency_app:app']
+        started = time.perf_counter()
+        process = harness.start_server(None, port, None, env={**env, **PROFILES[name]},
+                                       command=command)
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').read()
+            first_response_ms = round((time.perf_counter() - started) * 1000)
+            state = load_test.WorkloadState(args.movies, args.movies * args.cast_size)
+            overall, _ = asyncio.run(load_test.run_workload(
+                '127.0.0.1', port, tokens, state, weights, args.concurrency,
+                args.duration, args.warmup))
+            overall['first_response_ms'] = first_response_ms
+            overall['pss_mb'] = pss_mb(process.pid)
+            results[name] = overall
+        finally:
+            process.terminate()
+            process.wait()
+    stub.stop()
+
+    print(json.dumps({
+        'revision': harness.git_revision(),
+        'database': dialect,
+        'cpus': os.cpu_count(),
+        'db_latency_ms': args.db_latency_ms,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Shared pieces of the HTTP benchmarks: a stub JWKS server and RS256 tokens for
+the roles in auth_config.json, seeding, starting the app under gunicorn or
+uvicorn, and an asyncio HTTP/1.1 client with latency percentiles.
+
+Importing this module sets the environment defaults the app needs (a SQLite
+file in a temp directory unless DATABASE_URL is set), so import it before
+flaskr or models.
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+WORKDIR = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+    WORKDIR, 'bench.db'))
+os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+import rsa  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+from sqlalchemy import insert, inspect, text  # noqa: E402
+
+from models import db, Movie, Actor, bump_versions  # noqa: E402
+
+KID = 'bench'
+
+
+class JWKSStub:
+    """
+    Serves a freshly generated public key as the JWKS document on a local port,
+    and mints tokens signed with the matching private key.
+
+    Process:
+        - start() listens on 127.0.0.1 and points AUTH0_JWKS_URL at the stub,
+          so servers started afterwards fetch their keys from it.
+    """
+    def __init__(self):
+        public_key, private_key = rsa.newkeys(2048)
+        public_jwk = jwk.construct(public_key.save_pkcs1().decode(), 'RS256') \
+            .to_dict()
+        public_jwk.update({'kid': KID, 'use': 'sig'})
+        self.document = json.dumps({'keys': [public_jwk]}).encode()
+        self.private_pem = private_key.save_pkcs1().decode()
+        self.requests = 0
+        self._server = None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(stub.document)))
+                self.end_headers()
+                self.wfile.write(stub.document)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        os.environ['AUTH0_JWKS_URL'] = \
+            f'http://127.0.0.1:{self._server.server_port}/.well-known/jwks.json'
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def mint(self, permissions, expires_in=3600):
+        now = int(time.time())
+        return jwt.encode({
+            'iss': f"https://{os.environ['AUTH0_DOMAIN']}/",
+            'aud': os.environ['API_AUDIENCE'],
+            'sub': 'auth0|bench',
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': permissions
+        }, self.private_pem, algorithm='RS256', headers={'kid': KID})
+
+    def role_tokens(self, path=os.path.join(ROOT, 'auth_config.json')):
+        """
+        Returns {role: token} for every role in auth_config.json, each carrying
+        that role's permissions.
+        """
+        with open(path) as f:
+            roles = json.load(f)['roles']
+        return {name: self.mint(role['permissions']) for name, role in roles.items()}
+
+
+def seed(movie_count, cast_size=0, chunk=10000, movie_row=None, actor_row=None,
+         actor_count=None):
+    """
+    Recreates the tables and inserts movie_count movies with cast_size actors
+    each. Must run inside an app context.
+
+    movie_row(i) and actor_row(i) return the column values of the i-th movie and
+    actor for benchmarks that need other data, and actor_count replaces
+    movie_count * cast_size. A database with an alembic_version table was set up
+    by the migrations, i.e. it is an app database, and is never dropped.
+    """
+    if inspect(db.engine).has_table('alembic_version'):
+        raise SystemExit(f'{db.engine.url!r} was created by "flask db upgrade"; '
+                         'benchmarks drop every table, point DATABASE_URL at a '
+                         'throwaway database')
+    movie_row = movie_row or (lambda i: {
+        'id': i + 1, 'title': f'Movie {i}',
+        'release_date': datetime(2000 + i % 25, 1 + i % 12, 1)})
+    actor_row = actor_row or (lambda i: {
+        'id': i + 1, 'name': f'Actor {i}', 'age': 18 + i % 70,
+        'gender': 'MF'[i % 2], 'movie_id': i // cast_size + 1})
+    if actor_count is None:
+        actor_count = movie_count * cast_size
+
+    db.drop_all()
+    db.create_all()
+    for start in range(0, movie_count, chunk):
+        db.session.execute(insert(Movie), [
+            movie_row(i) for i in range(start, min(start + chunk, movie_count))])
+    for start in range(0, actor_count, chunk):
+        db.session.execute(insert(Actor), [
+            actor_row(i) for i in range(start, min(start + chunk, actor_count))])
+    bump_versions('movies', 'actors')
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        # Explicit ids do not advance the serial sequences.
+        for table in ('movies', 'actors'):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"))
+        db.session.commit()
+    # Fresh statistics so the planner sees the real table sizes.
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+SERVERS = {
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}']
+        + (['--workers', str(workers)] if workers else [])
+        + ['flaskr:create_app()'],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--factory', '--workers', str(workers or 1),
+        '--port', str(port), '--no-access-log', 'flaskr.asgi:create_asgi_app']
+}
+
+
+def start_server(kind, port, workers, env=None, command=None):
+    """
+    Starts the app under one of SERVERS (or the given command) and waits until
+    it accepts connections. gunicorn reads gunicorn.conf.py, so workers=None
+    keeps its default and env can select a profile, e.g.
+    {'GUNICORN_WORKER_CLASS': 'gevent'}.
+    """
+    command = command or SERVERS[kind](port, workers)
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'Server did not start: {" ".join(command)}')
+
+
+class HTTPConnection:
+    """
+    Minimal keep-alive HTTP/1.1 client for asyncio; reconnects whenever the
+    server closes the connection (gunicorn's sync workers always do).
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._streams = None
+
+    async def request(self, method, path, headers=None, body=None):
+        """
+        Returns (status, body bytes).
+        """
+        if self._streams is None:
+            self._streams = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._streams
+        headers = dict(headers or {})
+        headers['Host'] = f'{self.host}:{self.port}'
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            headers['Content-Length'] = str(len(body))
+        try:
+            writer.write((f'{method} {path} HTTP/1.1\r\n' + ''.join(
+                f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n').encode()
+                + (body or b''))
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            length, close = 0, False
+            while True:
+                line = (await reader.readline()).decode('latin1').strip().lower()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'connection' and value.strip() == 'close':
+                    close = True
+            data = await reader.readexactly(length)
+        except Exception:
+            self.close()
+            raise
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self._streams is not None:
+            self._streams[1].close()
+            self._streams = None
+
+
+def summarize(latencies, errors, duration):
+    """
+    Throughput and latency percentiles (milliseconds) of successful requests.
+    """
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+                     * 1000, 2)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2)
+        if latencies else None,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
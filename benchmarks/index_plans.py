@@ -0,0 +1,154 @@
+"""
+Benchmark: Index-backed filtering and sorting
+Seeds a large movies/actors data set and prints the query plan and latency of
+the SQL that GET /movies and GET /actors issue for each filter and sort order,
+for the first page and for the page after its cursor, flagging any plan that
+falls back to a sequential scan or sorts rows instead of reading them in index
+order. Exits non-zero on a sequential scan, or on a sort in a ?sort= request:
+a range filter in id order sorts only the rows it matches, the same on every
+page, but a sort order must be read from its (sort, id) index.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/index_plans.py --actors 1000000
+    python benchmarks/index_plans.py            # SQLite file in a temp directory
+
+The target database is dropped and recreated, never point it at real data.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from sqlalchemy import event  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.filters import MOVIE_SORTS, ACTOR_SORTS, filter_movies, filter_actors  # noqa: E402
+from flaskr.pagination import get_page_args, get_sort_arg, paginate  # noqa: E402
+from models import db, Movie, Actor  # noqa: E402
+
+
+CASES = [
+    ('/movies', 'released_after=2010-01-01&released_before=2012-12-31'),
+    ('/movies', 'sort=-release_date'),
+    ('/movies', 'sort=title'),
+    ('/actors', 'movie_id=7'),
+    ('/actors', 'min_age=30&max_age=31'),
+    ('/actors', 'gender=F&min_age=40&sort=age'),
+    ('/actors', 'sort=name'),
+    ('/actors', 'sort=-age'),
+]
+
+
+def seed(movie_count, actor_count):
+    rng = random.Random(42)
+    harness.seed(
+        movie_count, actor_count=actor_count,
+        movie_row=lambda i: {
+            'title': f'Movie {i}',
+            'release_date': datetime(1950 + rng.randrange(75), rng.randrange(1, 13), 1)},
+        actor_row=lambda i: {
+            'name': f'Actor {rng.randrange(actor_count)}',
+            'age': rng.randrange(18, 90),
+            'gender': rng.choice('MF'),
+            'movie_id': rng.randrange(1, movie_count + 1)})
+
+
+def list_query(app, path, query_string):
+    """
+    Run the route's query building code and capture the SELECTs it issues,
+    which are more than one when a page crosses from non-NULL to NULL sort
+    keys. Returns (statements, elapsed, next_cursor).
+    """
+    model, sorts, apply_filters = {
+        '/movies': (Movie, MOVIE_SORTS, filter_movies),
+        '/actors': (Actor, ACTOR_SORTS, filter_actors),
+    }[path]
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    with app.test_request_context(f'{path}?{query_string}'):
+        sort = get_sort_arg(sorts)
+        limit, cursor = get_page_args(sort)
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            started = time.perf_counter()
+            _, next_cursor = paginate(apply_filters(model.query), model.id, limit,
+                                      cursor, sort)
+            elapsed = time.perf_counter() - started
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+    return captured, elapsed, next_cursor
+
+
+def explain(statement, parameters):
+    connection = db.session.connection().connection.driver_connection
+    cursor = connection.cursor()
+    if db.engine.dialect.name == 'postgresql':
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        plan = [row[0] for row in cursor.fetchall()]
+        sequential = any('Seq Scan' in line for line in plan)
+    else:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        plan = [row[-1] for row in cursor.fetchall()]
+        sequential = any(line.startswith('SCAN') and 'USING' not in line
+                         for line in plan)
+    cursor.close()
+    return plan, sequential
+
+
+def sorts_rows(plan):
+    """True when a plan sorts rows rather than reading them in index order."""
+    return any('Sort' in line or 'TEMP B-TREE' in line for line in plan)
+
+
+def page_result(path, query_string, statements, elapsed):
+    plans = [explain(statement, parameters) for statement, parameters in statements]
+    return {
+        'request': f'GET {path}?{query_string}',
+        'ms': round(elapsed * 1000, 2),
+        'sequential_scan': any(sequential for _, sequential in plans),
+        'sort': any(sorts_rows(plan) for plan, _ in plans),
+        'plan': [line for plan, _ in plans for line in plan]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--movies', type=int, default=20000)
+    parser.add_argument('--actors', type=int, default=200000)
+    args = parser.parse_args()
+
+    app = create_app()
+    results = []
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        seed(args.movies, args.actors)
+        for path, query_string in CASES:
+            statements, elapsed, next_cursor = list_query(app, path, query_string)
+            results.append(page_result(path, query_string, statements, elapsed))
+            if next_cursor is not None:
+                # Deep pages must be the same index range scan as the first.
+                query_string = f'{query_string}&after={next_cursor}'
+                statements, elapsed, _ = list_query(app, path, query_string)
+                results.append(page_result(path, query_string, statements, elapsed))
+
+    print(json.dumps({
+        'database': dialect,
+        'movies': args.movies,
+        'actors': args.actors,
+        'results': results
+    }, indent=2))
+    return 1 if any(r['sequential_scan'] or (r['sort'] and 'sort=' in r['request'])
+                    for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Benchmark: JWT signature verification
+Verifies one RS256 token repeatedly on a single core, the way
+verify_decode_jwt() used to (a JWK dict handed to jwt.decode(), re-parsed on
+every call, with the pure-Python 'rsa' backend) and the way it does now (a key
+object parsed once per kid, verified with the cryptography backend). The
+in-between case isolates the gain of each change. Reports verifications per
+second.
+
+Usage:
+    python benchmarks/jwt_verify.py --seconds 3
+
+No database or network is needed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from jose import jwt  # noqa: E402
+from jose.backends.rsa_backend import RSAKey as PurePythonRSAKey  # noqa: E402
+
+from auth.jwks import JWKSKeyStore  # noqa: E402
+
+AUDIENCE = os.environ['API_AUDIENCE']
+ISSUER = f"https://{os.environ['AUTH0_DOMAIN']}/"
+
+
+def rate(verify, seconds):
+    verify()
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        verify()
+        count += 1
+    return round(count / (time.perf_counter() - started), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    stub = harness.JWKSStub()
+    token = stub.mint(['view:movies'])
+    key = json.loads(stub.document)['keys'][0]
+    rsa_key = {name: key[name] for name in ('kty', 'kid', 'use', 'n', 'e')}
+
+    def decode(signing_key):
+        return jwt.decode(token, signing_key, algorithms=['RS256'],
+                          audience=AUDIENCE, issuer=ISSUER)
+
+    store = JWKSKeyStore('unused')
+    cases = {
+        'dict_pure_python_rsa': lambda: decode(PurePythonRSAKey(rsa_key, 'RS256')),
+        'dict_cryptography': lambda: decode(rsa_key),
+        'parsed_key_cryptography': lambda: decode(
+            store.get_public_key(key, 'RS256'))
+    }
+    results = {name: rate(verify, args.seconds) for name, verify in cases.items()}
+
+    print(json.dumps({
+        'verifications_per_second': results,
+        'speedup': round(results['parsed_key_cryptography']
+                         / results['dict_pure_python_rsa'], 1)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Benchmark: Mixed-workload load test
+Seeds a database, starts the app under gunicorn or uvicorn (or targets an
+already running server with --url), and drives a weighted mix of reads and
+writes from concurrent keep-alive clients. Tokens for each role in
+auth_config.json are minted locally and verified against a stub JWKS server,
+so no Auth0 tenant or live deployment is needed.
+
+Reports throughput and p50/p95/p99 latency per route as JSON; save runs with
+--output and compare them across commits.
+
+Usage:
+    python benchmarks/load_test.py --server gunicorn --concurrency 50 --duration 30
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/load_test.py \\
+        --server uvicorn --movies 10000 --mix list_movies=50,get_actor=30,create_actor=20
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --no-seed
+
+The target database is dropped and recreated unless --no-seed is given, never
+point it at real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+"""
+Operations
+name: (role, method, route label, function building (path, body) from the
+workload state). Ids are drawn from the seeded ranges; writes only touch actors
+created by the run itself, so reads keep finding the seeded data.
+"""
+
+def _json(data):
+    return json.dumps(data).encode()
+
+
+OPERATIONS = {
+    'list_movies': ('Casting Assistant', 'GET', 'GET /movies',
+                    lambda s: ('/movies?limit=20', None)),
+    'list_actors': ('Casting Assistant', 'GET', 'GET /actors',
+                    lambda s: (f'/actors?limit=20&min_age={random.randint(18, 80)}',
+                               None)),
+    'get_movie': ('Casting Assistant', 'GET', 'GET /movies/<id>',
+                  lambda s: (f'/movies/{random.randint(1, s.movies)}', None)),
+    'get_actor': ('Casting Assistant', 'GET', 'GET /actors/<id>',
+                  lambda s: (f'/actors/{random.randint(1, s.actors)}', None)),
+    'create_actor': ('Casting Director', 'POST', 'POST /actors',
+                     lambda s: ('/actors', _json({
+                         'name': 'Load Test', 'age': random.randint(18, 80),
+                         'gender': 'F', 'movie_id': random.randint(1, s.movies)}))),
+    'update_actor': ('Casting Director', 'PATCH', 'PATCH /actors/<id>',
+                     lambda s: (f'/actors/{s.created_actor()}',
+                                _json({'age': random.randint(18, 80)}))),
+    'delete_actor': ('Casting Director', 'DELETE', 'DELETE /actors/<id>',
+                     lambda s: (f'/actors/{s.pop_created_actor()}', None))
+}
+
+DEFAULT_MIX = 'list_movies=35,list_actors=25,get_movie=15,get_actor=15,' \
+    'create_actor=5,update_actor=3,delete_actor=2'
+
+
+class WorkloadState:
+    """
+    Seeded row counts and the ids of actors created during the run.
+    """
+    def __init__(self, movies, actors):
+        self.movies = max(movies, 1)
+        self.actors = max(actors, 1)
+        self.created = []
+
+    def created_actor(self):
+        return random.choice(self.created) if self.created else self.actors
+
+    def pop_created_actor(self):
+        if not self.created:
+            return self.actors
+        return self.created.pop(random.randrange(len(self.created)))
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in filter(None, mix.split(',')):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation '{name}'. "
+                             f"Use: {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def run_workload(host, port, tokens, state, weights, concurrency,
+                       duration, warmup):
+    names, cum_weights = list(weights), []
+    total = 0
+    for name in names:
+        total += weights[name]
+        cum_weights.append(total)
+
+    results = {OPERATIONS[name][2]: {'latencies': [], 'errors': 0, 'statuses': {}}
+               for name in names}
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def client():
+        connection = harness.HTTPConnection(host, port)
+        while time.perf_counter() < deadline:
+            name = random.choices(names, cum_weights=cum_weights)[0]
+            role, method, route, build = OPERATIONS[name]
+            path, body = build(state)
+            headers = {'Authorization': f'Bearer {tokens[role]}'}
+            sent = time.perf_counter()
+            try:
+                status, data = await connection.request(method, path, headers, body)
+            except Exception:
+                status, data = None, b''
+            elapsed = time.perf_counter() - sent
+            if name == 'create_actor' and status == 201:
+                state.created.append(json.loads(data)['created']['id'])
+            if sent < measure_from:
+                continue
+
+            route_result = results[route]
+            route_result['statuses'][str(status)] = \
+                route_result['statuses'].get(str(status), 0) + 1
+            if status is not None and status < 400:
+                route_result['latencies'].append(elapsed)
+            else:
+                route_result['errors'] += 1
+        connection.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    report = {}
+    all_latencies, all_errors = [], 0
+    for route, result in results.items():
+        report[route] = harness.summarize(result['latencies'], result['errors'],
+                                          duration)
+        report[route]['statuses'] = result['statuses']
+        all_latencies += result['latencies']
+        all_errors += result['errors']
+    return harness.summarize(all_latencies, all_errors, duration), report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--server', choices=list(harness.SERVERS), default='gunicorn')
+    parser.add_argument('--url', help='Target a running server instead; it must '
+                        'verify tokens against this run\'s JWKS stub or share '
+                        'AUTH0_JWKS_URL with it')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--cast-size', type=int, default=5)
+    parser.add_argument('--no-seed', action='store_true')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='Comma-separated operation=weight pairs. '
+                        f'Operations: {", ".join(OPERATIONS)}')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    stub = harness.JWKSStub().start()
+    tokens = stub.role_tokens()
+
+    app = create_app()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        if not args.no_seed:
+            harness.seed(args.movies, args.cast_size)
+        db.engine.dispose()
+
+    process = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = '127.0.0.1', harness.free_port()
+        process = harness.start_server(args.server, port, args.workers)
+    try:
+        state = WorkloadState(args.movies, args.movies * args.cast_size)
+        overall, routes = asyncio.run(run_workload(
+            host, port, tokens, state, weights, args.concurrency,
+            args.duration, args.warmup))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        stub.stop()
+
+    report = json.dumps({
+        'revision': harness.git_revision(),
+        'database': dialect,
+        'server': args.url or args.server,
+        'workers': None if args.url else args.workers,
+        'movies': args.movies,
+        'actors': args.movies * args.cast_size,
+        'mix': weights,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'jwks_fetches': stub.requests,
+        'overall': overall,
+        'routes': routes
+    }, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: Movie documents
+Seeds movies with a cast each, builds the movie documents read model and times
+GET /movies pages read from the movies and actors tables (MOVIE_DOCUMENTS=
+maintain) and from the documents (MOVIE_DOCUMENTS=serve), plus the cost the
+read model adds to a write (PATCH /actors/<id> with MOVIE_DOCUMENTS=off vs.
+maintain). Requests go through the Flask test client with the response cache
+off, so every one reaches the database.
+
+Usage:
+    python benchmarks/movie_documents.py --movies 100000 --cast-size 10
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/movie_documents.py
+
+The target database is dropped and recreated, never point it at real data.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.documents import rebuild_movie_documents  # noqa: E402
+from models import db  # noqa: E402
+
+
+def median_ms(client, method, paths, headers, runs, **kwargs):
+    samples = []
+    for _ in range(runs):
+        for path in paths:
+            started = time.perf_counter()
+            res = client.open(path, method=method, headers=headers, **kwargs)
+            samples.append(time.perf_counter() - started)
+            assert res.status_code == 200, res.data
+    return round(statistics.median(samples) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--cast-size', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    stub = harness.JWKSStub().start()
+    tokens = stub.role_tokens()
+    app = create_app({'RESPONSE_CACHE_BACKEND': 'none'})
+    client = app.test_client()
+    viewer = {'Authorization': f"Bearer {tokens['Casting Assistant']}"}
+    editor = {'Authorization': f"Bearer {tokens['Executive Producer']}"}
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        harness.seed(args.movies, args.cast_size)
+        started = time.perf_counter()
+        rebuild_movie_documents()
+        rebuild_s = round(time.perf_counter() - started, 2)
+
+    reads = []
+    for limit in (100, 1000):
+        paths = [f'/movies?limit={limit}',
+                 f'/movies?limit={limit}&sort=-release_date&released_after=2010-01-01']
+        result = {'limit': limit}
+        for mode in ('maintain', 'serve'):
+            app.config['MOVIE_DOCUMENTS'] = mode
+            result[f'{mode}_ms'] = median_ms(client, 'GET', paths, viewer, args.runs)
+        reads.append(result)
+
+    # Moves one actor back and forth, rewriting two documents per write.
+    writes = {}
+    for mode in ('off', 'maintain'):
+        app.config['MOVIE_DOCUMENTS'] = mode
+        samples = []
+        for run in range(args.runs):
+            samples.append(median_ms(client, 'PATCH', ['/actors/1'], editor, 1,
+                                     json={'movie_id': 1 + (run + 1) % 2}))
+        writes[f'{mode}_ms'] = round(statistics.median(samples), 2)
+    stub.stop()
+
+    print(json.dumps({
+        'revision': harness.git_revision(),
+        'database': dialect,
+        'movies': args.movies,
+        'cast_size': args.cast_size,
+        'rebuild_s': rebuild_s,
+        'get_movies': reads,
+        'patch_actor': writes
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: Search latency
+Seeds a large data set of generated movie titles and actor names and measures
+the first page of GET /actors?q= and GET /movies?q= for prefix, substring,
+misspelled and absent search terms, with the query plan of each. On Postgres
+every case also runs with index scans disabled, which is the cost of the same
+search without the trigram indexes.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/search.py --actors 1000000
+    python benchmarks/search.py --actors 1000000      # SQLite file in a temp directory
+
+The target database is dropped and recreated, never point it at real data.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from sqlalchemy import event, text  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.filters import MOVIE_SORTS, ACTOR_SORTS  # noqa: E402
+from flaskr.pagination import get_page_args, get_sort_arg, paginate  # noqa: E402
+from flaskr.search import apply_search  # noqa: E402
+from index_plans import explain  # noqa: E402
+from models import db, Movie, Actor  # noqa: E402
+
+SYLLABLES = ['al', 'an', 'ar', 'ay', 'be', 'ce', 'da', 'de', 'el', 'em', 'en',
+             'er', 'ha', 'ka', 'ke', 'la', 'le', 'li', 'ma', 'me', 'na', 'ne',
+             'ol', 'or', 'ra', 're', 'sa', 'se', 'ta', 'te', 'un', 'ya', 'yi', 'zu']
+
+# A few known rows among the generated ones.
+NEEDLES = ['Cem Yilmaz', 'Cemal Sureya', 'Ahmet Cem']
+
+CASES = [
+    ('/actors', 'cem'),            # word prefix
+    ('/actors', 'yilmaz'),         # one rare full word
+    ('/actors', 'yilmz'),          # misspelled
+    ('/actors', 'rame'),           # substring of many names
+    ('/actors', 'qqqq'),           # no match
+    ('/movies', 'dark'),
+]
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def seed(movie_count, actor_count):
+    rng = random.Random(42)
+    harness.seed(
+        movie_count, actor_count=actor_count + len(NEEDLES),
+        movie_row=lambda i: {
+            'title': f'The {word(rng)} {rng.choice(["Dark", "Road", "Sea"])}',
+            'release_date': datetime(1950 + rng.randrange(75), 1, 1)},
+        actor_row=lambda i: {
+            'name': f'{word(rng)} {word(rng)}', 'age': rng.randrange(18, 90),
+            'gender': rng.choice('MF'), 'movie_id': rng.randrange(1, movie_count + 1)}
+        if i < actor_count else
+        {'name': NEEDLES[i - actor_count], 'age': 40, 'gender': 'M', 'movie_id': 1})
+
+
+def search_query(app, path, q, runs, settings=()):
+    """
+    Runs the route's search with the app's code, after the SQL statements in
+    settings, and returns the statement of the page query, the median latency
+    and the number of rows returned.
+    """
+    model, column, sorts = {
+        '/movies': (Movie, Movie.title, MOVIE_SORTS),
+        '/actors': (Actor, Actor.name, ACTOR_SORTS),
+    }[path]
+    captured, samples = [], []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    with app.test_request_context(f'{path}?q={q}'):
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            for _ in range(runs):
+                for setting in settings:
+                    db.session.execute(text(setting))
+                started = time.perf_counter()
+                query, sortable, default_sort = apply_search(
+                    model.query, model, column, sorts)
+                sort = get_sort_arg(sortable, default_sort)
+                limit, cursor = get_page_args(sort)
+                rows, _ = paginate(query, model.id, limit, cursor, sort)
+                samples.append(time.perf_counter() - started)
+                db.session.rollback()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+    return captured[0], round(statistics.median(samples) * 1000, 2), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--actors', type=int, default=1000000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    results = []
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        seed(args.movies, args.actors)
+        for path, q in CASES:
+            (statement, parameters), ms, rows = search_query(app, path, q, args.runs)
+            plan, sequential = explain(statement, parameters)
+            result = {'request': f'GET {path}?q={q}', 'rows': rows, 'ms': ms,
+                      'sequential_scan': sequential, 'plan': plan}
+            if dialect == 'postgresql':
+                # Reverted by the rollback that ends each run.
+                result['ms_without_index'] = search_query(
+                    app, path, q, args.runs,
+                    ['SET LOCAL enable_bitmapscan = off',
+                     'SET LOCAL enable_indexscan = off'])[1]
+            results.append(result)
+
+    print(json.dumps({
+        'revision': harness.git_revision(),
+        'database': dialect,
+        'movies': args.movies,
+        'actors': args.actors,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: Serialization
+Times building a GET /movies body from N movies with three actors each, using
+the original format() + jsonify path (dicts built through map/lambda, Flask's
+default JSON provider) and the compiled serializers with FastJSONProvider.
+No database is needed; the rows are transient ORM objects.
+
+Usage:
+    python benchmarks/serialization.py --rows 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from flaskr.json_provider import FastJSONProvider, orjson  # noqa: E402
+from models import Movie, Actor  # noqa: E402
+
+
+def legacy_actor_format(actor):
+    return {
+        'id': actor.id,
+        'name': actor.name,
+        'age': actor.age,
+        'gender': actor.gender,
+        "movie_id": actor.movie_id
+    }
+
+
+def legacy_movie_format(movie):
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'release_date': movie.release_date,
+        'actors': list(map(lambda actor: legacy_actor_format(actor), movie.actors))
+    }
+
+
+def make_movies(count):
+    movies = []
+    for i in range(count):
+        movie = Movie(title=f'Movie {i}', release_date=datetime(2000 + i % 25, 1, 1))
+        movie.id = i + 1
+        cast = []
+        for j in range(3):
+            actor = Actor(name=f'Actor {i}-{j}', age=20 + j, gender='MF'[j % 2],
+                          movie_id=movie.id)
+            actor.id = i * 3 + j + 1
+            cast.append(actor)
+        movie.actors = cast
+        movies.append(movie)
+    return movies
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_app = Flask('legacy')
+    legacy_app.json = DefaultJSONProvider(legacy_app)
+    fast_app = Flask('fast')
+    fast_app.json = FastJSONProvider(fast_app)
+
+    results = []
+    for count in args.rows:
+        movies = make_movies(count)
+
+        def legacy():
+            with legacy_app.app_context():
+                body = list(map(lambda movie: legacy_movie_format(movie), movies))
+                legacy_app.json.response({"success": True, "movies": body}).get_data()
+
+        def compiled():
+            with fast_app.app_context():
+                body = list(map(lambda movie: movie.format(), movies))
+                fast_app.json.response({"success": True, "movies": body}).get_data()
+
+        legacy_s = best_of(args.repeat, legacy)
+        compiled_s = best_of(args.repeat, compiled)
+        results.append({
+            'rows': count,
+            'legacy_ms': round(legacy_s * 1000, 1),
+            'compiled_ms': round(compiled_s * 1000, 1),
+            'speedup': round(legacy_s / compiled_s, 2)
+        })
+
+    print(json.dumps({
+        'encoder': 'orjson' if orjson is not None else 'json (stdlib)',
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: Startup cost
+Measures, in fresh interpreters, the time to import flaskr, to build the app
+with create_app() and to serve the first request under gunicorn, plus the
+modules each step loads. Importing the package builds nothing; Alembic and
+python-jose are only imported by the migration commands and the first token
+verification.
+
+Usage:
+    python benchmarks/startup.py --runs 10
+
+The database in DATABASE_URL (a SQLite file in a temp directory when unset) is
+only connected to, not written.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+STEPS = {
+    'import_flaskr': 'import flaskr',
+    'create_app': 'from flaskr import create_app; create_app()'
+}
+
+MEASURE = '''
+import json, sys, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'modules': len(sys.modules),
+                  'alembic': 'alembic' in sys.modules,
+                  'jose': 'jose' in sys.modules}}))
+'''
+
+
+def measure(statement, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', MEASURE.format(statement=statement)],
+            cwd=harness.ROOT, env=os.environ, capture_output=True, text=True,
+            check=True).stdout
+        samples.append(json.loads(output))
+    result = samples[-1]
+    result['ms'] = round(statistics.median(s['ms'] for s in samples), 1)
+    return result
+
+
+def first_response_ms(runs):
+    samples = []
+    for _ in range(runs):
+        port = harness.free_port()
+        started = time.perf_counter()
+        process = harness.start_server('gunicorn', port, 1)
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').read()
+            samples.append((time.perf_counter() - started) * 1000)
+        finally:
+            process.terminate()
+            process.wait()
+    return round(statistics.median(samples), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {name: measure(statement, args.runs)
+               for name, statement in STEPS.items()}
+    results['gunicorn_first_response_ms'] = first_response_ms(args.runs)
+
+    print(json.dumps({
+        'revision': harness.git_revision(),
+        'runs': args.runs,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: Streaming exports
+Compares exporting every actor the old way (Query.all(), a list of dicts and
+one jsonify string) with the NDJSON stream served for ?stream=1. Reports peak
+Python memory, time to first byte and total time for each.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/capstone_bench python benchmarks/stream_export.py --actors 500000
+    python benchmarks/stream_export.py            # SQLite file in a temp directory
+
+The target database is dropped and recreated, never point it at real data.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+from flask import jsonify  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.streaming import stream_ndjson  # noqa: E402
+from models import db, Actor  # noqa: E402
+
+
+def seed(actor_count):
+    harness.seed(0, actor_count=actor_count, actor_row=lambda i: {
+        'name': f'Actor {i}', 'age': 18 + i % 70, 'gender': 'MF'[i % 2],
+        'movie_id': None})
+
+
+def materialized():
+    actors = Actor.query.order_by(Actor.id).all()
+    actors = list(map(lambda actor: actor.format(), actors))
+    yield jsonify({"success": True, "actors": actors}).get_data()
+
+
+def streamed():
+    yield from stream_ndjson(Actor.query.order_by(Actor.id)).response
+
+
+def measure(app, produce):
+    with app.test_request_context('/actors'):
+        db.session.expunge_all()
+        tracemalloc.start()
+        started = time.perf_counter()
+        first_byte = None
+        size = 0
+        for chunk in produce():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+        total = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        db.session.remove()
+    return {
+        'ttfb_ms': round(first_byte * 1000, 1),
+        'total_ms': round(total * 1000, 1),
+        'peak_mb': round(peak / 2 ** 20, 1),
+        'bytes': size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--actors', type=int, default=100000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        seed(args.actors)
+
+    print(json.dumps({
+        'database': dialect,
+        'actors': args.actors,
+        'batch_size': app.config['STREAM_BATCH_SIZE'],
+        'materialized': measure(app, materialized),
+        'ndjson_stream': measure(app, streamed)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
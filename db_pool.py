@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import time
+import weakref
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+'''
+Connection pool configuration
+        engine options are read from the environment:
+
+        DB_POOL_SIZE             connections kept open per process (5)
+        DB_MAX_OVERFLOW          extra connections allowed under load (10)
+        DB_POOL_TIMEOUT          seconds to wait for a free connection (30)
+        DB_POOL_RECYCLE          seconds before a connection is replaced (1800)
+        DB_POOL_PRE_PING         test connections before use (true)
+        DB_CONNECT_TIMEOUT       seconds to establish a connection (10)
+        DB_STATEMENT_TIMEOUT_MS  server side statement timeout, 0 for none (0)
+        DB_POOL_WAIT_WARN_MS     log checkouts that waited longer than this (100)
+        DB_PGBOUNCER_MODE        'transaction' when connecting through PgBouncer
+                                 in transaction pooling mode
+'''
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+'''
+TimedQueuePool
+        QueuePool that records how many checkouts happened and how long they
+        waited for a free connection
+'''
+class TimedQueuePool(QueuePool):
+
+    wait_warn_seconds = 0.1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        if waited > self.wait_warn_seconds:
+            logger.warning('Waited %.0f ms for a database connection (%s)',
+                           waited * 1000, self.status())
+        return connection
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'checked_in': self.checkedin(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 3)
+                if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3)
+            }
+
+
+def engine_options(database_path):
+    '''
+    returns SQLALCHEMY_ENGINE_OPTIONS for the given database URL
+    '''
+    url = make_url(database_path)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory SQLite shares one connection; there is no pool to tune.
+        return {}
+
+    is_postgres = url.get_backend_name() == 'postgresql'
+    pgbouncer_mode = os.environ.get('DB_PGBOUNCER_MODE', '').lower()
+    connect_args = {}
+
+    if pgbouncer_mode == 'transaction':
+        # PgBouncer owns the pool: every checkout opens a client connection to
+        # PgBouncer, which is cheap, and returns it at the end of the
+        # transaction. Startup parameters such as statement_timeout are
+        # rejected by PgBouncer, and pre-ping and recycling are meaningless
+        # without a local pool.
+        options = {'poolclass': NullPool}
+    else:
+        TimedQueuePool.wait_warn_seconds = \
+            float(os.environ.get('DB_POOL_WAIT_WARN_MS', 100)) / 1000
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+        }
+        statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+        if is_postgres and statement_timeout:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+
+    if is_postgres:
+        connect_args['connect_timeout'] = int(os.environ.get('DB_CONNECT_TIMEOUT', 10))
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+# Async drivers used by the ASGI entry point (flaskr/asgi.py)
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+
+def async_url(database_path):
+    '''
+    returns the database URL with the backend's async driver
+    '''
+    url = make_url(database_path)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def async_engine_options(database_path):
+    '''
+    returns create_async_engine() options equivalent to engine_options().
+    asyncpg takes its timeouts as 'timeout' and 'server_settings' rather than
+    libpq connection parameters
+    '''
+    options = engine_options(database_path)
+    if options.get('poolclass') is TimedQueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+
+    connect_args = options.pop('connect_args', {})
+    async_connect_args = {}
+    if 'connect_timeout' in connect_args:
+        async_connect_args['timeout'] = connect_args['connect_timeout']
+    if 'options' in connect_args:
+        statement_timeout = connect_args['options'].rpartition('=')[2]
+        async_connect_args['server_settings'] = {
+            'statement_timeout': statement_timeout}
+    if make_url(database_path).get_backend_name() == 'postgresql' and \
+            os.environ.get('DB_PGBOUNCER_MODE', '').lower() == 'transaction':
+        # Prepared statements do not survive PgBouncer switching server
+        # connections between transactions.
+        async_connect_args['statement_cache_size'] = 0
+    if async_connect_args:
+        options['connect_args'] = async_connect_args
+    return options
+
+
+'''
+Fork safety
+        connections must not be shared between a parent process and its
+        forked children. Every engine created by setup_db is tracked, and a
+        child drops the pools it inherited (without closing the parent's
+        sockets) so that it opens its own connections
+'''
+_engines = weakref.WeakSet()
+
+
+def track_engine(engine):
+    _engines.add(engine)
+
+
+def reset_pools():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+def pool_stats(engine):
+    '''
+    returns checkout and wait statistics of an engine's pool, or just its
+    class name for pools that do not record them
+    '''
+    stats = {'pool': type(engine.pool).__name__}
+    if isinstance(engine.pool, TimedQueuePool):
+        stats.update(engine.pool.stats())
+    return stats
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_pools)
@@ -2,11 +2,37 @@ import os
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from models import setup_db, Movie, Actor
-from auth.auth import AuthError, requires_auth
+from sqlalchemy import delete
+from sqlalchemy.orm import joinedload
+from models import setup_db, db, Movie, Actor, ACTOR_POLICIES, DOCUMENT_MODES
+from db_pool import pool_stats
+from metrics import init_metrics, metrics_response, serialization_timer
+from auth.auth import AuthError, requires_auth, init_auth
+from flaskr.pagination import get_page_args, get_sort_arg, paginate, sort_order, \
+    read_page
+from flaskr.streaming import wants_stream, stream_ndjson
+from flaskr.json_provider import FastJSONProvider
+from flaskr.fields import get_movie_fields, get_actor_fields, \
+    movie_load_options, actor_load_options
+from flaskr.filters import MOVIE_SORTS, ACTOR_SORTS, filter_movies, filter_actors
+from flaskr.etag import conditional_get
+from flaskr.cache import init_response_cache, cached_response
+from flaskr.batch import run_batch
+from flaskr.idempotency import idempotent
+from flaskr.replicas import init_replicas, read_replica
+from flaskr.search import get_search_arg, apply_search, search_page
+from flaskr.stats import movie_stats, actor_stats
+from flaskr.documents import documents_cli, serves_documents, \
+    movie_documents_query, movie_documents_response
+from flaskr.bulk import get_bulk_items, validate_all, validate_movie, \
+    validate_actor, check_movies_exist, invalid_items_response
 from datetime import datetime
 
 
+# Response key of the number of actors a movie delete affected, per policy.
+ACTOR_COUNT_KEYS = {'detach': 'actors_detached', 'cascade': 'actors_deleted'}
+
+
 """
 Function: create_app
 Purpose: Creates and configures the Flask application, including database setup,
@@ -16,7 +42,10 @@ Parameters:
 Returns: The configured Flask app instance.
 Setup:
     - Initializes the Flask app.
-    - Sets up the database connection, including the test configuration if provided.
+    - Reads the configuration from the environment, overridden by test_config
+      if provided (e.g. DATABASE_URL or SQLALCHEMY_DATABASE_URI, AUTH0_JWKS_URL).
+    - Sets up the database connection, the read replicas listed in
+      DATABASE_REPLICA_URLS (comma-separated) and token verification from it.
     - Configures CORS to allow cross-origin requests from specified origins.
     - Applies middleware for setting CORS headers after every request.
 """
@@ -24,7 +53,61 @@ Setup:
 def create_app(test_config=None):
     # Create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.json = FastJSONProvider(app)
+    app.config.from_mapping(
+        PAGE_SIZE=int(os.environ.get('PAGE_SIZE', 100)),
+        MAX_PAGE_SIZE=int(os.environ.get('MAX_PAGE_SIZE', 1000)),
+        MAX_BULK_SIZE=int(os.environ.get('MAX_BULK_SIZE', 1000)),
+        MAX_BATCH_SIZE=int(os.environ.get('MAX_BATCH_SIZE', 1000)),
+        MOVIE_DELETE_ACTORS=os.environ.get('MOVIE_DELETE_ACTORS', 'detach'),
+        MOVIE_DOCUMENTS=os.environ.get('MOVIE_DOCUMENTS', 'off'),
+        IDEMPOTENCY_KEY_TTL=float(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400)),
+        IDEMPOTENCY_MAX_KEYS=int(os.environ.get('IDEMPOTENCY_MAX_KEYS', 100000)),
+        IDEMPOTENCY_PRUNE_INTERVAL=float(
+            os.environ.get('IDEMPOTENCY_PRUNE_INTERVAL', 60)),
+        IDEMPOTENCY_WAIT=float(os.environ.get('IDEMPOTENCY_WAIT', 5)),
+        RESPONSE_CACHE_BACKEND=os.environ.get('RESPONSE_CACHE_BACKEND', 'local'),
+        RESPONSE_CACHE_TTL=float(os.environ.get('RESPONSE_CACHE_TTL', 30)),
+        RESPONSE_CACHE_SIZE=int(os.environ.get('RESPONSE_CACHE_SIZE', 512)),
+        REDIS_URL=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+        STREAM_BATCH_SIZE=int(os.environ.get('STREAM_BATCH_SIZE', 1000)),
+        ASGI_WSGI_THREADS=int(os.environ.get('ASGI_WSGI_THREADS', 16)),
+        DATABASE_URL=os.environ.get('DATABASE_URL'),
+        DATABASE_REPLICA_URLS=os.environ.get('DATABASE_REPLICA_URLS', ''),
+        REPLICA_STICKY_SECONDS=float(os.environ.get('REPLICA_STICKY_SECONDS', 5)),
+        REPLICA_STICKY_BACKEND=os.environ.get('REPLICA_STICKY_BACKEND', 'local'),
+        REPLICA_RETRY_INTERVAL=float(os.environ.get('REPLICA_RETRY_INTERVAL', 30)),
+        AUTH0_DOMAIN=os.environ.get('AUTH0_DOMAIN'),
+        ALGORITHMS=os.environ.get('ALGORITHMS', 'RS256'),
+        API_AUDIENCE=os.environ.get('API_AUDIENCE'),
+        AUTH0_JWKS_URL=os.environ.get('AUTH0_JWKS_URL'),
+        JWKS_CACHE_TTL=float(os.environ.get('JWKS_CACHE_TTL', 600)),
+        JWKS_MIN_REFRESH_INTERVAL=float(
+            os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30)),
+        TOKEN_CACHE_SIZE=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)))
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    if app.config['MOVIE_DELETE_ACTORS'] not in ACTOR_POLICIES:
+        raise ValueError('MOVIE_DELETE_ACTORS must be one of '
+                         + ', '.join(ACTOR_POLICIES))
+    if app.config['MOVIE_DOCUMENTS'] not in DOCUMENT_MODES:
+        raise ValueError('MOVIE_DOCUMENTS must be one of '
+                         + ', '.join(DOCUMENT_MODES))
+
+    database_path = app.config.get('SQLALCHEMY_DATABASE_URI') or \
+        app.config['DATABASE_URL']
+    if not database_path:
+        raise RuntimeError('DATABASE_URL is not set')
+    replica_paths = [path.strip() for path in
+                     app.config['DATABASE_REPLICA_URLS'].split(',') if path.strip()]
+    setup_db(app, database_path, replica_paths)
+    app.cli.add_command(documents_cli)
+    init_replicas(app)
+    init_auth(app)
+    init_response_cache(app)
+    with app.app_context():
+        init_metrics(app, [*db.engines.values(), *app.extensions['replica_engines']])
 
     CORS(app)
 
@@ -58,26 +141,102 @@ def create_app(test_config=None):
         except Exception as e:
             abort(500, str(e))
             
+    """
+    Database Pool Health
+    Path: /health/db
+    Method: GET
+    Description: Reports this worker's connection pool usage: size, connections checked
+                 out, overflow, number of checkouts, timeouts and the average and
+                 maximum time spent waiting for a connection.
+    Response: JSON object with a success status and the pool statistics, plus those of
+              each read replica and whether it is in use (null without replicas).
+    """
+    @app.route('/health/db')
+    def database_pool_health():
+        replicas = app.extensions['replicas']
+        return jsonify({
+            "success": True,
+            "pid": os.getpid(),
+            "pool": pool_stats(db.engine),
+            "replicas": replicas.status() if replicas is not None else None
+        })
+
+    """
+    Metrics
+    Path: /metrics
+    Method: GET
+    Description: Request latency per route, SQL statements and time per request, and
+                 JWKS fetch, JWT verification and serialization timings, aggregated
+                 over all workers when PROMETHEUS_MULTIPROC_DIR is set.
+    Response: Prometheus text exposition format.
+    """
+    @app.route('/metrics')
+    def metrics():
+        return metrics_response()
+
     """
     Retrieve All Movies
     Path: /movies
     Method: GET
     Authorization: view:movies permission required.
-    Description: Retrieves a list of all movies in the database. Each movie is formatted as a 
+    Description: Retrieves one page of movies ordered by id. Each movie is formatted as a 
                  dictionary containing its details.
-    Response: JSON object with a success status and a list of movies.
+    Query Parameters:
+        - limit: Page size (default PAGE_SIZE, capped at MAX_PAGE_SIZE).
+        - after: Cursor returned as next_cursor by the previous page.
+        - released_after, released_before: Inclusive ISO 8601 release date bounds.
+        - q: Search text (3 to 100 characters) matched against titles; see GET /search.
+        - sort: id, title or release_date, or relevance (the default while searching);
+          prefix with '-' for descending order.
+        - stream=1 (or Accept: application/x-ndjson): Stream every matching movie
+          as newline-delimited JSON instead of one page.
+        - fields: Comma-separated fields to return, e.g. id,title,actors.name. Only
+          those columns are selected, and the cast is not loaded unless requested.
+    Response: JSON object with a success status, a list of movies and the cursor of the
+              next page (null on the last page). Tagged with an ETag; a matching
+              If-None-Match is answered with 304 Not Modified. Served from the
+              response cache until movies or actors change. Read from a replica
+              when DATABASE_REPLICA_URLS is set. With MOVIE_DOCUMENTS=serve, pages
+              without q, fields or stream are read from the movie documents.
 
     """
     @app.route('/movies', methods=['GET'])
     @requires_auth('view:movies')
+    @read_replica
+    @conditional_get('movies', 'actors')
+    @cached_response('movies', 'actors')
     def retrieve_movies(payload):
+        if serves_documents():
+            queries, limit, sort = movie_documents_query()
+            try:
+                rows = read_page(lambda q: db.session.execute(q).all(),
+                                 queries, limit)
+                return movie_documents_response(rows, limit, sort)
+            except Exception as e:
+                abort(500, str(e))
+
+        query, sorts, default_sort = apply_search(
+            filter_movies(Movie.query), Movie, Movie.title, MOVIE_SORTS)
+        sort = get_sort_arg(sorts, default_sort)
+        fields = get_movie_fields()
+        # Only the requested columns are selected; when the cast is requested,
+        # selectin loads it for a whole page (or stream batch) in one extra
+        # query instead of one lazy load per movie.
+        query = query.options(*movie_load_options(fields, sort[1]))
+        if wants_stream():
+            return stream_ndjson(query.order_by(*sort_order(Movie.id, sort)),
+                                 fields)
+
+        limit, cursor = get_page_args(sort)
         try:
-            movies = Movie.query.all()
-            movies = list(map(lambda movie: movie.format(), movies))
-            return jsonify({
-                "success": True,
-                "movies": movies
-            })
+            movies, next_cursor = paginate(query, Movie.id, limit, cursor, sort)
+            with serialization_timer():
+                movies = list(map(lambda movie: movie.format(fields), movies))
+                return jsonify({
+                    "success": True,
+                    "movies": movies,
+                    "next_cursor": next_cursor
+                })
         except Exception as e:
             abort(500, str(e))
 
@@ -86,34 +245,225 @@ def create_app(test_config=None):
     Path: /actors
     Method: GET
     Authorization: view:actors permission required.
-    Description: Retrieves a list of all actors in the database. Each actor is formatted as a
+    Description: Retrieves one page of actors ordered by id. Each actor is formatted as a
                  dictionary containing their details.
-    Response: JSON object with a success status and a list of actors.
+    Query Parameters:
+        - limit: Page size (default PAGE_SIZE, capped at MAX_PAGE_SIZE).
+        - after: Cursor returned as next_cursor by the previous page.
+        - movie_id, gender: Exact matches.
+        - min_age, max_age: Inclusive age bounds.
+        - q: Search text (3 to 100 characters) matched against names; see GET /search.
+        - sort: id, name or age, or relevance (the default while searching); prefix
+          with '-' for descending order.
+        - stream=1 (or Accept: application/x-ndjson): Stream every matching actor
+          as newline-delimited JSON instead of one page.
+        - fields: Comma-separated fields to return, e.g. id,name. Only those
+          columns are selected.
+    Response: JSON object with a success status, a list of actors and the cursor of the
+              next page (null on the last page). Tagged with an ETag; a matching
+              If-None-Match is answered with 304 Not Modified. Served from the
+              response cache until actors change. Read from a replica when
+              DATABASE_REPLICA_URLS is set.
     """
     @app.route('/actors', methods=['GET'])
     @requires_auth('view:actors')
+    @read_replica
+    @conditional_get('actors')
+    @cached_response('actors')
     def retrieve_actors(payload):
+        query, sorts, default_sort = apply_search(
+            filter_actors(Actor.query), Actor, Actor.name, ACTOR_SORTS)
+        sort = get_sort_arg(sorts, default_sort)
+        fields = get_actor_fields()
+        query = query.options(*actor_load_options(fields, sort[1]))
+        if wants_stream():
+            return stream_ndjson(query.order_by(*sort_order(Actor.id, sort)),
+                                 fields)
+
+        limit, cursor = get_page_args(sort)
+        try:
+            actors, next_cursor = paginate(query, Actor.id, limit, cursor, sort)
+            with serialization_timer():
+                actors = list(map(lambda actor: actor.format(fields), actors))
+                return jsonify({
+                    "success": True,
+                    "actors": actors,
+                    "next_cursor": next_cursor
+                })
+        except Exception as e:
+            abort(500, str(e))
+    
+    """
+    Search Movies and Actors
+    Path: /search
+    Method: GET
+    Authorization: view:movies and/or view:actors; only the resources the caller may view
+                   are searched.
+    Description: Finds movies whose title and actors whose name contain the search text or,
+                 on Postgres, a word similar to it (typos included), using trigram indexes.
+                 Results are ranked by relevance, then id.
+    Query Parameters:
+        - q: Search text, 3 to 100 characters (required).
+        - limit: Results per resource (default PAGE_SIZE, capped at MAX_PAGE_SIZE).
+    Response: JSON object with a success status, the first page of movies and of actors,
+              and in next_cursors the cursor of each resource's next page, to be passed
+              as after= to GET /movies?q= or GET /actors?q= with the same q.
+    """
+    @app.route('/search', methods=['GET'])
+    @requires_auth(None)
+    @read_replica
+    @conditional_get('movies', 'actors')
+    @cached_response('movies', 'actors')
+    def search_all(payload):
+        get_search_arg(required=True)
+        permissions = payload.get('permissions', [])
+        searched = [(name, model, column, options)
+                    for name, model, column, options in (
+                        ('movies', Movie, Movie.title, movie_load_options(None)),
+                        ('actors', Actor, Actor.name, actor_load_options(None)))
+                    if f'view:{name}' in permissions]
+        if not searched:
+            raise AuthError({
+                'code': 'unauthorized',
+                'description': 'Permission not found.'
+            }, 403)
+
+        limit, _ = get_page_args()
+        try:
+            results = {"success": True, "next_cursors": {}}
+            for name, model, column, options in searched:
+                rows, results["next_cursors"][name] = \
+                    search_page(model, column, limit, options)
+                results[name] = [row.format() for row in rows]
+            return jsonify(results)
+        except Exception as e:
+            abort(500, str(e))
+
+    """
+    Movie Statistics
+    Path: /stats/movies
+    Method: GET
+    Authorization: view:movies permission required.
+    Description: Aggregates the cast of each movie in the database (GROUP BY over
+                 actors.movie_id), in one query per page.
+    Query Parameters:
+        - limit: Page size (default PAGE_SIZE, capped at MAX_PAGE_SIZE).
+        - after: Cursor returned as next_cursor by the previous page.
+        - released_after, released_before: Inclusive ISO 8601 release date bounds.
+    Response: JSON object with a success status, a list of movies in id order with their
+              cast_size, genders (actors per gender) and ages (min, max, average), and
+              the cursor of the next page. Served from the response cache until movies
+              or actors change. Read from a replica when DATABASE_REPLICA_URLS is set.
+    """
+    @app.route('/stats/movies', methods=['GET'])
+    @requires_auth('view:movies')
+    @read_replica
+    @conditional_get('movies', 'actors')
+    @cached_response('movies', 'actors')
+    def movie_statistics(payload):
+        limit, cursor = get_page_args()
         try:
-            actors = Actor.query.all()
-            actors = list(map(lambda actor: actor.format(), actors))
+            movies, next_cursor = movie_stats(limit, cursor)
             return jsonify({
                 "success": True,
-                "actors": actors
+                "movies": movies,
+                "next_cursor": next_cursor
             })
         except Exception as e:
             abort(500, str(e))
-    
+
+    """
+    Actor Statistics
+    Path: /stats/actors
+    Method: GET
+    Authorization: view:actors permission required.
+    Description: Aggregates all actors, or the casts of the movies released in the window,
+                 in the database with two GROUP BY queries.
+    Query Parameters:
+        - released_after, released_before: Inclusive ISO 8601 release date bounds of
+          the movies whose casts are counted.
+    Response: JSON object with a success status, the number of actors, their genders,
+              ages (min, max, average and actors per decade), the number of movies
+              and cast_sizes (movies per cast size). Served from the response cache
+              until movies or actors change. Read from a replica when
+              DATABASE_REPLICA_URLS is set.
+    """
+    @app.route('/stats/actors', methods=['GET'])
+    @requires_auth('view:actors')
+    @read_replica
+    @conditional_get('movies', 'actors')
+    @cached_response('movies', 'actors')
+    def actor_statistics(payload):
+        try:
+            return jsonify({"success": True, **actor_stats()})
+        except Exception as e:
+            abort(500, str(e))
+
+    """
+    Retrieve a Movie
+    Path: /movies/<int:movie_id>
+    Method: GET
+    Authorization: view:movies permission required.
+    Description: Retrieves a single movie and its cast.
+    Response: JSON object with a success status and the movie's details. Tagged with an
+              ETag; a matching If-None-Match is answered with 304 Not Modified. Read
+              from a replica when DATABASE_REPLICA_URLS is set.
+    """
+    @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @requires_auth('view:movies')
+    @read_replica
+    @conditional_get('movies', 'actors')
+    def retrieve_movie(payload, movie_id):
+        movie = Movie.query.options(joinedload(Movie.actors)) \
+            .filter(Movie.id == movie_id).one_or_none()
+
+        if not movie:
+            abort(404, f"Movie with id {movie_id} not found")
+
+        return jsonify({
+            "success": True,
+            "movie": movie.format()
+        })
+
+    """
+    Retrieve an Actor
+    Path: /actors/<int:actor_id>
+    Method: GET
+    Authorization: view:actors permission required.
+    Description: Retrieves a single actor.
+    Response: JSON object with a success status and the actor's details. Tagged with an
+              ETag; a matching If-None-Match is answered with 304 Not Modified. Read
+              from a replica when DATABASE_REPLICA_URLS is set.
+    """
+    @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @requires_auth('view:actors')
+    @read_replica
+    @conditional_get('actors')
+    def retrieve_actor(payload, actor_id):
+        actor = db.session.get(Actor, actor_id)
+
+        if not actor:
+            abort(404, f"Actor with id {actor_id} not found")
+
+        return jsonify({
+            "success": True,
+            "actor": actor.format()
+        })
+
     """
     Create a New Movie
     Path: /movies
     Method: POST
     Authorization: post:movies permission required.
     Description: Creates a new movie in the database. The request must include the movie's title and release date.
+                 Honours an Idempotency-Key header: a retry with the same key replays the first
+                 response instead of creating another movie.
     Request Body: JSON object with title and release_date.
     Response: JSON object with a success status and the created movie's details.
     """
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @idempotent
     def create_movie(payload):
         try:
             body = request.get_json()
@@ -143,12 +493,13 @@ def create_app(test_config=None):
     Method: POST
     Authorization: post:actors permission required.
     Description: Creates a new actor in the database. The request must include the actor's name, age, gender, and
-                 associated movie ID.
+                 associated movie ID. Honours an Idempotency-Key header like POST /movies.
     Request Body: JSON object with name, age, gender, and movie_id.
     Response: JSON object with a success status and the created actor's details.
     """
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @idempotent
     def create_actor(payload):
         try:
             body = request.get_json()
@@ -174,58 +525,175 @@ def create_app(test_config=None):
         except Exception as e:
             abort(500, str(e))
 
+    """
+    Bulk Create Movies
+    Path: /movies/bulk
+    Method: POST
+    Authorization: post:movies permission required.
+    Description: Creates up to MAX_BULK_SIZE movies in one transaction. Every record is
+                 validated first; if any is invalid nothing is created.
+    Request Body: JSON array of objects with title and release_date (YYYY-MM-DD).
+    Response: JSON object with a success status and the created ids in request order, or
+              a 422 listing the index and message of each invalid record.
+    """
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies')
+    def create_movies_bulk(payload):
+        items = get_bulk_items()
+        rows, errors = validate_all(items, validate_movie)
+        if errors:
+            return invalid_items_response(errors)
+
+        try:
+            ids = Movie.bulk_insert(rows)
+
+            return jsonify({
+                "success": True,
+                "created": ids
+            }), 201
+        except Exception as e:
+            abort(500, str(e))
+
+    """
+    Bulk Create Actors
+    Path: /actors/bulk
+    Method: POST
+    Authorization: post:actors permission required.
+    Description: Creates up to MAX_BULK_SIZE actors in one transaction. Every record is
+                 validated, and every movie_id checked to exist, before anything is
+                 written; if any record is invalid nothing is created.
+    Request Body: JSON array of objects with name, age, gender, and movie_id.
+    Response: JSON object with a success status and the created ids in request order, or
+              a 422 listing the index and message of each invalid record.
+    """
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors')
+    def create_actors_bulk(payload):
+        items = get_bulk_items()
+        rows, errors = validate_all(items, validate_actor)
+        if not errors:
+            errors = check_movies_exist(rows)
+        if errors:
+            return invalid_items_response(errors)
+
+        try:
+            ids = Actor.bulk_insert(rows)
+
+            return jsonify({
+                "success": True,
+                "created": ids
+            }), 201
+        except Exception as e:
+            abort(500, str(e))
+
+    """
+    Batch Operations
+    Path: /batch
+    Method: POST
+    Authorization: the permission of each operation (post:, update: or delete: on movies or
+                   actors); if any is missing nothing is applied.
+    Description: Applies up to MAX_BATCH_SIZE create, update and delete operations on movies
+                 and actors in one transaction, in order. Every operation is validated and
+                 authorized before anything is written; if any fails, nothing is applied.
+    Request Body: JSON array of operations, e.g.
+                  {"op": "create", "resource": "actors", "data": {...}},
+                  {"op": "update", "resource": "actors", "id": 4, "data": {"movie_id": 2}},
+                  {"op": "delete", "resource": "movies", "id": 3}.
+    Response: JSON object with a success status and one result per operation, in request
+              order, or a 422 (invalid), 403 (not permitted) or 404 (missing record) listing
+              the index and message of each rejected operation.
+    """
+    @app.route('/batch', methods=['POST'])
+    @requires_auth(None)
+    def apply_batch(payload):
+        return run_batch(payload)
+
     """
     Delete a Movie
     Path: /movies/<int:movie_id>
     Method: DELETE
     Authorization: delete:movies permission required.
-    Description: Deletes a movie from the database based on the provided movie ID.
-    Response: JSON object with a success status and the ID of the deleted movie.
+    Description: Deletes a movie from the database based on the provided movie ID, with a
+                 single DELETE ... RETURNING. Its actors are handled by MOVIE_DELETE_ACTORS:
+                 'detach' (default) sets their movie_id to null, 'cascade' deletes them and
+                 'reject' refuses to delete a movie that still has actors (409).
+    Response: JSON object with a success status, the ID of the deleted movie and the number
+              of actors detached (actors_detached) or deleted (actors_deleted); neither
+              under 'reject'.
     """
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
     def delete_movie(payload, movie_id):
+        policy = app.config['MOVIE_DELETE_ACTORS']
         try:
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-
-            if not movie:
-                abort(404, f"Movie with id {movie_id} not found")
-
-            movie.delete()
-
-            return jsonify({
-                "success": True,
-                "deleted": movie_id
-            })
+            deleted, actor_count = Movie.delete_by_id(movie_id, policy)
         except Exception as e:
             abort(500, str(e))
 
+        if not deleted and actor_count:
+            abort(409, f"Movie with id {movie_id} still has {actor_count} actor(s)")
+        if not deleted:
+            abort(404, f"Movie with id {movie_id} not found")
+
+        result = {"success": True, "deleted": movie_id}
+        # Under 'reject' only a movie without actors is deleted.
+        if policy in ACTOR_COUNT_KEYS:
+            result[ACTOR_COUNT_KEYS[policy]] = actor_count
+        return jsonify(result)
+
     """
     Delete an Actor
     Path: /actors/<int:actor_id>
     Method: DELETE
     Authorization: delete:actors permission required.
-    Description: Deletes an actor from the database based on the provided actor ID.
+    Description: Deletes an actor from the database based on the provided actor ID, with a
+                 single DELETE ... RETURNING.
     Response: JSON object with a success status and the ID of the deleted actor.
     """
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
     def delete_actor(payload, actor_id):
         try:
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+            deleted = Actor.delete_where(Actor.id == actor_id)
+        except Exception as e:
+            abort(500, str(e))
 
-            if not actor:
-                abort(404, f"Actor with id {actor_id} not found")
+        if not deleted:
+            abort(404, f"Actor with id {actor_id} not found")
 
-            actor.delete()
+        return jsonify({
+            "success": True,
+            "deleted": actor_id
+        })
 
-            return jsonify({
-                "success": True,
-                "deleted": actor_id
-            })
+    """
+    Delete Actors by Filter
+    Path: /actors
+    Method: DELETE
+    Authorization: delete:actors permission required.
+    Description: Deletes every actor matching the GET /actors filters (movie_id, gender,
+                 min_age, max_age) with a single DELETE ... RETURNING, whatever the number
+                 of rows. At least one filter is required.
+    Response: JSON object with a success status, the IDs of the deleted actors and their count.
+    """
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors(payload):
+        statement = filter_actors(delete(Actor))
+        if statement.whereclause is None:
+            abort(400, "At least one filter (movie_id, gender, min_age, max_age) is required")
+
+        try:
+            deleted = Actor.delete_where(statement.whereclause)
         except Exception as e:
             abort(500, str(e))
 
+        return jsonify({
+            "success": True,
+            "deleted": deleted,
+            "total": len(deleted)
+        })
+
     """
     Update a Movie
     Path: /movies/<int:movie_id>
@@ -259,6 +727,9 @@ def create_app(test_config=None):
                 movie.release_date = release_date
 
             movie.update()
+            # The commit expired the movie; reload it and its cast in one joined query.
+            movie = Movie.query.options(joinedload(Movie.actors)) \
+                .filter(Movie.id == movie_id).one()
 
             return jsonify({
                 "success": True,
@@ -322,6 +793,9 @@ def create_app(test_config=None):
     404 - Not Found: Triggered when a resource (movie or actor) is not found in the database.
     Response: JSON object with an error code (404) and a description of the issue.
 
+    409 - Conflict: Triggered when a movie that still has actors is deleted under the 'reject' policy.
+    Response: JSON object with an error code (409) and a description of the issue.
+
     422 - Unprocessable Entity: Triggered when the server is unable to process the request.
     Response: JSON object with an error code (422) and a description of the issue.
 
@@ -347,6 +821,14 @@ def create_app(test_config=None):
             "message": str(error.description)
         }), 404
 
+    @app.errorhandler(409)
+    def conflict(error):
+        return jsonify({
+            "success": False,
+            "error": 409,
+            "message": str(error.description)
+        }), 409
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -373,7 +855,6 @@ def create_app(test_config=None):
 
     return app
 
-APP = create_app()
 
 if __name__ == '__main__':
-    APP.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
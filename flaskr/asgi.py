@@ -0,0 +1,346 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, abort, jsonify
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from models import Movie, Actor
+from auth.auth import requires_auth_async
+from metrics import instrument_engine, serialization_timer
+from flaskr import create_app
+from flaskr.async_db import init_async_db, get_async_session, close_async_session
+from flaskr.pagination import get_page_args, get_sort_arg, page_queries, \
+    read_page_async, page_result
+from flaskr.streaming import wants_stream
+from flaskr.fields import get_movie_fields, get_actor_fields, \
+    movie_load_options, actor_load_options
+from flaskr.filters import MOVIE_SORTS, ACTOR_SORTS, filter_movies, filter_actors
+from flaskr.etag import conditional_get_async
+from flaskr.cache import cached_response_async
+from flaskr.replicas import read_replica_async
+from flaskr.search import apply_search
+from flaskr.documents import serves_documents, movie_documents_query, \
+    movie_documents_response
+
+
+"""
+ASGI Entry Point
+Serves the same routes as the Flask app under an ASGI server:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+
+The read routes (GET /movies, /actors, /movies/<id> and /actors/<id>) run as
+coroutines: the token is checked with requires_auth_async(), the data is read
+through an AsyncSession, and a request waiting on the database or a JWKS fetch
+does not hold a thread, so one worker can serve many of them at once. Like the
+Flask views, they read from a replica when DATABASE_REPLICA_URLS is set. Routing,
+query parameter parsing, error handlers and the after_request hooks are the
+Flask app's own, so responses are identical to the WSGI deployment.
+
+Every other request (writes, streaming exports, health checks) is passed to the
+Flask app unchanged and runs on a pool of ASGI_WSGI_THREADS threads.
+"""
+
+
+"""
+Async Read Routes
+Coroutine versions of the Flask views with the same endpoint names. See the
+Flask views in flaskr/__init__.py for their documentation.
+"""
+
+async def _fetch_scalars(statement):
+    return (await get_async_session().scalars(statement)).all()
+
+
+async def _fetch_rows(statement):
+    return (await get_async_session().execute(statement)).all()
+
+
+@requires_auth_async('view:movies')
+@read_replica_async
+@conditional_get_async('movies', 'actors')
+@cached_response_async('movies', 'actors')
+async def retrieve_movies(payload):
+    if serves_documents():
+        queries, limit, sort = movie_documents_query()
+        try:
+            rows = await read_page_async(_fetch_rows, queries, limit)
+            return movie_documents_response(rows, limit, sort)
+        except Exception as e:
+            abort(500, str(e))
+
+    query, sorts, default_sort = apply_search(
+        filter_movies(select(Movie)), Movie, Movie.title, MOVIE_SORTS)
+    sort = get_sort_arg(sorts, default_sort)
+    fields = get_movie_fields()
+    query = query.options(*movie_load_options(fields, sort[1]))
+
+    limit, cursor = get_page_args(sort)
+    try:
+        rows = await read_page_async(
+            _fetch_scalars, page_queries(query, Movie.id, cursor, sort), limit)
+        movies, next_cursor = page_result(rows, Movie.id, limit, sort)
+        with serialization_timer():
+            movies = list(map(lambda movie: movie.format(fields), movies))
+            return jsonify({
+                "success": True,
+                "movies": movies,
+                "next_cursor": next_cursor
+            })
+    except Exception as e:
+        abort(500, str(e))
+
+
+@requires_auth_async('view:actors')
+@read_replica_async
+@conditional_get_async('actors')
+@cached_response_async('actors')
+async def retrieve_actors(payload):
+    query, sorts, default_sort = apply_search(
+        filter_actors(select(Actor)), Actor, Actor.name, ACTOR_SORTS)
+    sort = get_sort_arg(sorts, default_sort)
+    fields = get_actor_fields()
+    query = query.options(*actor_load_options(fields, sort[1]))
+
+    limit, cursor = get_page_args(sort)
+    try:
+        rows = await read_page_async(
+            _fetch_scalars, page_queries(query, Actor.id, cursor, sort), limit)
+        actors, next_cursor = page_result(rows, Actor.id, limit, sort)
+        with serialization_timer():
+            actors = list(map(lambda actor: actor.format(fields), actors))
+            return jsonify({
+                "success": True,
+                "actors": actors,
+                "next_cursor": next_cursor
+            })
+    except Exception as e:
+        abort(500, str(e))
+
+
+@requires_auth_async('view:movies')
+@read_replica_async
+@conditional_get_async('movies', 'actors')
+async def retrieve_movie(payload, movie_id):
+    result = await get_async_session().scalars(
+        select(Movie).options(joinedload(Movie.actors))
+        .where(Movie.id == movie_id))
+    movie = result.unique().one_or_none()
+
+    if not movie:
+        abort(404, f"Movie with id {movie_id} not found")
+
+    return jsonify({
+        "success": True,
+        "movie": movie.format()
+    })
+
+
+@requires_auth_async('view:actors')
+@read_replica_async
+@conditional_get_async('actors')
+async def retrieve_actor(payload, actor_id):
+    actor = await get_async_session().get(Actor, actor_id)
+
+    if not actor:
+        abort(404, f"Actor with id {actor_id} not found")
+
+    return jsonify({
+        "success": True,
+        "actor": actor.format()
+    })
+
+
+ASYNC_VIEWS = {
+    'retrieve_movies': retrieve_movies,
+    'retrieve_actors': retrieve_actors,
+    'retrieve_movie': retrieve_movie,
+    'retrieve_actor': retrieve_actor
+}
+
+
+def build_environ(scope, body):
+    """
+    WSGI environ for an ASGI HTTP scope.
+    """
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+def _status_code(status):
+    return int(status.split(' ', 1)[0])
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin1'), value.encode('latin1'))
+            for name, value in headers]
+
+
+class AsyncApp:
+    """
+    ASGI application serving a Flask app, with coroutine read routes.
+
+    Args:
+        app: The Flask app from create_app().
+        wsgi_threads (int): Threads running the requests passed to the Flask app.
+    """
+    def __init__(self, app, wsgi_threads=16):
+        self.app = app
+        self.engine = init_async_db(app)
+        for engine in [self.engine, *app.extensions['async_replica_engines'].values()]:
+            instrument_engine(engine.sync_engine)
+        self.executor = ThreadPoolExecutor(max_workers=wsgi_threads,
+                                           thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        if scope['method'] == 'GET':
+            environ = build_environ(scope, io.BytesIO())
+            ctx = self.app.request_context(environ)
+            ctx.push()
+            try:
+                rule = request.url_rule
+                view = ASYNC_VIEWS.get(rule.endpoint) if rule else None
+                if view is not None and not wants_stream():
+                    response = await self._dispatch(view)
+                    return await self._send(response, environ, send)
+            finally:
+                ctx.pop()
+
+        await self._call_wsgi(scope, receive, send)
+
+    async def _dispatch(self, view):
+        """
+        Flask's full_dispatch_request() around a coroutine view.
+        """
+        try:
+            try:
+                rv = self.app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = self.app.handle_user_exception(e)
+            finally:
+                await close_async_session()
+            return self.app.finalize_request(rv)
+        except Exception as e:
+            return self.app.handle_exception(e)
+
+    async def _send(self, response, environ, send):
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        try:
+            body = b''.join(app_iter)
+        finally:
+            response.close()
+        await send({'type': 'http.response.start',
+                    'status': _status_code(status),
+                    'headers': _encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _call_wsgi(self, scope, receive, send):
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        # The body is fully buffered, so its length is known even when the
+        # client sent it chunked.
+        length = body.tell()
+        body.seek(0)
+        environ = build_environ(scope, body)
+        environ['CONTENT_LENGTH'] = str(length)
+        environ.pop('HTTP_TRANSFER_ENCODING', None)
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = _status_code(status)
+                started['headers'] = _encode_headers(headers)
+
+            def send_start():
+                if not started.get('sent'):
+                    send_from_thread({'type': 'http.response.start',
+                                      'status': started['status'],
+                                      'headers': started['headers']})
+                    started['sent'] = True
+
+            app_iter = self.app(environ, start_response)
+            try:
+                # Chunks are forwarded as they are produced, so streaming
+                # exports stay streamed.
+                for chunk in app_iter:
+                    send_start()
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body',
+                                          'body': chunk, 'more_body': True})
+                send_start()
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+    async def dispose(self):
+        for engine in [self.engine, *self.app.extensions['async_replica_engines'].values()]:
+            await engine.dispose()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(test_config=None):
+    """
+    Creates the Flask app and wraps it in AsyncApp.
+    """
+    app = create_app(test_config)
+    return AsyncApp(app, wsgi_threads=app.config['ASGI_WSGI_THREADS'])
@@ -0,0 +1,55 @@
+from flask import current_app, g
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, \
+    create_async_engine
+from db_pool import async_engine_options, async_url
+
+
+"""
+Async Database Access
+The ASGI entry point reads through an AsyncEngine on the same database as the
+app's synchronous engine, using the backend's async driver (asyncpg or
+aiosqlite). Each request lazily opens one AsyncSession, which is closed when the
+request finishes. Every read replica of DATABASE_REPLICA_URLS gets an AsyncEngine
+as well, which read_replica_async() (flaskr/replicas.py) binds the request's
+session to.
+"""
+
+
+def init_async_db(app):
+    """
+    Creates the app's async engine and session factory from its database URL,
+    and in app.extensions['async_replica_engines'] an async engine per replica,
+    keyed by the replica's engine from setup_db().
+    """
+    database_path = app.config['SQLALCHEMY_DATABASE_URI']
+    engine = create_async_engine(async_url(database_path),
+                                 **async_engine_options(database_path))
+    app.extensions['async_db'] = async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False)
+    app.extensions['async_replica_engines'] = {
+        replica: create_async_engine(async_url(url), **async_engine_options(url))
+        for replica in app.extensions['replica_engines']
+        for url in [replica.url.render_as_string(hide_password=False)]}
+    return engine
+
+
+def get_async_session():
+    """
+    Returns the AsyncSession of the current request, opening it on first use.
+    """
+    if 'async_session' not in g:
+        g.async_session = current_app.extensions['async_db']()
+    return g.async_session
+
+
+def set_async_session(session):
+    """
+    Makes session the AsyncSession of the current request.
+    """
+    g.async_session = session
+
+
+async def close_async_session():
+    session = g.pop('async_session', None)
+    if session is not None:
+        await session.close()
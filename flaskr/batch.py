@@ -0,0 +1,305 @@
+from flask import abort, current_app, jsonify, request
+from sqlalchemy import delete
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, Movie, Actor, bump_versions, apply_actor_policy, \
+    refresh_movie_documents
+from flaskr.bulk import validate_movie, validate_actor, parse_date
+
+
+"""
+Batch Operations
+POST /batch applies a list of create, update and delete operations on movies
+and actors in one transaction. Every operation is checked against the caller's
+permissions and validated before anything is written; rows targeted by updates
+and deletes are loaded with one IN query per resource, and the changes are
+flushed and committed once, so the batch is applied as a whole or not at all.
+Movie deletes follow the MOVIE_DELETE_ACTORS policy of DELETE /movies/<id>.
+"""
+
+MODELS = {'movies': Movie, 'actors': Actor}
+
+PERMISSIONS = {'create': 'post', 'update': 'update', 'delete': 'delete'}
+
+
+def get_operations():
+    """
+    Reads the JSON array of operations from the request body.
+
+    Aborts:
+        400: If the body is not a non-empty array of at most MAX_BATCH_SIZE operations.
+    """
+    operations = request.get_json(silent=True)
+    if not isinstance(operations, list) or not operations:
+        abort(400, "Request body must be a non-empty JSON array of operations")
+
+    max_size = current_app.config['MAX_BATCH_SIZE']
+    if len(operations) > max_size:
+        abort(400, f"At most {max_size} operations can be applied per request")
+    return operations
+
+
+def _validate_changes(data, validators):
+    if not isinstance(data, dict) or not data:
+        raise ValueError("data must be a non-empty JSON object")
+    unknown = set(data) - set(validators)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {name: validators[name](value) for name, value in data.items()}
+
+
+def _string(name):
+    def validate(value):
+        if not value or not isinstance(value, str):
+            raise ValueError(f"{name} must be a non-empty string")
+        return value
+    return validate
+
+
+def _integer(name, positive=False):
+    minimum, kind = (1, 'positive') if positive else (0, 'non-negative')
+
+    def validate(value):
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            raise ValueError(f"{name} must be a {kind} integer")
+        return value
+    return validate
+
+
+MOVIE_CHANGES = {'title': _string('title'), 'release_date': parse_date}
+ACTOR_CHANGES = {'name': _string('name'), 'age': _integer('age'),
+                 'gender': _string('gender'), 'movie_id': _integer('movie_id', positive=True)}
+
+
+def validate_operation(operation):
+    """
+    Returns (op, resource, id, values) for an operation. values are the column
+    values of a create or the changed columns of an update.
+
+    Raises:
+        ValueError: With a description of the first problem found.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError("Operation must be a JSON object")
+
+    op = operation.get('op')
+    resource = operation.get('resource')
+    if op not in PERMISSIONS:
+        raise ValueError("op must be one of create, update, delete")
+    if resource not in MODELS:
+        raise ValueError("resource must be movies or actors")
+
+    if op == 'create':
+        validate = validate_movie if resource == 'movies' else validate_actor
+        return op, resource, None, validate(operation.get('data'))
+
+    target_id = operation.get('id')
+    if isinstance(target_id, bool) or not isinstance(target_id, int):
+        raise ValueError(f"id must be an integer to {op} a record")
+    if op == 'delete':
+        return op, resource, target_id, None
+    changes = MOVIE_CHANGES if resource == 'movies' else ACTOR_CHANGES
+    return op, resource, target_id, _validate_changes(operation.get('data'), changes)
+
+
+def required_permission(op, resource):
+    return f'{PERMISSIONS[op]}:{resource}'
+
+
+def check_operation_permissions(operations, payload):
+    """
+    Lists, in request order, the operations the caller may not perform.
+    """
+    granted = set(payload.get('permissions', []))
+    errors = []
+    for index, (op, resource, _, _) in enumerate(operations):
+        permission = required_permission(op, resource)
+        if permission not in granted:
+            errors.append({'index': index,
+                           'message': f"Permission {permission} not found"})
+    return errors
+
+
+def _load_targets(operations):
+    """
+    Loads every movie and actor that is updated or deleted, one query per
+    resource, keyed by (resource, id).
+    """
+    ids = {resource: set() for resource in MODELS}
+    for op, resource, target_id, _ in operations:
+        if target_id is not None:
+            ids[resource].add(target_id)
+
+    targets = {}
+    for resource, model in MODELS.items():
+        if ids[resource]:
+            for row in db.session.scalars(
+                    db.select(model).where(model.id.in_(ids[resource]))):
+                targets[(resource, row.id)] = row
+    return targets
+
+
+def _existing_movie_ids(operations):
+    movie_ids = {values['movie_id'] for op, resource, _, values in operations
+                 if resource == 'actors' and values and 'movie_id' in values}
+    if not movie_ids:
+        return set()
+    return set(db.session.scalars(
+        db.select(Movie.id).where(Movie.id.in_(movie_ids))))
+
+
+def _load_casts(movies):
+    """
+    Sets the actors of every movie from one IN query, so serializing the movie
+    results does not lazy-load each cast.
+    """
+    casts = {movie.id: [] for movie in movies}
+    if not casts:
+        return
+    for actor in db.session.scalars(db.select(Actor)
+                                    .where(Actor.movie_id.in_(casts))
+                                    .order_by(Actor.id)):
+        casts[actor.movie_id].append(actor)
+    for movie in movies:
+        set_committed_value(movie, 'actors', casts[movie.id])
+
+
+def _delete_movie(movie_id, targets, policy):
+    """
+    Deletes a movie with set-based statements after applying the dependent-actor
+    policy (see models.apply_actor_policy), and brings the loaded actors in line.
+    Returns the number of actors that block the delete under 'reject', else 0.
+    """
+    actor_count = apply_actor_policy([movie_id], policy)
+    if policy == 'reject' and actor_count:
+        return actor_count
+
+    db.session.execute(delete(Movie).where(Movie.id == movie_id),
+                       execution_options={'synchronize_session': False})
+    db.session.expunge(targets.pop(('movies', movie_id)))
+    for key, record in list(targets.items()):
+        if key[0] == 'actors' and record.movie_id == movie_id:
+            if policy == 'cascade':
+                db.session.expunge(targets.pop(key))
+            else:
+                set_committed_value(record, 'movie_id', None)
+    return 0
+
+
+def apply_operations(operations):
+    """
+    Applies validated operations to the session, in order, without committing.
+
+    Returns:
+        tuple: (results, errors, status, tables). results hold, per operation,
+        the created or updated record, or the deleted id. errors list the
+        operations that target a missing movie or actor (status 404), or delete a
+        movie that still has actors under the 'reject' policy (status 409).
+        tables are the tables written. The movie documents of every movie
+        whose row or cast changed are rewritten.
+    """
+    targets = _load_targets(operations)
+    movie_ids = _existing_movie_ids(operations)
+    policy = current_app.config['MOVIE_DELETE_ACTORS']
+    errors, applied, tables = [], [], set()
+    documents = set()
+    status = 404
+
+    for index, (op, resource, target_id, values) in enumerate(operations):
+        if resource == 'actors' and values and 'movie_id' in values \
+                and values['movie_id'] not in movie_ids:
+            errors.append({'index': index,
+                           'message': f"Movie with id {values['movie_id']} not found"})
+            continue
+
+        if op == 'create':
+            record = MODELS[resource](**values)
+            db.session.add(record)
+            documents.add(values.get('movie_id'))
+        else:
+            record = targets.get((resource, target_id))
+            if record is None:
+                errors.append({'index': index, 'message':
+                               f"{resource[:-1].capitalize()} with id {target_id} not found"})
+                continue
+            documents.add(target_id if resource == 'movies' else record.movie_id)
+            if op == 'update':
+                for name, value in values.items():
+                    setattr(record, name, value)
+                if resource == 'actors':
+                    documents.add(record.movie_id)
+            elif resource == 'movies':
+                blocking = _delete_movie(target_id, targets, policy)
+                if blocking:
+                    errors.append({'index': index, 'message':
+                                   f"Movie with id {target_id} still has {blocking} actor(s)"})
+                    status = 409
+                    continue
+                movie_ids.discard(target_id)
+                tables.add('actors')
+            else:
+                db.session.delete(record)
+                del targets[(resource, target_id)]
+        tables.add(resource)
+        applied.append((op, resource, target_id, record))
+
+    if errors:
+        return [], errors, status, tables
+
+    db.session.flush()
+    documents.update(record.id for op, resource, _, record in applied
+                     if op == 'create' and resource == 'movies')
+    refresh_movie_documents(documents)
+    _load_casts([record for op, resource, _, record in applied
+                 if resource == 'movies' and op != 'delete'])
+    results = [{'op': op, 'resource': resource, 'id': target_id}
+               if op == 'delete' else
+               {'op': op, 'resource': resource, 'id': record.id,
+                'data': record.format()}
+               for op, resource, target_id, record in applied]
+    return results, [], None, tables
+
+
+def run_batch(payload):
+    """
+    Validates, authorizes and applies the request's operations in one transaction.
+    """
+    operations, errors = [], []
+    for index, operation in enumerate(get_operations()):
+        try:
+            operations.append(validate_operation(operation))
+        except ValueError as e:
+            errors.append({'index': index, 'message': str(e)})
+    if errors:
+        return batch_error_response(422, errors, "failed validation")
+
+    errors = check_operation_permissions(operations, payload)
+    if errors:
+        return batch_error_response(403, errors, "are not permitted")
+
+    try:
+        results, errors, status, tables = apply_operations(operations)
+        if errors:
+            db.session.rollback()
+            return batch_error_response(status, errors, "could not be applied")
+        bump_versions(*tables)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        abort(500, str(e))
+
+    return jsonify({
+        "success": True,
+        "results": results
+    })
+
+
+def batch_error_response(status, errors, reason):
+    """
+    Error response listing the index and message of each rejected operation.
+    """
+    return jsonify({
+        "success": False,
+        "error": status,
+        "message": f"{len(errors)} operation(s) {reason}, nothing was applied",
+        "errors": errors
+    }), status
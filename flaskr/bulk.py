@@ -0,0 +1,130 @@
+from datetime import datetime
+from flask import abort, current_app, jsonify, request
+from models import db, Movie
+
+
+"""
+Bulk Validation
+Every record of a bulk request is validated before anything is written, so a
+batch is either inserted as a whole with a single multi-row statement or
+rejected with the errors of each failing item.
+"""
+
+
+def get_bulk_items():
+    """
+    Reads the JSON array of records from the request body.
+
+    Aborts:
+        400: If the body is not a non-empty array of at most MAX_BULK_SIZE records.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        abort(400, "Request body must be a non-empty JSON array")
+
+    max_size = current_app.config['MAX_BULK_SIZE']
+    if len(items) > max_size:
+        abort(400, f"At most {max_size} records can be created per request")
+    return items
+
+
+def parse_date(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    raise ValueError("release_date must be an ISO 8601 date (YYYY-MM-DD)")
+
+
+def validate_movie(item):
+    """
+    Returns the column values for a movie record.
+
+    Raises:
+        ValueError: With a description of the first problem found.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Record must be a JSON object")
+
+    title = item.get('title', None)
+    release_date = item.get('release_date', None)
+    if not title or not release_date:
+        raise ValueError("Missing fields for movie creation")
+    if not isinstance(title, str):
+        raise ValueError("title must be a string")
+
+    return {'title': title, 'release_date': parse_date(release_date)}
+
+
+def validate_actor(item):
+    """
+    Returns the column values for an actor record.
+
+    Raises:
+        ValueError: With a description of the first problem found.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Record must be a JSON object")
+
+    name = item.get('name', None)
+    age = item.get('age', None)
+    gender = item.get('gender', None)
+    movie_id = item.get('movie_id', None)
+    if not all([name, age, gender, movie_id]):
+        raise ValueError("Missing fields for actor creation")
+    if not isinstance(name, str) or not isinstance(gender, str):
+        raise ValueError("name and gender must be strings")
+    if isinstance(age, bool) or not isinstance(age, int) or age < 0:
+        raise ValueError("age must be a non-negative integer")
+    if isinstance(movie_id, bool) or not isinstance(movie_id, int):
+        raise ValueError("movie_id must be an integer")
+
+    return {'name': name, 'age': age, 'gender': gender, 'movie_id': movie_id}
+
+
+def validate_all(items, validate):
+    """
+    Validates every record.
+
+    Returns:
+        tuple: (rows, errors). errors lists {"index", "message"} for each invalid
+        record, in request order.
+    """
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate(item))
+        except ValueError as e:
+            errors.append({'index': index, 'message': str(e)})
+    return rows, errors
+
+
+def check_movies_exist(rows):
+    """
+    Reports records whose movie_id does not exist, using a single IN query.
+    rows must be the validated records of the whole request, so that their
+    positions match the request's indexes.
+    """
+    movie_ids = {row['movie_id'] for row in rows if row.get('movie_id')}
+    if not movie_ids:
+        return []
+
+    found = set(db.session.scalars(
+        db.select(Movie.id).where(Movie.id.in_(movie_ids))))
+    return [{'index': index,
+             'message': f"Movie with id {row['movie_id']} not found"}
+            for index, row in enumerate(rows)
+            if row.get('movie_id') and row['movie_id'] not in found]
+
+
+def invalid_items_response(errors):
+    """
+    422 response listing the errors of each rejected record.
+    """
+    return jsonify({
+        "success": False,
+        "error": 422,
+        "message": f"{len(errors)} record(s) failed validation, nothing was created",
+        "errors": errors
+    }), 422
@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, make_response, request
+from flaskr.etag import current_versions, prefetch_versions
+from metrics import count_cache_lookup
+
+
+"""
+Response Cache
+Serialized GET responses are cached under a key built from the route, the query
+string, the caller's permission set and the change versions of the tables the
+response is read from. Every create, update and delete bumps the version of the
+table it writes (see models.bump_versions), so a write makes exactly the entries
+built from that table unreachable, in every worker, without a broadcast. Those
+entries are then dropped by LRU eviction or TTL.
+
+When an entry expires, one request recomputes it while concurrent requests keep
+receiving the expired copy; when there is no copy at all they wait briefly for
+the first request to finish instead of all querying the database at once. If
+that request stores nothing (an error or a non-200 response), they stop waiting
+as soon as it finishes and compute the response themselves.
+"""
+
+
+class CachedResponse:
+    def __init__(self, body, status, mimetype, expires_at):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.expires_at = expires_at
+
+    def to_json(self):
+        return json.dumps({
+            'body': self.body.decode('utf-8'),
+            'status': self.status,
+            'mimetype': self.mimetype,
+            'expires_at': self.expires_at
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data['body'].encode('utf-8'), data['status'],
+                   data['mimetype'], data['expires_at'])
+
+
+# Local LRU Backend
+# Per-process cache; the default.
+
+class LocalLRUBackend:
+    """
+    In-process LRU of cached responses.
+
+    Args:
+        max_size (int): Maximum number of entries.
+    """
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._computing = set()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def acquire(self, key, timeout):
+        with self._lock:
+            if key in self._computing:
+                return False
+            self._computing.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._computing.discard(key)
+
+    def locked(self, key):
+        with self._lock:
+            return key in self._computing
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Redis Backend
+# Shared by all workers and hosts that point at the same Redis.
+
+class RedisBackend:
+    """
+    Stores cached responses in Redis. Requires the optional 'redis' package.
+
+    Args:
+        url (str): Redis connection URL, e.g. redis://localhost:6379/0.
+        stale_ttl (float): Seconds an expired entry is kept for stale serving.
+        prefix (str): Key prefix.
+    """
+    def __init__(self, url, stale_ttl=60, prefix='capstone:response:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url)
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return CachedResponse.from_json(raw) if raw is not None else None
+
+    def set(self, key, entry, ttl):
+        self.client.set(self.prefix + key, entry.to_json(),
+                        ex=int(ttl + self.stale_ttl) or 1)
+
+    def acquire(self, key, timeout):
+        # The lock expires on its own if the worker holding it dies.
+        return bool(self.client.set(self.prefix + 'lock:' + key, 1, nx=True,
+                                    px=max(int(timeout * 1000), 1)))
+
+    def release(self, key):
+        self.client.delete(self.prefix + 'lock:' + key)
+
+    def locked(self, key):
+        return bool(self.client.exists(self.prefix + 'lock:' + key))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+LOOKUP_RESULTS = {'hits': 'hit', 'stale_hits': 'stale', 'misses': 'miss'}
+
+
+# Response Cache
+# Hit accounting and stampede protection on top of a backend.
+
+class ResponseCache:
+    """
+    Caches successful responses of decorated GET routes.
+
+    Args:
+        backend: LocalLRUBackend or RedisBackend.
+        ttl (float): Seconds an entry is served before it is recomputed.
+        wait_timeout (float): Seconds a request waits for another request that is
+            already computing the same entry before computing it itself.
+    """
+    def __init__(self, backend, ttl=30, wait_timeout=5):
+        self.backend = backend
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _count(self, outcome):
+        # The counters of stats() are per process; the Prometheus counter is
+        # aggregated over workers by /metrics (see metrics.py).
+        with self._stats_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        count_cache_lookup(LOOKUP_RESULTS[outcome])
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (response or CachedResponse, outcome) where outcome is one of
+        'HIT', 'STALE' or 'MISS'.
+        """
+        entry = self.backend.get(key)
+        if entry is not None and entry.expires_at > time.time():
+            self._count('hits')
+            return entry, 'HIT'
+
+        if self.backend.acquire(key, self.wait_timeout):
+            try:
+                return self._compute(key, compute), 'MISS'
+            finally:
+                self.backend.release(key)
+
+        if entry is not None:
+            self._count('stale_hits')
+            return entry, 'STALE'
+
+        # Another request is building this entry; wait for it.
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            entry, computing = self._poll(key)
+            if entry is not None:
+                self._count('hits')
+                return entry, 'HIT'
+            if not computing:
+                break
+        return self._compute(key, compute), 'MISS'
+
+    def _poll(self, key):
+        # The lock is read before the entry: a request stores its entry before
+        # releasing the lock, so a released lock with no entry means it stored
+        # nothing (an error or a non-200 response) and there is nothing to wait for.
+        computing = self.backend.locked(key)
+        return self.backend.get(key), computing
+
+    def _compute(self, key, compute):
+        self._count('misses')
+        return self._store(key, make_response(compute()))
+
+    async def get_or_compute_async(self, key, compute):
+        """
+        get_or_compute() for a coroutine compute; waiting for another request
+        that is building the entry does not block the event loop.
+        """
+        entry = self.backend.get(key)
+        if entry is not None and entry.expires_at > time.time():
+            self._count('hits')
+            return entry, 'HIT'
+
+        if self.backend.acquire(key, self.wait_timeout):
+            try:
+                return await self._compute_async(key, compute), 'MISS'
+            finally:
+                self.backend.release(key)
+
+        if entry is not None:
+            self._count('stale_hits')
+            return entry, 'STALE'
+
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            entry, computing = self._poll(key)
+            if entry is not None:
+                self._count('hits')
+                return entry, 'HIT'
+            if not computing:
+                break
+        return await self._compute_async(key, compute), 'MISS'
+
+    async def _compute_async(self, key, compute):
+        self._count('misses')
+        return self._store(key, make_response(await compute()))
+
+    def _store(self, key, response):
+        if response.status_code == 200 and not response.is_streamed:
+            entry = CachedResponse(response.get_data(), response.status_code,
+                                   response.mimetype, time.time() + self.ttl)
+            self.backend.set(key, entry, self.ttl)
+        return response
+
+    def clear(self):
+        self.backend.clear()
+        with self._stats_lock:
+            self.hits = self.stale_hits = self.misses = 0
+
+    def stats(self):
+        with self._stats_lock:
+            served = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.stale_hits) / served if served else 0.0
+            }
+
+
+def init_response_cache(app, backend=None, ttl=None, size=None, redis_url=None):
+    """
+    Creates the app's response cache from RESPONSE_CACHE_* settings.
+
+    RESPONSE_CACHE_BACKEND selects 'local' (default), 'redis' or 'none'.
+    """
+    backend = backend or app.config['RESPONSE_CACHE_BACKEND']
+    ttl = ttl if ttl is not None else app.config['RESPONSE_CACHE_TTL']
+    if backend == 'none':
+        cache = None
+    elif backend == 'redis':
+        cache = ResponseCache(
+            RedisBackend(redis_url or app.config['REDIS_URL']), ttl=ttl)
+    elif backend == 'local':
+        cache = ResponseCache(LocalLRUBackend(
+            size if size is not None else app.config['RESPONSE_CACHE_SIZE']),
+            ttl=ttl)
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND {backend!r}')
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def cache_key(tables, permissions):
+    versions = current_versions(tables)
+    args = sorted(request.args.items(multi=True))
+    raw = json.dumps([request.path, args, sorted(permissions),
+                      request.accept_mimetypes.to_header(),
+                      list(zip(tables, versions))])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _to_response(result, outcome):
+    if isinstance(result, CachedResponse):
+        response = current_app.response_class(
+            result.body, status=result.status, mimetype=result.mimetype)
+    else:
+        response = result
+    response.headers['X-Cache'] = outcome
+    return response
+
+
+def cached_response(*tables):
+    """
+    Decorator caching the serialized response of a GET route.
+
+    Args:
+        tables (str): Names of the tables the response is built from; their
+            versions are part of the key, so writes to them invalidate it.
+
+    The decorated route must receive the JWT payload as its first argument,
+    i.e. be wrapped by requires_auth.
+    """
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None:
+                return f(payload, *args, **kwargs)
+
+            key = cache_key(tables, payload.get('permissions', []))
+            result, outcome = cache.get_or_compute(
+                key, lambda: f(payload, *args, **kwargs))
+            return _to_response(result, outcome)
+        return wrapper
+    return cached_response_decorator
+
+
+def cached_response_async(*tables):
+    """
+    cached_response() for the coroutine views of the ASGI entry point.
+    """
+    def cached_response_decorator(f):
+        @wraps(f)
+        async def wrapper(payload, *args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None:
+                return await f(payload, *args, **kwargs)
+
+            await prefetch_versions(tables)
+            key = cache_key(tables, payload.get('permissions', []))
+            result, outcome = await cache.get_or_compute_async(
+                key, lambda: f(payload, *args, **kwargs))
+            return _to_response(result, outcome)
+        return wrapper
+    return cached_response_decorator
@@ -0,0 +1,176 @@
+import json
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import delete, exists, select, text
+from models import db, Movie, MovieDocument, bump_versions, build_movie_documents, \
+    upsert_movie_documents
+from metrics import serialization_timer
+from flaskr.filters import filter_movies
+from flaskr.pagination import get_page_args, get_sort_arg, page_queries, page_result
+from flaskr.streaming import wants_stream
+
+
+"""
+Movie Documents
+A read model of GET /movies: movie_documents holds one row per movie with the
+serialized movie and cast, rewritten in the same transaction as every create,
+update and delete of a movie or actor (models.refresh_movie_documents). With
+MOVIE_DOCUMENTS=serve a page of GET /movies is one index range scan of that
+table, and the response body is the stored documents joined together, without
+joining actors or serializing anything.
+
+Requests with q, fields or stream still read movies and actors. Documents are
+not written while MOVIE_DOCUMENTS is 'off', so switch to 'maintain', run
+"flask documents rebuild", then switch to 'serve'. "flask documents check"
+compares every document with the tables.
+"""
+
+DOCUMENT_SORTS = {
+    'id': MovieDocument.id,
+    'title': MovieDocument.title,
+    'release_date': MovieDocument.release_date
+}
+
+
+def serves_documents():
+    """
+    True when the current GET /movies request can be answered from the documents.
+    """
+    return current_app.config['MOVIE_DOCUMENTS'] == 'serve' \
+        and 'q' not in request.args and 'fields' not in request.args \
+        and not wants_stream()
+
+
+def movie_documents_query():
+    """
+    Returns (queries, limit, sort) reading the requested page of documents with
+    read_page(), with the filters, sort orders and cursors of GET /movies.
+    """
+    sort = get_sort_arg(DOCUMENT_SORTS)
+    limit, cursor = get_page_args(sort)
+    query = filter_movies(select(MovieDocument.id, MovieDocument.title,
+                                 MovieDocument.release_date,
+                                 MovieDocument.document), MovieDocument)
+    return page_queries(query, MovieDocument.id, cursor, sort), limit, sort
+
+
+def movie_documents_response(rows, limit, sort):
+    """
+    Returns the GET /movies response for the rows read from
+    movie_documents_query(), in the JSON provider's compact, key-sorted layout.
+    """
+    rows, next_cursor = page_result(rows, MovieDocument.id, limit, sort)
+    with serialization_timer():
+        body = '{"movies":[' + ','.join(row.document for row in rows) + \
+            '],"next_cursor":' + current_app.json.dumps(next_cursor) + \
+            ',"success":true}'
+        return current_app.response_class(body, mimetype=current_app.json.mimetype)
+
+
+def _movie_id_batches(batch_size):
+    last_id = None
+    while True:
+        query = select(Movie.id).order_by(Movie.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(Movie.id > last_id)
+        movie_ids = db.session.scalars(query).all()
+        if not movie_ids:
+            return
+        yield movie_ids
+        last_id = movie_ids[-1]
+
+
+def rebuild_movie_documents(batch_size=1000):
+    """
+    Replaces every document with one built from the tables, in one transaction,
+    and returns the number of documents written.
+
+    On Postgres movie_documents is locked against writes first, so a write that
+    commits during the rebuild rewrites its documents after the rebuild instead
+    of racing with it; reads of the old documents continue meanwhile.
+    """
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('LOCK TABLE movie_documents IN EXCLUSIVE MODE'))
+        db.session.execute(delete(MovieDocument))
+        written = 0
+        for movie_ids in _movie_id_batches(batch_size):
+            rows = build_movie_documents(movie_ids)
+            upsert_movie_documents(rows)
+            written += len(rows)
+        # Cached and tagged GET /movies responses may hold stale documents.
+        bump_versions('movies')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return written
+
+
+def check_movie_documents(batch_size=1000):
+    """
+    Compares every document with the movie and cast it was built from.
+
+    Returns:
+        dict: The number of movies checked and the ids of the movies whose
+        document is missing or stale, and of documents without a movie. On
+        Postgres all of it is read from one snapshot, so writes running during
+        the check are not reported.
+    """
+    report = {'movies': 0, 'missing': [], 'stale': [], 'orphaned': []}
+    db.session.rollback()
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'})
+        for movie_ids in _movie_id_batches(batch_size):
+            stored = {row.id: row for row in db.session.execute(
+                select(MovieDocument).where(MovieDocument.id.in_(movie_ids)))
+                .scalars()}
+            for expected in build_movie_documents(movie_ids):
+                report['movies'] += 1
+                document = stored.get(expected['id'])
+                if document is None:
+                    report['missing'].append(expected['id'])
+                elif (document.title, document.release_date,
+                      json.loads(document.document)) != \
+                        (expected['title'], expected['release_date'],
+                         json.loads(expected['document'])):
+                    report['stale'].append(expected['id'])
+        report['orphaned'] = db.session.scalars(
+            select(MovieDocument.id)
+            .where(~exists().where(Movie.id == MovieDocument.id))
+            .order_by(MovieDocument.id)).all()
+    finally:
+        db.session.rollback()
+    return report
+
+
+documents_cli = AppGroup('documents', help='Maintain the movie documents read model.')
+
+
+@documents_cli.command('rebuild')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Movies read per query.')
+def rebuild_command(batch_size):
+    """Rebuild every movie document from the tables."""
+    written = rebuild_movie_documents(batch_size)
+    click.echo(f'Rebuilt {written} movie documents.')
+
+
+@documents_cli.command('check')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Movies read per query.')
+def check_command(batch_size):
+    """Compare the movie documents with the tables; exit 1 on any difference."""
+    report = check_movie_documents(batch_size)
+    click.echo(f"Checked {report['movies']} movies.")
+    problems = [(name, report[name]) for name in ('missing', 'stale', 'orphaned')
+                if report[name]]
+    for name, ids in problems:
+        shown = ', '.join(map(str, ids[:20])) + (', ...' if len(ids) > 20 else '')
+        click.echo(f'{len(ids)} {name}: {shown}')
+    if problems:
+        raise click.exceptions.Exit(1)
+    click.echo('All movie documents are up to date.')
@@ -0,0 +1,93 @@
+import hashlib
+from functools import wraps
+from flask import g, make_response, request
+from models import get_versions, get_versions_async
+from flaskr.async_db import get_async_session
+
+
+"""
+Conditional GET
+Responses are tagged with a strong ETag derived from the request path, query
+string and the change versions of the tables the response is built from. The
+versions are read with one primary key lookup before the data, so a request whose
+If-None-Match still matches is answered with 304 without running the list query
+or serializing anything.
+"""
+
+
+def current_versions(tables):
+    """
+    Returns the versions of the given tables, read at most once per request.
+    """
+    cached = g.setdefault('table_versions', {})
+    if tables not in cached:
+        cached[tables] = get_versions(*tables)
+    return cached[tables]
+
+
+async def prefetch_versions(tables):
+    """
+    Reads the versions of the given tables through the request's AsyncSession,
+    so that current_versions() answers from g without a blocking query.
+    """
+    cached = g.setdefault('table_versions', {})
+    if tables not in cached:
+        cached[tables] = await get_versions_async(get_async_session(), *tables)
+
+
+def compute_etag(tables):
+    versions = current_versions(tables)
+    tag = f'{request.full_path}|{request.accept_mimetypes}|' + \
+        ','.join(f'{t}={v}' for t, v in zip(tables, versions))
+    return hashlib.sha1(tag.encode()).hexdigest()
+
+
+def conditional_get(*tables):
+    """
+    Decorator adding ETag / If-None-Match support to a GET route.
+
+    Args:
+        tables (str): Names of the tables the response is built from.
+
+    Process:
+        - Computes the ETag from the current table versions.
+        - Returns 304 Not Modified if the client already holds that version.
+        - Otherwise runs the route and attaches the ETag to its response.
+    """
+    def conditional_get_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(tables)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return conditional_get_decorator
+
+
+def conditional_get_async(*tables):
+    """
+    conditional_get() for the coroutine views of the ASGI entry point.
+    """
+    def conditional_get_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            await prefetch_versions(tables)
+            etag = compute_etag(tables)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(await f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return conditional_get_decorator
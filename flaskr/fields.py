@@ -0,0 +1,99 @@
+from flask import abort, request
+from sqlalchemy.orm import QueryableAttribute, load_only, selectinload
+from models import Movie, Actor
+
+
+"""
+Sparse Fieldsets
+?fields=id,title,actors.name limits what list endpoints return. The same field
+list restricts the SELECT to the requested columns, and the cast is only loaded
+when an actors field is requested, so unrequested data is neither read from the
+database nor serialized.
+"""
+
+MOVIE_FIELDS = Movie.serialized_fields
+ACTOR_FIELDS = Actor.serialized_fields
+
+
+def get_fields(allowed, nested=None):
+    """
+    Reads ?fields= from the current request.
+
+    Args:
+        allowed (tuple): Top-level field names.
+        nested (dict): Relationship names mapped to their allowed field names.
+
+    Returns:
+        dict: Requested field names mapped to None, or for a relationship to the
+        list of its requested fields (None for all of them). None when the
+        parameter is absent, meaning every field.
+
+    Aborts:
+        400: If a field is unknown.
+    """
+    raw = request.args.get('fields', None)
+    if raw is None:
+        return None
+
+    nested = nested or {}
+    fields = {}
+    for name in filter(None, (part.strip() for part in raw.split(','))):
+        parent, _, child = name.partition('.')
+        if child and child in nested.get(parent, ()):
+            if fields.get(parent, []) is not None:
+                fields.setdefault(parent, []).append(child)
+        elif not child and parent in allowed:
+            fields[parent] = None
+        else:
+            abort(400, f"Unknown field '{name}'")
+
+    if not fields:
+        abort(400, "fields must name at least one field")
+    return fields
+
+
+def get_movie_fields():
+    return get_fields(MOVIE_FIELDS, {'actors': ACTOR_FIELDS})
+
+
+def get_actor_fields():
+    return get_fields(ACTOR_FIELDS)
+
+
+def movie_load_options(fields, sort_column=None):
+    """
+    Loader options that read only the requested movie and cast columns.
+
+    Args:
+        fields (dict): Result of get_movie_fields().
+        sort_column: Column the page is ordered by; always loaded so the cursor
+            can be built without another query. A computed order (search
+            relevance) is loaded by its own with_expression() option.
+    """
+    if fields is None:
+        return [selectinload(Movie.actors)]
+
+    columns = [Movie.id] + [getattr(Movie, name) for name in fields
+                            if name != 'actors']
+    if isinstance(sort_column, QueryableAttribute):
+        columns.append(sort_column)
+    options = [load_only(*columns)]
+
+    if 'actors' in fields:
+        actor_fields = fields['actors'] or ACTOR_FIELDS
+        options.append(selectinload(Movie.actors).load_only(
+            Actor.movie_id, *[getattr(Actor, name) for name in actor_fields]))
+    return options
+
+
+def actor_load_options(fields, sort_column=None):
+    """
+    Loader options that read only the requested actor columns.
+    """
+    if fields is None:
+        return []
+
+    columns = [Actor.id] + [getattr(Actor, name) for name in fields]
+    if isinstance(sort_column, QueryableAttribute):
+        columns.append(sort_column)
+    return [load_only(*columns)]
@@ -0,0 +1,78 @@
+from datetime import datetime
+from flask import abort, request
+from models import Movie, Actor
+
+
+"""
+List Filters
+Query parameters accepted by GET /movies and GET /actors. Every filter and sort
+order is backed by an index added in migration 4d2e8a1c5b7f, so filtered pages
+are index range scans rather than sequential scans.
+"""
+
+MOVIE_SORTS = {
+    'id': Movie.id,
+    'title': Movie.title,
+    'release_date': Movie.release_date
+}
+
+ACTOR_SORTS = {
+    'id': Actor.id,
+    'name': Actor.name,
+    'age': Actor.age
+}
+
+
+def _int_arg(name):
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, f"{name} must be an integer")
+
+
+def _date_arg(name):
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"{name} must be an ISO 8601 date (YYYY-MM-DD)")
+
+
+def filter_movies(query, model=Movie):
+    """
+    Applies ?released_after= and ?released_before= (inclusive ISO dates) to the
+    release_date of model, Movie or its read model MovieDocument.
+    """
+    released_after = _date_arg('released_after')
+    released_before = _date_arg('released_before')
+
+    if released_after is not None:
+        query = query.filter(model.release_date >= released_after)
+    if released_before is not None:
+        query = query.filter(model.release_date <= released_before)
+    return query
+
+
+def filter_actors(query):
+    """
+    Applies ?movie_id=, ?gender=, ?min_age= and ?max_age= (inclusive).
+    """
+    movie_id = _int_arg('movie_id')
+    gender = request.args.get('gender', None)
+    min_age = _int_arg('min_age')
+    max_age = _int_arg('max_age')
+
+    if movie_id is not None:
+        query = query.filter(Actor.movie_id == movie_id)
+    if gender is not None:
+        query = query.filter(Actor.gender == gender)
+    if min_age is not None:
+        query = query.filter(Actor.age >= min_age)
+    if max_age is not None:
+        query = query.filter(Actor.age <= max_age)
+    return query
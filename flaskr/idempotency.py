@@ -0,0 +1,186 @@
+import hashlib
+import json
+import time
+from functools import wraps
+from flask import abort, current_app, make_response, request
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey
+
+
+"""
+Idempotency Keys
+A create request sent with an Idempotency-Key header is recorded with a
+fingerprint of the request and, once it completes, its response. A retry with
+the same key gets the stored response back with one primary key lookup, without
+touching the data tables.
+
+The key's row is inserted in the same transaction as the created record, so
+the record and the key are committed together or not at all. A concurrent
+duplicate blocks on the key's primary key until the first request commits, then
+waits for its response, so exactly one record is created. Keys are scoped to the
+caller (the token's sub claim), expire after IDEMPOTENCY_KEY_TTL seconds, and at
+most IDEMPOTENCY_MAX_KEYS are kept.
+"""
+
+MAX_KEY_LENGTH = 255
+
+# Poll interval while a duplicate waits for the first request's response.
+WAIT_INTERVAL = 0.05
+
+_last_prune = 0.0
+
+
+def request_fingerprint():
+    """
+    Hashes the method, path and body, with JSON bodies in canonical form so that
+    key order and whitespace do not matter.
+    """
+    body = request.get_json(silent=True)
+    data = json.dumps(body, sort_keys=True, separators=(',', ':')).encode() \
+        if body is not None else request.get_data()
+    return hashlib.sha256(
+        f'{request.method} {request.path}\n'.encode() + data).hexdigest()
+
+
+def _scoped_key(payload, header):
+    return hashlib.sha256(f"{payload.get('sub', '')}\0{header}".encode()).hexdigest()
+
+
+def _lookup(key):
+    """
+    Returns the key's stored row, dropping it if it has expired.
+    """
+    row = db.session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.key == key)
+        .execution_options(populate_existing=True)).scalar_one_or_none()
+    if row is not None and row.expires_at <= time.time():
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.key == key, IdempotencyKey.expires_at <= time.time()))
+        db.session.commit()
+        return None
+    return row
+
+
+def prune_keys(max_keys):
+    """
+    Deletes expired keys, then the oldest keys beyond max_keys.
+    """
+    now = time.time()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+    overflow = select(IdempotencyKey.key) \
+        .order_by(IdempotencyKey.created_at.desc()).offset(max_keys)
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(overflow)))
+    db.session.commit()
+
+
+def _maybe_prune(config):
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune >= config['IDEMPOTENCY_PRUNE_INTERVAL']:
+        _last_prune = now
+        prune_keys(config['IDEMPOTENCY_MAX_KEYS'])
+
+
+def _claim(key, fingerprint, ttl):
+    """
+    Adds the key's row to the current transaction. Returns None when claimed, or
+    the row of the request that claimed the key first.
+    """
+    now = time.time()
+    db.session.add(IdempotencyKey(key=key, fingerprint=fingerprint,
+                                  created_at=now, expires_at=now + ttl))
+    try:
+        # Blocks while a concurrent duplicate holds the key uncommitted.
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return _lookup(key)
+    return None
+
+
+def _replay(row, key, fingerprint, wait):
+    """
+    Returns the stored response of the request that claimed the key, waiting for
+    it if that request is still running, or None if it failed and released the key.
+    """
+    if row.fingerprint != fingerprint:
+        abort(422, "Idempotency-Key was already used with a different request")
+
+    deadline = time.monotonic() + wait
+    while row.status_code is None:
+        if time.monotonic() >= deadline:
+            abort(409, "A request with this Idempotency-Key is still in progress")
+        db.session.rollback()
+        time.sleep(WAIT_INTERVAL)
+        row = _lookup(key)
+        if row is None:
+            return None
+
+    response = current_app.response_class(
+        row.body, status=row.status_code, content_type=row.content_type)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _release(key):
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def idempotent(f):
+    """
+    Decorator honouring the Idempotency-Key header on a create route. It must be
+    applied below requires_auth(), as it scopes keys to the caller.
+
+    Process:
+        - Without the header the route runs as before.
+        - A key seen before with the same request replays the stored response,
+          marked with an Idempotent-Replayed header, after waiting up to
+          IDEMPOTENCY_WAIT seconds if that request is still running (409 after
+          that); with a different request it is rejected with 422.
+        - Otherwise the key is claimed in the route's transaction, and the route's
+          response (unless it is a server error) is stored for replays. A server
+          error or an exception releases the key, so the request can be retried.
+    """
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        header = request.headers.get('Idempotency-Key', None)
+        if header is None:
+            return f(payload, *args, **kwargs)
+        if not header or len(header) > MAX_KEY_LENGTH:
+            abort(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+        config = current_app.config
+        key = _scoped_key(payload, header)
+        fingerprint = request_fingerprint()
+        row = _lookup(key)
+        if row is None:
+            _maybe_prune(config)
+        while True:
+            if row is None:
+                row = _claim(key, fingerprint, config['IDEMPOTENCY_KEY_TTL'])
+                if row is None:
+                    break
+            replayed = _replay(row, key, fingerprint, config['IDEMPOTENCY_WAIT'])
+            if replayed is not None:
+                return replayed
+            row = None
+
+        try:
+            response = make_response(f(payload, *args, **kwargs))
+        except Exception:
+            _release(key)
+            raise
+        if response.status_code >= 500:
+            _release(key)
+            return response
+
+        db.session.execute(update(IdempotencyKey).where(IdempotencyKey.key == key)
+                           .values(status_code=response.status_code,
+                                   content_type=response.content_type,
+                                   body=response.get_data(as_text=True)))
+        db.session.commit()
+        return response
+    return wrapper
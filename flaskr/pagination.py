@@ -0,0 +1,250 @@
+import base64
+import json
+from datetime import datetime
+from flask import abort, current_app, request
+from sqlalchemy import and_, tuple_
+
+
+"""
+Keyset Pagination
+Pages are selected with "WHERE (sort, id) > (:sort, :after) ORDER BY sort, id
+LIMIT :limit" rather than OFFSET, so every page costs one index range scan no
+matter how deep the client has paged. Cursors are opaque to clients; they encode
+the sort order and the sort key and id of the last row on the previous page.
+Rows whose sort key is NULL come last in ascending order and first in descending
+order, matching a backward scan of a (sort, id) B-tree index. A page that
+reaches the end of the non-NULL keys continues with a second range query over
+the NULL ones, as an OR of the two ranges would not be an index range scan.
+"""
+
+
+def _to_json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(last_id, sort='id', value=None):
+    cursor = {'id': last_id}
+    if sort != 'id':
+        cursor.update({'s': sort, 'v': _to_json_value(value)})
+    payload = json.dumps(cursor, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the dictionary stored in a cursor.
+
+    Raises:
+        ValueError: If the cursor was not produced by encode_cursor().
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(decoded, dict) or not isinstance(decoded.get('id'), int):
+        raise ValueError('Invalid cursor')
+    decoded.setdefault('s', 'id')
+    return decoded
+
+
+def get_page_args(sort=None):
+    """
+    Reads ?limit= and ?after= from the current request.
+
+    Args:
+        sort (tuple): The order returned by get_sort_arg(); the cursor must have
+            been issued for the same order. Defaults to ascending id.
+
+    Returns:
+        tuple: (limit, cursor). limit is capped at the app's MAX_PAGE_SIZE and
+        cursor is None for the first page.
+
+    Aborts:
+        400: If limit is not a positive integer or the cursor is malformed or
+        was issued for a different sort order.
+    """
+    max_size = current_app.config['MAX_PAGE_SIZE']
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        abort(400, "limit must be a positive integer")
+    if limit < 1:
+        abort(400, "limit must be a positive integer")
+
+    after = request.args.get('after', None)
+    cursor = None
+    if after:
+        try:
+            cursor = decode_cursor(after)
+        except ValueError:
+            abort(400, "Invalid pagination cursor")
+
+        if sort is not None:
+            name, column, descending = sort
+            if cursor['s'] != _order_name(name, descending):
+                abort(400, "Pagination cursor does not match the requested sort")
+            try:
+                cursor['v'] = _cursor_value(column, cursor.get('v'))
+            except (TypeError, ValueError):
+                abort(400, "Invalid pagination cursor")
+        elif cursor['s'] != 'id':
+            abort(400, "Pagination cursor does not match the requested sort")
+
+    return min(limit, max_size), cursor
+
+
+def get_sort_arg(sortable, default='id'):
+    """
+    Reads ?sort= from the current request, e.g. sort=age or sort=-release_date.
+
+    Args:
+        sortable (dict): Allowed sort names mapped to their columns.
+        default (str): Sort used when the request has none.
+
+    Returns:
+        tuple: (name, column, descending). Defaults to ascending id order, which
+        is the 'id' entry of sortable.
+
+    Aborts:
+        400: If the sort name is not one of sortable.
+    """
+    sort = request.args.get('sort', default)
+    descending = sort.startswith('-')
+    name = sort.lstrip('-')
+    if name not in sortable:
+        abort(400, f"Cannot sort by '{name}'. Use one of: {', '.join(sortable)}")
+    return name, sortable[name], descending
+
+
+def _order_name(name, descending):
+    return ('-' if descending else '') + name
+
+
+def _cursor_value(column, value):
+    if value is not None and column.type.python_type is datetime:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _ranges(key_column, sort_column, value, last_id, descending):
+    """
+    The (condition, order) ranges that follow (value, last_id) in the order
+    "sort ASC NULLS LAST, id ASC", or its exact reverse when descending, in the
+    order they are read. Each is one range of the (sort, id) index: the non-NULL
+    sort keys after the cursor, and the NULL sort keys after it.
+    """
+    non_null_order = [sort_column.desc(), key_column.desc()] if descending \
+        else [sort_column, key_column]
+    null_order = [key_column.desc() if descending else key_column]
+
+    if descending:
+        if value is None:
+            return [(and_(sort_column.is_(None), key_column < last_id), null_order),
+                    (sort_column.isnot(None), non_null_order)]
+        return [(tuple_(sort_column, key_column) < tuple_(value, last_id),
+                 non_null_order)]
+
+    if value is None:
+        return [(and_(sort_column.is_(None), key_column > last_id), null_order)]
+    return [(tuple_(sort_column, key_column) > tuple_(value, last_id), non_null_order),
+            (sort_column.is_(None), null_order)]
+
+
+def sort_order(key_column, sort=None):
+    """
+    Returns the ORDER BY clauses for a sort from get_sort_arg(), with key_column
+    breaking ties.
+    """
+    name, sort_column, descending = sort or ('id', key_column, False)
+    if sort_column is key_column:
+        return [key_column.desc() if descending else key_column]
+    if descending:
+        return [sort_column.desc().nulls_first(), key_column.desc()]
+    return [sort_column.asc().nulls_last(), key_column]
+
+
+def page_queries(query, key_column, cursor=None, sort=None):
+    """
+    Returns the queries or select()s reading the rows after cursor, in keyset
+    order, to be run in turn by read_page() until limit + 1 rows have been
+    read. The extra row lets page_result() tell whether another page exists
+    without a COUNT query.
+
+    The first page is one query. After a cursor, each query is a single range
+    of the (sort, id) index, never an OR of two: the rest of the non-NULL sort
+    keys, then the NULL ones, so a deep page costs the same as the first.
+    """
+    name, sort_column, descending = sort or ('id', key_column, False)
+    if cursor is None:
+        return [query.order_by(*sort_order(key_column, sort))]
+    if sort_column is key_column:
+        after = key_column < cursor['id'] if descending else key_column > cursor['id']
+        return [query.filter(after).order_by(*sort_order(key_column, sort))]
+    return [query.filter(condition).order_by(*order)
+            for condition, order in _ranges(key_column, sort_column,
+                                            cursor.get('v'), cursor['id'],
+                                            descending)]
+
+
+def read_page(fetch, queries, limit):
+    """
+    Runs the queries from page_queries() with fetch(query) -> list of rows,
+    each limited to the rows still missing, until limit + 1 have been read.
+    """
+    rows = []
+    for query in queries:
+        rows += fetch(query.limit(limit + 1 - len(rows)))
+        if len(rows) > limit:
+            break
+    return rows
+
+
+async def read_page_async(fetch, queries, limit):
+    """
+    read_page() with a coroutine fetch, for the AsyncSession of flaskr/asgi.py.
+    """
+    rows = []
+    for query in queries:
+        rows += await fetch(query.limit(limit + 1 - len(rows)))
+        if len(rows) > limit:
+            break
+    return rows
+
+
+def page_result(rows, key_column, limit, sort=None):
+    """
+    Returns (rows, next_cursor) for the rows read with read_page().
+    """
+    name, sort_column, descending = sort or ('id', key_column, False)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, key_column.key),
+                                    _order_name(name, descending),
+                                    getattr(last, sort_column.key))
+    return rows, next_cursor
+
+
+def paginate(query, key_column, limit, cursor=None, sort=None):
+    """
+    Fetches one page of a query in keyset order.
+
+    Args:
+        query: SQLAlchemy query to page through.
+        key_column: Unique, indexed column that breaks ties (normally the primary key).
+        limit (int): Page size.
+        cursor (dict): Cursor of the previous page from get_page_args(), or None.
+        sort (tuple): (name, column, descending) from get_sort_arg(); defaults to
+            ascending key_column order.
+
+    Returns:
+        tuple: (rows, next_cursor). next_cursor is None on the last page.
+    """
+    rows = read_page(lambda q: q.all(),
+                     page_queries(query, key_column, cursor, sort), limit)
+    return page_result(rows, key_column, limit, sort)
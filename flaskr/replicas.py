@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request
+from sqlalchemy.exc import DBAPIError
+from models import db
+from db_pool import pool_stats
+from metrics import READ_ROUTING
+from flaskr.async_db import set_async_session
+
+
+"""
+Read Replicas
+With DATABASE_REPLICA_URLS set, the read-only routes send their queries to a
+replica while every write goes to the primary. Replicas are used in turn; one
+that fails to connect is skipped for REPLICA_RETRY_INTERVAL seconds and its
+requests are served by the next replica, or by the primary when none is left.
+
+Replication is asynchronous, so a caller that has just written could read a
+replica that has not received the write yet. For REPLICA_STICKY_SECONDS after
+a successful write, a caller's (the token's sub claim) reads go to the primary
+as well. Writes are remembered per process by default; with several workers,
+REPLICA_STICKY_BACKEND=redis shares them through REDIS_URL.
+
+The coroutine routes of the ASGI entry point are routed the same way by
+read_replica_async(), with the same replica health and recent writers.
+"""
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+# Replica Set
+# Round robin over the healthy replicas.
+
+class ReplicaSet:
+    """
+    The replica engines of an app.
+
+    Args:
+        engines (list): Engines of the replicas.
+        retry_interval (float): Seconds a replica that failed to connect is skipped.
+    """
+    def __init__(self, engines, retry_interval=30):
+        self.engines = list(engines)
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._next = 0
+
+    def healthy(self, engine):
+        return self._down_until.get(engine, 0) <= time.monotonic()
+
+    def candidates(self):
+        """
+        Returns the healthy replicas, starting with the next one in turn.
+        """
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.engines)
+        ordered = self.engines[start:] + self.engines[:start]
+        return [engine for engine in ordered if self.healthy(engine)]
+
+    def mark_down(self, engine, error):
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_interval
+        logger.warning('Read replica %s is unavailable, retrying in %.0f s: %s',
+                       engine.url.render_as_string(hide_password=True),
+                       self.retry_interval, error)
+
+    def status(self):
+        return [dict(pool_stats(engine), healthy=self.healthy(engine))
+                for engine in self.engines]
+
+
+# Local Sticky Writes
+# Per-process record of recent writers; the default.
+
+class LocalStickyWrites:
+    """
+    Remembers, in this process, who wrote recently.
+
+    Args:
+        max_size (int): Maximum number of callers remembered.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._until = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, caller, seconds):
+        with self._lock:
+            self._until[caller] = time.monotonic() + seconds
+            self._until.move_to_end(caller)
+            while len(self._until) > self.max_size:
+                self._until.popitem(last=False)
+
+    def is_sticky(self, caller):
+        until = self._until.get(caller)
+        return until is not None and until > time.monotonic()
+
+
+# Redis Sticky Writes
+# Shared by all workers and hosts that point at the same Redis.
+
+class RedisStickyWrites:
+    """
+    Remembers recent writers in Redis, as keys that expire with the window.
+    Requires the optional 'redis' package.
+
+    Args:
+        url (str): Redis connection URL, e.g. redis://localhost:6379/0.
+        prefix (str): Key prefix.
+    """
+    def __init__(self, url, prefix='capstone:wrote:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "REPLICA_STICKY_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def mark(self, caller, seconds):
+        self.client.set(self.prefix + caller, 1, px=max(int(seconds * 1000), 1))
+
+    def is_sticky(self, caller):
+        return bool(self.client.exists(self.prefix + caller))
+
+
+def _caller(payload):
+    return payload.get('sub', '')
+
+
+def _remember_write(response):
+    if request.method not in SAFE_METHODS and response.status_code < 400 \
+            and 'jwt_payload' in g:
+        current_app.extensions['replica_sticky'].mark(
+            _caller(g.jwt_payload), current_app.config['REPLICA_STICKY_SECONDS'])
+    return response
+
+
+def _release_replica(exception=None):
+    # Reads streamed after the view returned still use the replica, as the
+    # request is only torn down once the response has been sent.
+    db.session.info.pop('read_bind', None)
+
+
+def init_replicas(app):
+    """
+    Sets up read routing over the replica engines created by setup_db(), if any.
+
+    REPLICA_STICKY_BACKEND selects 'local' (default) or 'redis'; a
+    REPLICA_STICKY_SECONDS of 0 turns read-your-writes stickiness off.
+    """
+    engines = app.extensions['replica_engines']
+    if not engines:
+        app.extensions['replicas'] = None
+        return None
+
+    replicas = ReplicaSet(engines, app.config['REPLICA_RETRY_INTERVAL'])
+    app.extensions['replicas'] = replicas
+    app.teardown_request(_release_replica)
+    if app.config['REPLICA_STICKY_SECONDS'] > 0:
+        backend = app.config['REPLICA_STICKY_BACKEND']
+        if backend == 'redis':
+            sticky = RedisStickyWrites(app.config['REDIS_URL'])
+        elif backend == 'local':
+            sticky = LocalStickyWrites()
+        else:
+            raise ValueError(f'Unknown REPLICA_STICKY_BACKEND {backend!r}')
+        app.extensions['replica_sticky'] = sticky
+        app.after_request(_remember_write)
+    return replicas
+
+
+def route_reads(replicas, payload):
+    """
+    Points the request's session at a replica, unless the caller wrote recently.
+
+    Process:
+        - Within REPLICA_STICKY_SECONDS of the caller's last write, reads stay on
+          the primary.
+        - Otherwise the session opens its connection on the next healthy replica
+          right away, so a replica that cannot be reached is found before the
+          route runs. It is marked down and the next one is tried.
+        - When no replica could be used, reads stay on the primary.
+    """
+    if _is_sticky(payload):
+        READ_ROUTING.labels('primary_sticky').inc()
+        return
+
+    for engine in replicas.candidates():
+        db.session.info['read_bind'] = engine
+        try:
+            db.session.connection()
+        except DBAPIError as e:
+            db.session.rollback()
+            replicas.mark_down(engine, e.orig)
+            continue
+        READ_ROUTING.labels('replica').inc()
+        return
+
+    db.session.info.pop('read_bind', None)
+    READ_ROUTING.labels('primary_fallback').inc()
+
+
+def _is_sticky(payload):
+    sticky = current_app.extensions.get('replica_sticky')
+    return sticky is not None and sticky.is_sticky(_caller(payload))
+
+
+def read_replica(f):
+    """
+    Decorator sending the queries of a read-only route to a read replica (see
+    route_reads()). It must be applied below requires_auth(), as stickiness is
+    per caller, and above conditional_get() and cached_response(), so that the
+    table versions and the data are read from the same database.
+    """
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        replicas = current_app.extensions.get('replicas')
+        if replicas is not None:
+            route_reads(replicas, payload)
+        return f(payload, *args, **kwargs)
+    return wrapper
+
+
+async def route_reads_async(replicas, payload):
+    """
+    route_reads() for the AsyncSession of the current request: the session is
+    opened on the async engine of the next healthy replica, and replaces the
+    primary session that get_async_session() would open.
+    """
+    if _is_sticky(payload):
+        READ_ROUTING.labels('primary_sticky').inc()
+        return
+
+    engines = current_app.extensions['async_replica_engines']
+    for engine in replicas.candidates():
+        session = current_app.extensions['async_db'](bind=engines[engine])
+        try:
+            await session.connection()
+        except DBAPIError as e:
+            await session.close()
+            replicas.mark_down(engine, e.orig)
+            continue
+        set_async_session(session)
+        READ_ROUTING.labels('replica').inc()
+        return
+
+    READ_ROUTING.labels('primary_fallback').inc()
+
+
+def read_replica_async(f):
+    """
+    read_replica() for the coroutine views of the ASGI entry point, applied
+    below requires_auth_async() and above conditional_get_async().
+    """
+    @wraps(f)
+    async def wrapper(payload, *args, **kwargs):
+        replicas = current_app.extensions.get('replicas')
+        if replicas is not None:
+            await route_reads_async(replicas, payload)
+        return await f(payload, *args, **kwargs)
+    return wrapper
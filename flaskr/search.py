@@ -0,0 +1,101 @@
+from flask import abort, request
+from sqlalchemy import Float, case, func, literal, or_
+from sqlalchemy.orm import with_expression
+from models import db
+from flaskr.pagination import paginate
+
+
+"""
+Search
+GET /search?q= and the q parameter of GET /movies and GET /actors match movie
+titles and actor names, most relevant first.
+
+On Postgres a row matches when the text contains q (ILIKE) or has a word
+similar to it (pg_trgm's word similarity, so "Cme" still finds "Cem Yilmaz").
+Both are answered from the GIN trigram indexes of migration e7a4b9c2d1f3.
+Relevance is 1 - word_similarity(q, text): 0 when a word starts with q.
+
+SQLite has no trigram index. The fallback is a case-insensitive substring match,
+a scan of the table without typo tolerance. Relevance is 0 for an exact match,
+1 for a prefix, 2 for a word prefix and 3 for any other substring.
+
+Ties are broken by id, and pages use the keyset cursors of flaskr/pagination.py
+with relevance as the sort key.
+"""
+
+# Shorter queries have no trigram to look up, so they would scan the index.
+MIN_QUERY_LENGTH = 3
+MAX_QUERY_LENGTH = 100
+
+
+def get_search_arg(required=False):
+    """
+    Reads ?q= from the current request. Returns None when it is absent.
+
+    Aborts:
+        400: If q is missing while required, or shorter than MIN_QUERY_LENGTH or
+        longer than MAX_QUERY_LENGTH characters once stripped.
+    """
+    q = request.args.get('q', None)
+    if q is None:
+        if required:
+            abort(400, "q is required")
+        return None
+
+    q = q.strip()
+    if not MIN_QUERY_LENGTH <= len(q) <= MAX_QUERY_LENGTH:
+        abort(400, f"q must be {MIN_QUERY_LENGTH} to {MAX_QUERY_LENGTH} characters")
+    return q
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def match(column, q):
+    """
+    Returns (condition, relevance) for searching column for q on the app's
+    database. Lower relevance is more relevant.
+    """
+    contains = column.ilike(f'%{_escape_like(q)}%', escape='\\')
+    if db.engine.dialect.name == 'postgresql':
+        # column %> q is q <% column, the form the trigram index can serve.
+        similarity = func.word_similarity(q, column, type_=Float)
+        return or_(contains, column.op('%>')(q)), literal(1.0, Float) - similarity
+
+    lowered, q = func.lower(column), q.lower()
+    relevance = case(
+        (lowered == q, 0),
+        (lowered.like(f'{_escape_like(q)}%', escape='\\'), 1),
+        (lowered.like(f'% {_escape_like(q)}%', escape='\\'), 2),
+        else_=3)
+    return contains, relevance
+
+
+def apply_search(query, model, column, sortable):
+    """
+    Applies ?q= to a list query of model, matching column.
+
+    Returns:
+        tuple: (query, sortable, default_sort). While searching, 'relevance' is
+        added to the sort orders and is the default; model.relevance is loaded
+        so the cursor can be built from the last row.
+    """
+    q = get_search_arg()
+    if q is None:
+        return query, sortable, 'id'
+
+    condition, relevance = match(column, q)
+    query = query.filter(condition) \
+        .options(with_expression(model.relevance, relevance))
+    return query, dict(sortable, relevance=relevance.label('relevance')), 'relevance'
+
+
+def search_page(model, column, limit, load_options=()):
+    """
+    Returns (rows, next_cursor) for the first page of model rows matching ?q=,
+    most relevant first. The cursor continues the list route's search.
+    """
+    query, sorts, _ = apply_search(model.query.options(*load_options), model, column, {})
+    return paginate(query, model.id, limit, None,
+                    ('relevance', sorts['relevance'], False))
@@ -0,0 +1,134 @@
+from sqlalchemy import Integer, func, literal_column, select
+from models import db, Movie, Actor
+from flaskr.filters import filter_movies
+from flaskr.pagination import encode_cursor
+
+
+"""
+Statistics
+GET /stats/movies and GET /stats/actors aggregate casts in the database with
+GROUP BY over actors.movie_id, optionally limited to movies released in a
+window (the released_after and released_before filters of GET /movies), so a
+report costs one or two small queries instead of downloading both tables.
+Both routes are served from the response cache until movies or actors change.
+
+Genders are grouped as stored and ages counted per decade; actors without a
+gender or an age are counted under 'unknown'.
+"""
+
+
+UNKNOWN = 'unknown'
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _age_summary(count, total, youngest, oldest):
+    return {
+        'min': youngest,
+        'max': oldest,
+        'average': round(total / count, 1) if count else None
+    }
+
+
+def _decade_labels(decades):
+    # {20: n, None: m} -> {'20-29': n, 'unknown': m}, youngest first.
+    ordered = sorted(decades.items(), key=lambda item: (item[0] is None, item[0] or 0))
+    return {f'{bucket}-{bucket + 9}' if bucket is not None else UNKNOWN: actors
+            for bucket, actors in ordered}
+
+
+def movie_stats(limit, cursor=None):
+    """
+    Returns (movies, next_cursor) for one page of movies in id order, each with
+    its cast size, ages and gender split, read with one query.
+    """
+    page = filter_movies(select(Movie.id)).order_by(Movie.id).limit(limit + 1)
+    if cursor is not None:
+        page = page.where(Movie.id > cursor['id'])
+
+    # One row per (movie, gender); a movie without actors has one NULL row.
+    rows = db.session.execute(
+        select(Movie.id, Movie.title, Movie.release_date, Actor.gender,
+               func.count(Actor.id), func.sum(Actor.age), func.count(Actor.age),
+               func.min(Actor.age), func.max(Actor.age))
+        .outerjoin(Actor, Actor.movie_id == Movie.id)
+        .where(Movie.id.in_(page.scalar_subquery()))
+        .group_by(Movie.id, Movie.title, Movie.release_date, Actor.gender)
+        .order_by(Movie.id)).all()
+
+    movies = {}
+    for movie_id, title, release_date, gender, actors, age_total, aged, \
+            youngest, oldest in rows:
+        stats = movies.setdefault(movie_id, {
+            'id': movie_id, 'title': title, 'release_date': _isoformat(release_date),
+            'cast_size': 0, 'genders': {}, '_ages': [0, 0, None, None]})
+        if not actors:
+            continue
+        stats['cast_size'] += actors
+        stats['genders'][gender or UNKNOWN] = actors
+        ages = stats['_ages']
+        ages[0] += aged
+        ages[1] += age_total or 0
+        if youngest is not None:
+            ages[2] = youngest if ages[2] is None else min(ages[2], youngest)
+            ages[3] = oldest if ages[3] is None else max(ages[3], oldest)
+
+    movies = list(movies.values())
+    for stats in movies:
+        stats['ages'] = _age_summary(*stats.pop('_ages'))
+
+    next_cursor = None
+    if len(movies) > limit:
+        movies = movies[:limit]
+        next_cursor = encode_cursor(movies[-1]['id'])
+    return movies, next_cursor
+
+
+def actor_stats():
+    """
+    Returns the gender split, age distribution and cast size distribution of
+    all actors, or of the casts of movies in the release window, with two
+    queries.
+    """
+    # Inline constants, so the GROUP BY expression matches the selected one.
+    ten = literal_column('10', Integer)
+    decade = (Actor.age // ten) * ten
+    query = select(Actor.gender, decade, func.count(), func.sum(Actor.age),
+                   func.min(Actor.age), func.max(Actor.age)) \
+        .group_by(Actor.gender, decade)
+    windowed = filter_movies(select(Movie.id))
+    if windowed.whereclause is not None:
+        query = query.join(Movie, Actor.movie_id == Movie.id) \
+            .where(windowed.whereclause)
+
+    total, genders, decades = 0, {}, {}
+    aged, age_total, youngest, oldest = 0, 0, None, None
+    for gender, bucket, actors, ages, low, high in db.session.execute(query):
+        total += actors
+        genders[gender or UNKNOWN] = genders.get(gender or UNKNOWN, 0) + actors
+        decades[bucket] = decades.get(bucket, 0) + actors
+        if bucket is not None:
+            aged += actors
+            age_total += ages
+            youngest = low if youngest is None else min(youngest, low)
+            oldest = high if oldest is None else max(oldest, high)
+
+    cast_sizes = filter_movies(
+        select(func.count(Actor.id).label('cast_size'))
+        .select_from(Movie).outerjoin(Actor, Actor.movie_id == Movie.id)
+        .group_by(Movie.id)).subquery()
+    sizes = db.session.execute(
+        select(cast_sizes.c.cast_size, func.count())
+        .group_by(cast_sizes.c.cast_size)
+        .order_by(cast_sizes.c.cast_size)).all()
+
+    return {
+        'actors': total,
+        'genders': genders,
+        'ages': dict(_age_summary(aged, age_total, youngest, oldest),
+                     decades=_decade_labels(decades)),
+        'movies': sum(movies for _, movies in sizes),
+        'cast_sizes': {str(size): movies for size, movies in sizes}
+    }
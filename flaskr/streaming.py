@@ -0,0 +1,43 @@
+from flask import Response, current_app, request, stream_with_context
+
+
+"""
+Streaming Exports
+GET /movies and GET /actors can stream every matching row as newline-delimited
+JSON instead of returning one page. Rows are read through a server-side cursor
+in batches of STREAM_BATCH_SIZE and written to the client as they are
+serialized, so memory stays flat however large the table is and the first
+bytes are sent after the first batch rather than after the whole table.
+"""
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_stream():
+    """
+    True when the client asked for NDJSON with ?stream=1 or the Accept header.
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON]) == NDJSON
+
+
+def stream_ndjson(query, fields=None):
+    """
+    Returns a response that streams query results, one format() per line.
+
+    Args:
+        query: Ordered SQLAlchemy query of Movie or Actor rows.
+        fields (dict): Sparse fieldset passed to format(), or None for all fields.
+    """
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        # yield_per turns on a server-side cursor (stream_results) and keeps only
+        # one batch of ORM objects alive at a time.
+        for row in query.yield_per(batch_size):
+            yield dumps(row.format(fields)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
@@ -0,0 +1,115 @@
+import glob
+import logging
+import multiprocessing
+import os
+
+
+'''
+gunicorn configuration
+        loaded by gunicorn from the working directory (see Procfile). Every
+        value can be overridden from the environment:
+
+        GUNICORN_WORKER_CLASS         gthread (default), gevent or sync
+        WEB_CONCURRENCY               worker processes (CPU count, at least 2;
+                                      2 x CPU count + 1 for sync workers)
+        GUNICORN_THREADS              threads per gthread worker (DB_POOL_SIZE)
+        GUNICORN_WORKER_CONNECTIONS   concurrent requests per gevent worker (100)
+        GUNICORN_PRELOAD              import the app once in the master (true)
+        GUNICORN_TIMEOUT              seconds before a silent worker is killed (30)
+        GUNICORN_GRACEFUL_TIMEOUT     seconds a worker gets to finish its
+                                      requests on restart or shutdown (30)
+        GUNICORN_KEEPALIVE            seconds an idle keep-alive connection is
+                                      held open (5)
+        GUNICORN_MAX_REQUESTS         restart a worker after this many requests,
+                                      0 to never (0)
+        DB_MAX_CONNECTIONS            connections the database accepts from this
+                                      deployment; a warning is logged when the
+                                      workers' pools could exceed it
+
+        Requests mostly wait on the database and on Auth0, so a worker serves
+        several at once: gthread runs one request per thread, and gevent one
+        per greenlet with psycopg2 made cooperative by psycogreen. A gthread
+        worker gets one thread per pooled connection (DB_POOL_SIZE), so a
+        thread never waits for a connection. benchmarks/gunicorn_profiles.py
+        compares the profiles.
+'''
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+cpu_count = multiprocessing.cpu_count()
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Patched before the app is preloaded, so that every socket, lock and
+    # psycopg2 connection the app creates cooperates with gevent.
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        raise RuntimeError("GUNICORN_WORKER_CLASS=gevent requires the 'gevent' "
+                           "and 'psycogreen' packages")
+    monkey.patch_all()
+    patch_psycopg()
+
+if worker_class == 'sync':
+    workers = _env_int('WEB_CONCURRENCY', 2 * cpu_count + 1)
+else:
+    workers = _env_int('WEB_CONCURRENCY', max(2, cpu_count))
+
+if worker_class == 'gthread':
+    threads = _env_int('GUNICORN_THREADS', _env_int('DB_POOL_SIZE', 5))
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() \
+    in ('1', 'true', 'yes')
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 0)
+max_requests_jitter = max_requests // 10
+
+
+'''
+Hooks
+'''
+
+
+def on_starting(server):
+    # Per-process metric files of a previous run would be added to this one's.
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(path)
+
+    if worker_class == 'gevent' and \
+            os.environ.get('DATABASE_URL', '').startswith('sqlite'):
+        # sqlite3 waits for a lock in C, blocking every greenlet of the worker,
+        # including the one holding the lock.
+        logger.warning('gevent workers stall on concurrent SQLite writes; use '
+                       'gthread workers with SQLite')
+
+    max_connections = _env_int('DB_MAX_CONNECTIONS', 0)
+    per_worker = _env_int('DB_POOL_SIZE', 5) + _env_int('DB_MAX_OVERFLOW', 10)
+    if max_connections and server.cfg.workers * per_worker > max_connections:
+        logger.warning('%d workers may open up to %d database connections each, '
+                       'more than DB_MAX_CONNECTIONS=%d', server.cfg.workers,
+                       per_worker, max_connections)
+
+
+def post_fork(server, worker):
+    # A preloaded app's pools and caches belong to the master; the worker opens
+    # its own connections and fetches its own key set.
+    import db_pool
+    import auth.auth
+    db_pool.reset_pools()
+    auth.auth.reset_after_fork()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
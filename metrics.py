@@ -0,0 +1,184 @@
+import os
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, \
+    Histogram, generate_latest, multiprocess, REGISTRY
+from sqlalchemy import event
+
+
+'''
+Metrics
+        Prometheus metrics for every request: latency per route, the number of
+        SQL statements and the time spent in them, and separate timers for the
+        JWKS fetch, JWT verification and serialization. They are served in the
+        Prometheus text format by GET /metrics.
+
+        Under several gunicorn workers each process keeps its own counters.
+        Set PROMETHEUS_MULTIPROC_DIR to an empty directory writable by all
+        workers (before the server starts) and /metrics aggregates every
+        worker's values, whichever worker answers the scrape.
+'''
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to build the response of a request.',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements executed per request.',
+    ['method', 'route'], buckets=STATEMENT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'http_request_sql_seconds', 'Time spent executing SQL per request.',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+SERIALIZATION_SECONDS = Histogram(
+    'serialization_seconds', 'Time spent formatting rows and encoding JSON.',
+    ['route'], buckets=LATENCY_BUCKETS)
+JWKS_FETCH_SECONDS = Histogram(
+    'auth_jwks_fetch_seconds', 'Time to fetch the JSON Web Key Set.',
+    buckets=LATENCY_BUCKETS)
+JWT_VERIFY_SECONDS = Histogram(
+    'auth_jwt_verify_seconds', 'Time to verify and decode a JWT.',
+    buckets=LATENCY_BUCKETS)
+TOKEN_CACHE_LOOKUPS = Counter(
+    'auth_token_cache_lookups_total', 'Verified token cache lookups.', ['result'])
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'response_cache_lookups_total', 'Response cache lookups by result: hit, '
+    'stale (expired copy served) or miss.', ['route', 'result'])
+READ_ROUTING = Counter(
+    'db_read_routing_total', 'Read-only requests by the database they were '
+    'routed to: replica, primary_sticky or primary_fallback.', ['target'])
+
+
+def _route():
+    rule = request.url_rule if has_request_context() else None
+    return rule.rule if rule is not None else '<unmatched>'
+
+
+def _add(name, seconds):
+    if has_request_context():
+        g.setdefault('timings', {}).setdefault(name, 0.0)
+        g.timings[name] += seconds
+
+
+@contextmanager
+def timed(histogram, timing=None, **labels):
+    '''
+    observes the duration of the block in histogram, and adds it to the
+    current request's Server-Timing entry named timing
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        (histogram.labels(**labels) if labels else histogram).observe(elapsed)
+        if timing:
+            _add(timing, elapsed)
+
+
+@contextmanager
+def serialization_timer():
+    with timed(SERIALIZATION_SECONDS, 'serialize', route=_route()):
+        yield
+
+
+def count_cache_lookup(result):
+    RESPONSE_CACHE_LOOKUPS.labels(_route(), result).inc()
+
+
+'''
+SQL instrumentation
+        cursor events of every engine add the statement count and time to the
+        request that issued them
+'''
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # Kept on the statement's execution context rather than the connection, so
+    # a statement that raises, and never reaches after_cursor_execute, leaves
+    # nothing behind to skew the timing of the next one.
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = getattr(context, 'query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        _add('db', elapsed)
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = _route()
+    REQUEST_LATENCY.labels(request.method, route, response.status_code) \
+        .observe(elapsed)
+
+    timings = g.get('timings', {})
+    REQUEST_SQL_STATEMENTS.labels(request.method, route) \
+        .observe(g.get('sql_statements', 0))
+    REQUEST_SQL_SECONDS.labels(request.method, route) \
+        .observe(timings.get('db', 0.0))
+
+    response.headers['Server-Timing'] = ', '.join(
+        [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items()]
+        + [f'total;dur={elapsed * 1000:.2f}'])
+    return response
+
+
+def registry():
+    '''
+    returns the registry to expose: every worker's values when
+    PROMETHEUS_MULTIPROC_DIR is set, otherwise this process's
+    '''
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return REGISTRY
+
+
+def metrics_response():
+    return generate_latest(registry()), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def mark_process_dead(pid):
+    '''
+    to be called by the server when a worker exits (gunicorn's child_exit), so
+    its live gauges are dropped from the multiprocess directory
+    '''
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+'''
+init_metrics(app)
+        times every request of app and instruments its database engines
+'''
+
+
+def init_metrics(app, engines):
+    for engine in engines:
+        instrument_engine(engine)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,40 @@
+"""add filter and sort indexes
+
+Revision ID: 4d2e8a1c5b7f
+Revises: 7bce976g657a
+Create Date: 2026-10-18 10:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d2e8a1c5b7f'
+down_revision = '7bce976g657a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_movies_release_date_id', 'movies',
+                    ['release_date', 'id'], unique=False)
+    op.create_index('ix_movies_title_id', 'movies',
+                    ['title', 'id'], unique=False)
+    op.create_index('ix_actors_movie_id_id', 'actors',
+                    ['movie_id', 'id'], unique=False)
+    op.create_index('ix_actors_age_id', 'actors',
+                    ['age', 'id'], unique=False)
+    op.create_index('ix_actors_name_id', 'actors',
+                    ['name', 'id'], unique=False)
+    op.create_index('ix_actors_gender_age_id', 'actors',
+                    ['gender', 'age', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actors_gender_age_id', table_name='actors')
+    op.drop_index('ix_actors_name_id', table_name='actors')
+    op.drop_index('ix_actors_age_id', table_name='actors')
+    op.drop_index('ix_actors_movie_id_id', table_name='actors')
+    op.drop_index('ix_movies_title_id', table_name='movies')
+    op.drop_index('ix_movies_release_date_id', table_name='movies')
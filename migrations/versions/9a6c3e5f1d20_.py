@@ -0,0 +1,33 @@
+"""add table_versions
+
+Revision ID: 9a6c3e5f1d20
+Revises: 4d2e8a1c5b7f
+Create Date: 2026-10-18 11:03:17.542861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6c3e5f1d20'
+down_revision = '4d2e8a1c5b7f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'movies', 'version': 0},
+        {'name': 'actors', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,38 @@
+"""add movie_documents
+
+Revision ID: b5d8f2a6c913
+Revises: e7a4b9c2d1f3
+Create Date: 2026-10-18 19:12:44.905163
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d8f2a6c913'
+down_revision = 'e7a4b9c2d1f3'
+branch_labels = None
+depends_on = None
+
+
+# Created empty; fill it with "flask documents rebuild" (see flaskr/documents.py).
+def upgrade():
+    op.create_table(
+        'movie_documents',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('release_date', sa.DateTime(), nullable=True),
+        sa.Column('document', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_movie_documents_release_date_id', 'movie_documents',
+                    ['release_date', 'id'], unique=False)
+    op.create_index('ix_movie_documents_title_id', 'movie_documents',
+                    ['title', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movie_documents_title_id', table_name='movie_documents')
+    op.drop_index('ix_movie_documents_release_date_id', table_name='movie_documents')
+    op.drop_table('movie_documents')
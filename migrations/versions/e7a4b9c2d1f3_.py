@@ -0,0 +1,36 @@
+"""add trigram search indexes
+
+Revision ID: e7a4b9c2d1f3
+Revises: c3f1a7e9b2d4
+Create Date: 2026-10-18 18:05:27.640113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4b9c2d1f3'
+down_revision = 'c3f1a7e9b2d4'
+branch_labels = None
+depends_on = None
+
+
+# Postgres only; SQLite searches without an index (see flaskr/search.py).
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'], unique=False,
+                    postgresql_using='gin',
+                    postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'], unique=False,
+                    postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
@@ -1,29 +1,234 @@
 import os
+import click
 from sqlalchemy import ForeignKey, Column, String, Integer, \
-                    DateTime, create_engine
-from sqlalchemy.orm import relationship
+                    DateTime, Index, Float, Text, create_engine, insert, update, \
+                    select, delete, exists, func, event, inspect, DDL
+from sqlalchemy.orm import relationship, query_expression
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask_sqlalchemy.session import Session
+from serializers import serializer_for
+from db_pool import engine_options, track_engine
 
-database_path = os.environ['DATABASE_URL']
-if database_path.startswith("postgres://"):
-  database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
+'''
+RoutingSession
+        the session of db. While its info holds a 'read_bind' (an engine of a
+        read replica, see flaskr/replicas.py) every query is sent there;
+        flushes and INSERT, UPDATE and DELETE statements still go to the
+        primary
+'''
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        read_bind = self.info.get('read_bind')
+        if bind is None and read_bind is not None and not self._flushing \
+                and not getattr(clause, 'is_dml', False):
+            return read_bind
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 '''
 setup_db(app)
-        binds a flask application and a SQLAlchemy service
+        binds a flask application and a SQLAlchemy service, with connection
+        pool options taken from the environment (see db_pool.py). The database
+        URL defaults to DATABASE_URL, read when the app is set up rather than
+        when this module is imported. Each of replica_paths gets an engine with
+        the same pool options, kept in app.extensions['replica_engines']; they
+        are only used by routed reads
 '''
 
 
-def setup_db(app, database_path=database_path):
+def _normalize_url(database_path):
+    if database_path.startswith("postgres://"):
+        return database_path.replace("postgres://", "postgresql://", 1)
+    return database_path
+
+
+def setup_db(app, database_path=None, replica_paths=()):
+    if database_path is None:
+        database_path = os.environ['DATABASE_URL']
+    database_path = _normalize_url(database_path)
 
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.extensions['replica_engines'] = [
+        create_engine(path, **engine_options(path))
+        for path in map(_normalize_url, replica_paths)]
     db.app = app
     db.init_app(app)
-    Migrate(app, db)
+    app.cli.add_command(_MigrateCommands(app))
+    with app.app_context():
+        for engine in [*db.engines.values(), *app.extensions['replica_engines']]:
+            track_engine(engine)
+
+
+'''
+_MigrateCommands
+        the "flask db" commands of Flask-Migrate. Alembic is only imported and
+        Migrate(app, db) only set up when one of them runs, so serving the app
+        never pays for it
+'''
+class _MigrateCommands(click.Group):
+
+    def __init__(self, app):
+        super().__init__('db', help='Perform database migrations.')
+        self.app = app
+
+    def _commands(self):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_commands
+        if 'migrate' not in self.app.extensions:
+            Migrate(self.app, db)
+        return migrate_commands
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+
+'''
+table : TableVersion
+        one row per data table, counting the writes made to it. The counters
+        change in the same transaction as the data, so every worker sees the
+        same version and list responses can be tagged without reading the data
+'''
+class TableVersion(db.Model):
+
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+'''
+table : IdempotencyKey
+        the outcome of a create request sent with an Idempotency-Key header
+        (see flaskr/idempotency.py). status_code stays NULL while the first
+        request is being processed
+'''
+class IdempotencyKey(db.Model):
+
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    created_at = Column(Float, nullable=False, index=True)
+    expires_at = Column(Float, nullable=False, index=True)
+    status_code = Column(Integer)
+    content_type = Column(String)
+    body = Column(Text)
+
+
+def bump_versions(*names):
+    # Each update locks its counter row until commit; taking them in name
+    # order keeps writers that bump several tables from deadlocking.
+    for name in sorted(set(names)):
+        result = db.session.execute(
+            update(TableVersion)
+            .where(TableVersion.name == name)
+            .values(version=TableVersion.version + 1))
+        if result.rowcount == 0:
+            db.session.add(TableVersion(name=name, version=1))
+            db.session.flush()
+
+
+def _versions_select(names):
+    return select(TableVersion.name, TableVersion.version) \
+        .where(TableVersion.name.in_(names))
+
+
+def get_versions(*names):
+    '''
+    returns the current version of each table, 0 for tables never written
+    '''
+    versions = dict(db.session.execute(_versions_select(names)).all())
+    return tuple(versions.get(name, 0) for name in names)
+
+
+async def get_versions_async(session, *names):
+    '''
+    get_versions() through an AsyncSession (see flaskr/async_db.py)
+    '''
+    versions = dict((await session.execute(_versions_select(names))).all())
+    return tuple(versions.get(name, 0) for name in names)
+
+
+'''
+_bulk_insert(model, rows)
+        inserts a list of column dicts with one multi-row INSERT ... RETURNING
+        in a single transaction and returns the new ids in the order of rows
+'''
+
+
+def _bulk_insert(model, rows):
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    try:
+        ids = list(db.session.scalars(statement, rows))
+        refresh_movie_documents(
+            ids if model is Movie else [row.get('movie_id') for row in rows])
+        bump_versions(model.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return ids
+
+
+def _execute_dml(statement):
+    # Set-based statements bypass the identity map: nothing is loaded to
+    # delete or update it, so the statement count does not grow with the rows.
+    return db.session.execute(
+        statement, execution_options={'synchronize_session': False})
+
+
+'''
+Dependent actors
+        what deleting a movie does to its actors: 'detach' sets their movie_id
+        to NULL, 'cascade' deletes them, 'reject' refuses to delete a movie
+        that still has actors
+'''
+ACTOR_POLICIES = ('detach', 'cascade', 'reject')
+
+
+def apply_actor_policy(movie_ids, policy):
+    '''
+    applies policy to the actors of movie_ids with at most one statement,
+    without committing. returns the number of actors detached or deleted, or
+    under 'reject' the number that block the delete
+    '''
+    in_movies = Actor.movie_id.in_(movie_ids)
+    if policy == 'reject':
+        return db.session.scalar(
+            select(func.count()).select_from(Actor).where(in_movies))
+    if policy == 'cascade':
+        return _execute_dml(delete(Actor).where(in_movies)).rowcount
+    if policy == 'detach':
+        return _execute_dml(
+            update(Actor).where(in_movies).values(movie_id=None)).rowcount
+    raise ValueError(f'Unknown actor policy {policy!r}')
+
+
+'''
+Search indexes
+        GIN trigram indexes on movies.title and actors.name serve the
+        substring and similarity matches of flaskr/search.py. They need the
+        pg_trgm extension and exist on Postgres only
+'''
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+def _trigram_index(name, column):
+    return Index(name, column, postgresql_using='gin',
+                 postgresql_ops={column: 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
 
 
 '''
@@ -32,11 +237,22 @@ table : Movie
 class Movie(db.Model):
 
     __tablename__ = 'movies'
+    # (sort column, id) indexes serve both filters and keyset pagination.
+    __table_args__ = (
+        Index('ix_movies_release_date_id', 'release_date', 'id'),
+        Index('ix_movies_title_id', 'title', 'id'),
+        _trigram_index('ix_movies_title_trgm', 'title'),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String)
     release_date = Column(DateTime)
     actors = relationship('Actor', backref="movie", lazy=True)
+    # Search rank, only loaded by searches (see flaskr/search.py).
+    relevance = query_expression()
+
+    # Fields emitted by format(), in order.
+    serialized_fields = ('id', 'title', 'release_date', 'actors')
 
     def __init__(self, title, release_date):
         self.title = title
@@ -44,22 +260,63 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        refresh_movie_documents([self.id])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
+    @classmethod
+    def bulk_insert(cls, rows):
+        return _bulk_insert(cls, rows)
+
     def update(self):
+        refresh_movie_documents([self.id])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        refresh_movie_documents([self.id])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
-    def format(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'release_date': self.release_date,
-            'actors': list(map(lambda actor: actor.format(), self.actors))
-        }
+    @classmethod
+    def delete_by_id(cls, movie_id, actor_policy='detach'):
+        '''
+        deletes a movie with one DELETE ... RETURNING, after applying
+        actor_policy to its actors, in one transaction and without loading
+        either. returns (deleted, actor_count): deleted is False when the movie
+        does not exist or, under 'reject', still has actors (actor_count > 0)
+        '''
+        try:
+            statement = delete(cls).where(cls.id == movie_id).returning(cls.id)
+            if actor_policy == 'reject':
+                statement = statement.where(
+                    ~exists().where(Actor.movie_id == movie_id))
+                actor_count = 0
+            else:
+                actor_count = apply_actor_policy([movie_id], actor_policy)
+            deleted = _execute_dml(statement).scalar() is not None
+
+            if not deleted:
+                db.session.rollback()
+                if actor_policy == 'reject':
+                    actor_count = apply_actor_policy([movie_id], actor_policy)
+                return False, actor_count
+            refresh_movie_documents([movie_id])
+            bump_versions(cls.__tablename__, *(['actors'] if actor_count else []))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return True, actor_count
+
+    def format(self, fields=None):
+        '''
+        fields optionally limits the output, mapping field names to None or,
+        for 'actors', to the list of actor fields to include
+        '''
+        return serializer_for(Movie, fields)(self)
 
 '''
 Table :- Actor
@@ -67,12 +324,22 @@ Table :- Actor
 class Actor(db.Model):
 
     __tablename__ = 'actors'
+    __table_args__ = (
+        Index('ix_actors_movie_id_id', 'movie_id', 'id'),
+        Index('ix_actors_age_id', 'age', 'id'),
+        Index('ix_actors_name_id', 'name', 'id'),
+        Index('ix_actors_gender_age_id', 'gender', 'age', 'id'),
+        _trigram_index('ix_actors_name_trgm', 'name'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
     movie_id = Column(Integer, ForeignKey('movies.id'), nullable=True)
+    relevance = query_expression()
+
+    serialized_fields = ('id', 'name', 'age', 'gender', 'movie_id')
 
     def __init__(self, name, age, gender, movie_id):
         self.name = name
@@ -82,20 +349,147 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        refresh_movie_documents([self.movie_id])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
+    @classmethod
+    def bulk_insert(cls, rows):
+        return _bulk_insert(cls, rows)
+
     def update(self):
+        # Moving an actor changes the cast of the movie it left as well.
+        refresh_movie_documents(
+            [self.movie_id, *inspect(self).attrs.movie_id.history.deleted])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        refresh_movie_documents([self.movie_id])
+        bump_versions(self.__tablename__)
         db.session.commit()
 
-    def format(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'age': self.age,
-            'gender': self.gender,
-            "movie_id": self.movie_id
-        }
+    @classmethod
+    def delete_where(cls, *criteria):
+        '''
+        deletes every actor matching criteria with one DELETE ... RETURNING and
+        returns their ids
+        '''
+        try:
+            deleted = _execute_dml(
+                delete(cls).where(*criteria).returning(cls.id, cls.movie_id)).all()
+            ids = [actor_id for actor_id, _ in deleted]
+            if ids:
+                refresh_movie_documents([movie_id for _, movie_id in deleted])
+                bump_versions(cls.__tablename__)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return ids
+
+    def format(self, fields=None):
+        return serializer_for(Actor, fields)(self)
+
+
+'''
+table : MovieDocument
+        the read model of GET /movies: one row per movie holding the JSON of
+        movie.format(), cast included, with copies of the columns the list is
+        filtered and sorted by. Kept in the same transaction as every write to
+        movies and actors while MOVIE_DOCUMENTS is 'maintain' or 'serve' (see
+        flaskr/documents.py)
+'''
+class MovieDocument(db.Model):
+
+    __tablename__ = 'movie_documents'
+    __table_args__ = (
+        Index('ix_movie_documents_release_date_id', 'release_date', 'id'),
+        Index('ix_movie_documents_title_id', 'title', 'id'),
+    )
+
+    # The movie's id; rows are deleted with the movie rather than by a
+    # foreign key, so documents can be rebuilt without touching movies.
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    release_date = Column(DateTime)
+    document = Column(Text, nullable=False)
+
+
+'''
+MOVIE_DOCUMENTS
+        'off' leaves movie_documents alone, 'maintain' rewrites the documents
+        of the movies each write touches, 'serve' also reads GET /movies from
+        them
+'''
+DOCUMENT_MODES = ('off', 'maintain', 'serve')
+
+
+def build_movie_documents(movie_ids):
+    '''
+    returns the movie_documents rows of the movies in movie_ids that exist,
+    read from movies and actors with two queries
+    '''
+    movie_fields = {name: None for name in Movie.serialized_fields
+                    if name != 'actors'}
+    serialize_movie = serializer_for(Movie, movie_fields)
+    serialize_actor = serializer_for(Actor)
+
+    casts = {}
+    for actor in db.session.execute(
+            select(*(getattr(Actor, name) for name in Actor.serialized_fields))
+            .where(Actor.movie_id.in_(movie_ids))
+            .order_by(Actor.movie_id, Actor.id)):
+        casts.setdefault(actor.movie_id, []).append(serialize_actor(actor))
+
+    movies = db.session.execute(
+        select(*(getattr(Movie, name) for name in movie_fields))
+        .where(Movie.id.in_(movie_ids)).order_by(Movie.id))
+    return [{'id': movie.id, 'title': movie.title,
+             'release_date': movie.release_date,
+             'document': current_app.json.dumps(
+                 dict(serialize_movie(movie), actors=casts.get(movie.id, [])))}
+            for movie in movies]
+
+
+def refresh_movie_documents(movie_ids):
+    '''
+    rewrites the documents of movie_ids from the pending state of the session,
+    without committing, unless MOVIE_DOCUMENTS is 'off'. documents are upserted
+    and documents of movies that no longer exist are deleted
+    '''
+    movie_ids = {movie_id for movie_id in movie_ids if movie_id is not None}
+    if not movie_ids or current_app.config['MOVIE_DOCUMENTS'] == 'off':
+        return
+    db.session.flush()
+    rows = build_movie_documents(movie_ids)
+    gone = movie_ids - {row['id'] for row in rows}
+    if gone:
+        _execute_dml(delete(MovieDocument).where(MovieDocument.id.in_(gone)))
+    upsert_movie_documents(rows)
+
+
+UPSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+
+def upsert_movie_documents(rows):
+    '''
+    writes rows built by build_movie_documents(), replacing the documents
+    already stored for their ids. on Postgres and SQLite this is one
+    INSERT ... ON CONFLICT (id) DO UPDATE, so two transactions rewriting the
+    same document wait on the row instead of failing on the primary key
+    '''
+    if not rows:
+        return
+    dialect_insert = UPSERTS.get(db.session.get_bind(MovieDocument).dialect.name)
+    if dialect_insert is None:
+        _execute_dml(delete(MovieDocument).where(
+            MovieDocument.id.in_([row['id'] for row in rows])))
+        db.session.execute(insert(MovieDocument), rows)
+        return
+    statement = dialect_insert(MovieDocument)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[MovieDocument.id],
+        set_={name: statement.excluded[name]
+              for name in ('title', 'release_date', 'document')}), rows)
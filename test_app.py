@@ -1,10 +1,161 @@
+import asyncio
 import os
 import unittest
 import json
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, select, update
+import rsa
+from jose import jwk, jwt
 
 from flaskr import create_app
-from models import db, Movie, Actor
+from models import db, Movie, Actor, MovieDocument, IdempotencyKey, bump_versions, \
+    refresh_movie_documents
+from flaskr.idempotency import prune_keys
+from flaskr.replicas import LocalStickyWrites
+from flaskr.documents import check_movie_documents, rebuild_movie_documents
+import auth.auth as auth_module
+from auth.jwks import JWKSKeyStore, JWKSFetchError
+from auth.token_cache import VerifiedTokenCache
+from serializers import serializer_for
+import flaskr.json_provider as json_provider
+from flask import Flask, g
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+import db_pool
+from db_pool import engine_options, TimedQueuePool
+from models import setup_db
+from flaskr.asgi import create_asgi_app
+from prometheus_client import REGISTRY
+
+
+def generate_signing_key(kid='test-key'):
+    """Create an RSA key pair and the public JWK used to mint local test tokens."""
+    public_key, private_key = rsa.newkeys(2048)
+    public_jwk = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig'})
+    return private_key.save_pkcs1().decode(), public_jwk
+
+
+def mint_token(private_pem, kid, permissions, expires_in=3600, sub='auth0|test'):
+    """Sign a token the app accepts, with the given permissions claim."""
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{auth_module.AUTH0_DOMAIN}/',
+        'aud': auth_module.API_AUDIENCE,
+        'sub': sub,
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256',
+                      headers={'kid': kid})
+
+
+class LocalAuthTestCase(unittest.TestCase):
+    """
+    Runs the app with locally minted tokens, verified through a JWKS file
+    instead of Auth0, against DATABASE_URL_Test or, when that is unset, a
+    temporary SQLite file per test. DATABASE_URL is never used, since every
+    test drops the tables it created.
+    """
+    kid = 'test-key'
+    signing_key = None
+
+    @classmethod
+    def setUpClass(cls):
+        if LocalAuthTestCase.signing_key is None:
+            LocalAuthTestCase.signing_key = generate_signing_key(cls.kid)
+        cls.private_pem, public_jwk = LocalAuthTestCase.signing_key
+
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        jwks_path = os.path.join(cls.tmpdir.name, 'jwks.json')
+        with open(jwks_path, 'w') as f:
+            json.dump({'keys': [public_jwk]}, f)
+
+        cls.jwks_url = 'file://' + jwks_path
+
+        with open('auth_config.json', 'r') as f:
+            cls.roles = json.loads(f.read())['roles']
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        auth_module.token_cache = VerifiedTokenCache()
+        self.app = create_app(self.app_config())
+        self.client = self.app.test_client
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+    def database_file(self):
+        db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        db_file.close()
+        self.addCleanup(os.unlink, db_file.name)
+        return db_file.name
+
+    def app_config(self, **config):
+        """create_app() settings pointing at the test database."""
+        database_url = os.environ.get('DATABASE_URL_Test') or \
+            'sqlite:///' + self.database_file()
+        return dict({'SQLALCHEMY_DATABASE_URI': database_url,
+                     'AUTH0_JWKS_URL': self.jwks_url}, **config)
+
+    def seed_movies(self, count):
+        with self.app.app_context():
+            movies = [Movie(title=f'Movie {i}',
+                            release_date=datetime(2000 + i % 25, 1, 1))
+                      for i in range(count)]
+            db.session.add_all(movies)
+            bump_versions('movies')
+            db.session.commit()
+            return [movie.id for movie in movies]
+
+    def seed_actors(self, count, movie_id=None):
+        with self.app.app_context():
+            actors = [Actor(name=f'Actor {i}', age=20 + i % 50,
+                            gender='MF'[i % 2], movie_id=movie_id)
+                      for i in range(count)]
+            db.session.add_all(actors)
+            bump_versions('actors')
+            db.session.commit()
+            return [actor.id for actor in actors]
+
+    @contextmanager
+    def count_queries(self):
+        """Collect every SQL statement the app's engine executes in the block."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    def auth_header(self, role, expires_in=3600, sub='auth0|test'):
+        token = mint_token(self.private_pem, self.kid,
+                           self.roles[role]['permissions'], expires_in, sub)
+        return {"Authorization": f'Bearer {token}'}
 
 
 
@@ -364,6 +515,2011 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertFalse(data['success'])
 
 
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        """Write a local JWKS document the store can be pointed at."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jwks_path = os.path.join(self.tmpdir.name, 'jwks.json')
+        self.write_jwks(['key-1'])
+        self.url = 'file://' + self.jwks_path
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_jwks(self, kids):
+        keys = [{'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'}
+                for kid in kids]
+        with open(self.jwks_path, 'w') as f:
+            json.dump({'keys': keys}, f)
+
+    def test_key_set_fetched_once_within_ttl(self):
+        store = JWKSKeyStore(self.url, ttl=600)
+        for _ in range(10):
+            self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+
+        self.assertEqual(store.fetch_count, 1)
+
+    def test_unknown_kid_forces_refresh(self):
+        store = JWKSKeyStore(self.url, ttl=600, min_refresh_interval=0)
+        store.get_key('key-1')
+        self.write_jwks(['key-1', 'key-2'])
+
+        self.assertEqual(store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(store.fetch_count, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        store = JWKSKeyStore(self.url, ttl=600, min_refresh_interval=60)
+        store.get_key('key-1')
+
+        for _ in range(5):
+            self.assertIsNone(store.get_key('missing'))
+        self.assertEqual(store.fetch_count, 1)
+
+    def test_failed_refresh_serves_last_good_keys(self):
+        store = JWKSKeyStore(self.url, ttl=600, min_refresh_interval=0)
+        store.get_key('key-1')
+        os.remove(self.jwks_path)
+
+        self.assertIsNone(store.get_key('missing'))
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+        self.assertGreaterEqual(store.error_count, 1)
+
+    def test_initial_fetch_failure_raises(self):
+        os.remove(self.jwks_path)
+        store = JWKSKeyStore(self.url)
+
+        with self.assertRaises(JWKSFetchError):
+            store.get_key('key-1')
+
+    def test_stale_key_set_refreshed_in_background(self):
+        store = JWKSKeyStore(self.url, ttl=0, min_refresh_interval=0)
+        store.get_key('key-1')
+        self.write_jwks(['key-1', 'key-2'])
+
+        # The stale key set is served immediately while the refresh runs.
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+        for _ in range(50):
+            if store.fetch_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(store.fetch_count, 2)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        requests_seen = []
+
+        class SlowJWKSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_seen.append(self.path)
+                time.sleep(0.2)
+                body = json.dumps({'keys': [{'kid': 'key-1'}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), SlowJWKSHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            store = JWKSKeyStore(
+                f'http://127.0.0.1:{server.server_port}/.well-known/jwks.json')
+            threads = [threading.Thread(target=store.get_key, args=('key-1',))
+                       for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(requests_seen), 1)
+        self.assertEqual(store.fetch_count, 1)
+
+
+class VerifiedTokenCacheTestCase(LocalAuthTestCase):
+    def test_repeat_token_skips_verification(self):
+        header_obj = self.auth_header("Casting Assistant")
+        for _ in range(3):
+            res = self.client().get('/movies', headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+
+        stats = auth_module.token_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+
+    def test_cached_token_still_checks_permissions(self):
+        header_obj = self.auth_header("Casting Assistant")
+        self.client().get('/movies', headers=header_obj)
+        res = self.client().post('/movies', json={"title": "Movie"},
+                                 headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+        self.assertEqual(auth_module.token_cache.hits, 1)
+
+    def test_entry_evicted_at_expiry(self):
+        cache = VerifiedTokenCache()
+        cache.put('token', {'exp': time.time() + 0.05})
+        self.assertIsNotNone(cache.get('token'))
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(len(cache), 0)
+
+    def test_tokens_without_exp_are_not_cached(self):
+        cache = VerifiedTokenCache()
+        cache.put('token', {'sub': 'auth0|test'})
+
+        self.assertEqual(len(cache), 0)
+
+    def test_size_limit_evicts_least_recently_used(self):
+        cache = VerifiedTokenCache(max_size=2)
+        exp = time.time() + 60
+        cache.put('a', {'exp': exp})
+        cache.put('b', {'exp': exp})
+        cache.get('a')
+        cache.put('c', {'exp': exp})
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_disabled_cache(self):
+        auth_module.token_cache = VerifiedTokenCache(max_size=0)
+        header_obj = self.auth_header("Casting Assistant")
+        for _ in range(2):
+            res = self.client().get('/movies', headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(len(auth_module.token_cache), 0)
+        self.assertEqual(auth_module.token_cache.hits, 0)
+
+
+class PaginationTestCase(LocalAuthTestCase):
+    def fetch_all_pages(self, path, key, limit):
+        header_obj = self.auth_header("Casting Assistant")
+        ids, pages, cursor = [], 0, None
+        while True:
+            query = f'{path}?limit={limit}' + (f'&after={cursor}' if cursor else '')
+            res = self.client().get(query, headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data)
+            self.assertLessEqual(len(data[key]), limit)
+            ids.extend(item['id'] for item in data[key])
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids, pages
+
+    def test_movies_paged_in_id_order(self):
+        movie_ids = self.seed_movies(25)
+        ids, pages = self.fetch_all_pages('/movies', 'movies', 10)
+
+        self.assertEqual(ids, sorted(movie_ids))
+        self.assertEqual(pages, 3)
+
+    def test_actors_paged_in_id_order(self):
+        actor_ids = self.seed_actors(20)
+        ids, pages = self.fetch_all_pages('/actors', 'actors', 10)
+
+        self.assertEqual(ids, sorted(actor_ids))
+        self.assertEqual(pages, 2)
+
+    def test_limit_capped_at_max_page_size(self):
+        self.app.config['MAX_PAGE_SIZE'] = 5
+        self.seed_actors(8)
+        res = self.client().get('/actors?limit=100',
+                                headers=self.auth_header("Casting Assistant"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 5)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_invalid_cursor_400(self):
+        res = self.client().get('/movies?after=not-a-cursor',
+                                headers=self.auth_header("Casting Assistant"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_invalid_limit_400(self):
+        res = self.client().get('/movies?limit=0',
+                                headers=self.auth_header("Casting Assistant"))
+
+        self.assertEqual(res.status_code, 400)
+
+
+class EagerLoadingTestCase(LocalAuthTestCase):
+    def seed_cast(self, movie_count, actors_per_movie=3):
+        for movie_id in self.seed_movies(movie_count):
+            self.seed_actors(actors_per_movie, movie_id)
+
+    def list_movie_queries(self):
+        header_obj = self.auth_header("Casting Assistant")
+        with self.count_queries() as statements:
+            res = self.client().get('/movies', headers=header_obj)
+        self.assertEqual(res.status_code, 200)
+        data_queries = [s for s in statements if 'table_versions' not in s]
+        return len(data_queries), json.loads(res.data)
+
+    def test_movie_list_query_count_is_constant(self):
+        self.seed_cast(2)
+        small_count, small_data = self.list_movie_queries()
+        self.seed_cast(20)
+        large_count, large_data = self.list_movie_queries()
+
+        self.assertEqual(len(small_data['movies']), 2)
+        self.assertEqual(len(large_data['movies']), 22)
+        self.assertTrue(all(len(m['actors']) == 3 for m in large_data['movies']))
+        self.assertEqual(small_count, large_count)
+        self.assertLessEqual(large_count, 2)
+
+    def test_update_movie_loads_cast_in_one_query(self):
+        self.seed_cast(1, actors_per_movie=10)
+        with self.count_queries() as statements:
+            res = self.client().patch('/movies/1', json={'title': 'Renamed'},
+                                      headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['updated']['actors']), 10)
+        selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+
+
+class FilterSortTestCase(LocalAuthTestCase):
+    def get_ids(self, path, key, role="Casting Assistant"):
+        res = self.client().get(path, headers=self.auth_header(role))
+        self.assertEqual(res.status_code, 200)
+        return [item['id'] for item in json.loads(res.data)[key]]
+
+    def test_filter_actors_by_movie(self):
+        movie_ids = self.seed_movies(2)
+        cast = self.seed_actors(3, movie_ids[1])
+        self.seed_actors(4, movie_ids[0])
+
+        self.assertEqual(
+            self.get_ids(f'/actors?movie_id={movie_ids[1]}', 'actors'), cast)
+
+    def test_filter_actors_by_gender_and_age(self):
+        self.seed_actors(40)
+        with self.app.app_context():
+            expected = [a.id for a in Actor.query.order_by(Actor.id)
+                        if a.gender == 'F' and 25 <= a.age <= 35]
+
+        ids = self.get_ids('/actors?gender=F&min_age=25&max_age=35', 'actors')
+        self.assertEqual(ids, expected)
+
+    def test_filter_movies_by_release_window(self):
+        self.seed_movies(25)
+        with self.app.app_context():
+            expected = [m.id for m in Movie.query.order_by(Movie.id)
+                        if datetime(2005, 1, 1) <= m.release_date
+                        <= datetime(2010, 1, 1)]
+
+        ids = self.get_ids('/movies?released_after=2005-01-01'
+                           '&released_before=2010-01-01', 'movies')
+        self.assertEqual(ids, expected)
+
+    def test_sorted_pages_follow_sort_key(self):
+        self.seed_actors(30)
+        with self.app.app_context():
+            Actor.query.filter(Actor.id <= 3).update({'age': None})
+            bump_versions('actors')
+            db.session.commit()
+            # Descending order puts NULL ages first, then age and id descending.
+            expected = [a.id for a in sorted(
+                Actor.query.all(),
+                key=lambda a: (a.age is not None, -(a.age or 0), -a.id))]
+
+        header_obj = self.auth_header("Casting Assistant")
+        ids, cursor = [], None
+        while True:
+            path = '/actors?sort=-age&limit=7' + (f'&after={cursor}' if cursor else '')
+            data = json.loads(self.client().get(path, headers=header_obj).data)
+            ids.extend(a['id'] for a in data['actors'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(ids, expected)
+
+    def test_ascending_pages_cross_into_null_keys(self):
+        self.seed_actors(20)
+        with self.app.app_context():
+            Actor.query.filter(Actor.id % 4 == 0).update({'age': None})
+            bump_versions('actors')
+            db.session.commit()
+            # Ascending order puts NULL ages last, after age and id ascending.
+            expected = [a.id for a in sorted(
+                Actor.query.all(), key=lambda a: (a.age is None, a.age or 0, a.id))]
+
+        header_obj = self.auth_header("Casting Assistant")
+        ids, cursor = [], None
+        with self.count_queries() as statements:
+            while True:
+                path = '/actors?sort=age&limit=6' + (f'&after={cursor}' if cursor else '')
+                data = json.loads(self.client().get(path, headers=header_obj).data)
+                ids.extend(a['id'] for a in data['actors'])
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+
+        self.assertEqual(ids, expected)
+        # Cursor pages read index ranges one at a time, never an OR of two.
+        pages = [s for s in statements if 'FROM actors' in s]
+        self.assertEqual(len(pages), 5)
+        self.assertFalse(any(' OR ' in s for s in pages))
+
+    def test_sort_by_release_date_pages(self):
+        self.seed_movies(12)
+        with self.app.app_context():
+            expected = [m.id for m in Movie.query.order_by(
+                Movie.release_date, Movie.id)]
+
+        header_obj = self.auth_header("Casting Assistant")
+        first = json.loads(self.client().get(
+            '/movies?sort=release_date&limit=5', headers=header_obj).data)
+        second = json.loads(self.client().get(
+            f'/movies?sort=release_date&limit=5&after={first["next_cursor"]}',
+            headers=header_obj).data)
+
+        ids = [m['id'] for m in first['movies'] + second['movies']]
+        self.assertEqual(ids, expected[:10])
+
+    def test_cursor_from_other_sort_400(self):
+        self.seed_actors(5)
+        header_obj = self.auth_header("Casting Assistant")
+        data = json.loads(self.client().get(
+            '/actors?sort=age&limit=2', headers=header_obj).data)
+        res = self.client().get(
+            f'/actors?sort=name&after={data["next_cursor"]}', headers=header_obj)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_invalid_filters_400(self):
+        header_obj = self.auth_header("Casting Assistant")
+        for path in ['/actors?min_age=old', '/actors?sort=salary',
+                     '/movies?released_after=yesterday']:
+            res = self.client().get(path, headers=header_obj)
+            self.assertEqual(res.status_code, 400, path)
+
+
+class BulkCreateTestCase(LocalAuthTestCase):
+    def test_bulk_create_movies(self):
+        movies = [{"title": f"Movie {i}", "release_date": "2020-11-02"}
+                  for i in range(50)]
+        with self.count_queries() as statements:
+            res = self.client().post('/movies/bulk', json=movies,
+                                     headers=self.auth_header("Executive Producer"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['created']), 50)
+        inserts = [s for s in statements if s.lstrip().upper().startswith('INSERT')]
+        with self.app.app_context():
+            # SQLite has no insert sentinel to order RETURNING rows by, so
+            # SQLAlchemy falls back to one INSERT per row in the transaction.
+            if db.engine.dialect.name != 'sqlite':
+                self.assertEqual(len(inserts), 1)
+            titles = {m.id: m.title for m in Movie.query.all()}
+        self.assertEqual([titles[i] for i in data['created']],
+                         [m['title'] for m in movies])
+
+    def test_bulk_create_actors(self):
+        movie_id = self.seed_movies(1)[0]
+        actors = [{"name": f"Actor {i}", "age": 30, "gender": "F",
+                   "movie_id": movie_id} for i in range(20)]
+        res = self.client().post('/actors/bulk', json=actors,
+                                 headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(data['created']), 20)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 20)
+
+    def test_bulk_create_reports_errors_per_item(self):
+        movie_id = self.seed_movies(1)[0]
+        actors = [
+            {"name": "Valid", "age": 30, "gender": "F", "movie_id": movie_id},
+            {"name": "No age", "gender": "F", "movie_id": movie_id},
+            {"name": "Valid", "age": 30, "gender": "F", "movie_id": movie_id},
+            {"name": "Bad age", "age": "old", "gender": "M", "movie_id": movie_id},
+        ]
+        res = self.client().post('/actors/bulk', json=actors,
+                                 headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+        self.assertEqual([e['index'] for e in data['errors']], [1, 3])
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 0)
+
+    def test_bulk_create_actors_unknown_movie_422(self):
+        actors = [{"name": "Actor", "age": 30, "gender": "F", "movie_id": 999}]
+        res = self.client().post('/actors/bulk', json=actors,
+                                 headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'][0]['index'], 0)
+
+    def test_bulk_create_size_limit_400(self):
+        self.app.config['MAX_BULK_SIZE'] = 2
+        movies = [{"title": "Movie", "release_date": "2020-11-02"}] * 3
+        res = self.client().post('/movies/bulk', json=movies,
+                                 headers=self.auth_header("Executive Producer"))
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_create_movies_fail_403(self):
+        movies = [{"title": "Movie", "release_date": "2020-11-02"}]
+        res = self.client().post('/movies/bulk', json=movies,
+                                 headers=self.auth_header("Casting Director"))
+
+        self.assertEqual(res.status_code, 403)
+
+
+class BatchTestCase(LocalAuthTestCase):
+    def test_recast_in_one_commit(self):
+        old_movie, new_movie = self.seed_movies(2)
+        actor_ids = self.seed_actors(50, old_movie)
+        operations = [{"op": "update", "resource": "actors", "id": actor_id,
+                       "data": {"movie_id": new_movie}} for actor_id in actor_ids]
+        with self.count_queries() as statements:
+            res = self.client().post('/batch', json=operations,
+                                     headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([r['id'] for r in data['results']], actor_ids)
+        self.assertTrue(all(r['data']['movie_id'] == new_movie
+                            for r in data['results']))
+        selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+        self.assertLessEqual(len(selects), 3)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.filter_by(movie_id=new_movie).count(), 50)
+
+    def test_mixed_operations_results_in_order(self):
+        movie_id = self.seed_movies(1)[0]
+        actor_id = self.seed_actors(1, movie_id)[0]
+        operations = [
+            {"op": "create", "resource": "movies",
+             "data": {"title": "New", "release_date": "2021-05-01"}},
+            {"op": "create", "resource": "actors",
+             "data": {"name": "Ann", "age": 30, "gender": "F", "movie_id": movie_id}},
+            {"op": "update", "resource": "movies", "id": movie_id,
+             "data": {"title": "Renamed"}},
+            {"op": "delete", "resource": "actors", "id": actor_id}
+        ]
+        res = self.client().post('/batch', json=operations,
+                                 headers=self.auth_header("Executive Producer"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(r['op'], r['resource']) for r in data['results']],
+                         [(o['op'], o['resource']) for o in operations])
+        self.assertEqual(data['results'][0]['data']['title'], 'New')
+        self.assertEqual(data['results'][2]['data']['title'], 'Renamed')
+        self.assertEqual(data['results'][3]['id'], actor_id)
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 2)
+            self.assertEqual([a.name for a in Actor.query.all()], ['Ann'])
+
+    def test_movie_results_load_casts_in_one_query(self):
+        movie_ids = self.seed_movies(20)
+        self.seed_actors(3, movie_ids[0])
+        operations = [{"op": "update", "resource": "movies", "id": movie_id,
+                       "data": {"title": f"Renamed {movie_id}"}}
+                      for movie_id in movie_ids]
+        with self.count_queries() as statements:
+            res = self.client().post('/batch', json=operations,
+                                     headers=self.auth_header("Executive Producer"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['results'][0]['data']['actors']), 3)
+        self.assertTrue(all(r['data']['actors'] == [] for r in data['results'][1:]))
+        actor_selects = [s for s in statements
+                         if s.lstrip().upper().startswith('SELECT')
+                         and 'FROM actors' in s]
+        self.assertEqual(len(actor_selects), 1)
+
+    def test_update_to_movie_zero_is_rejected(self):
+        actor_id = self.seed_actors(1, self.seed_movies(1)[0])[0]
+        res = self.client().post('/batch', json=[
+            {"op": "update", "resource": "actors", "id": actor_id,
+             "data": {"movie_id": 0}}],
+            headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'], [
+            {'index': 0, 'message': 'movie_id must be a positive integer'}])
+
+    def test_failure_rolls_back_everything(self):
+        movie_id = self.seed_movies(1)[0]
+        operations = [
+            {"op": "update", "resource": "movies", "id": movie_id,
+             "data": {"title": "Renamed"}},
+            {"op": "delete", "resource": "actors", "id": 999}
+        ]
+        res = self.client().post('/batch', json=operations,
+                                 headers=self.auth_header("Executive Producer"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['errors'],
+                         [{'index': 1, 'message': 'Actor with id 999 not found'}])
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Movie, movie_id).title, 'Movie 0')
+
+    def test_each_operation_checked_against_permissions(self):
+        movie_id = self.seed_movies(1)[0]
+        operations = [
+            {"op": "update", "resource": "movies", "id": movie_id,
+             "data": {"title": "Renamed"}},
+            {"op": "delete", "resource": "movies", "id": movie_id}
+        ]
+        res = self.client().post('/batch', json=operations,
+                                 headers=self.auth_header("Casting Director"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['errors'], [
+            {'index': 1, 'message': 'Permission delete:movies not found'}])
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Movie, movie_id).title, 'Movie 0')
+
+    def test_invalid_operations(self):
+        res = self.client().post('/batch', json=[
+            {"op": "upsert", "resource": "movies"},
+            {"op": "update", "resource": "actors", "id": 1, "data": {"age": -1}}],
+            headers=self.auth_header("Executive Producer"))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([e['index'] for e in data['errors']], [0, 1])
+
+        res = self.client().post('/batch', json={"op": "delete"},
+                                 headers=self.auth_header("Executive Producer"))
+        self.assertEqual(res.status_code, 400)
+
+
+class SetBasedDeleteTestCase(LocalAuthTestCase):
+    def delete(self, path):
+        with self.count_queries() as statements:
+            res = self.client().delete(path, headers=self.auth_header("Executive Producer"))
+        return res, json.loads(res.data), statements
+
+    def test_delete_movie_detaches_actors(self):
+        movie_id = self.seed_movies(1)[0]
+        actor_ids = self.seed_actors(30, movie_id)
+        res, data, statements = self.delete(f'/movies/{movie_id}')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors_detached'], 30)
+        self.assertEqual(
+            [s.split()[0].upper() for s in statements if 'table_versions' not in s],
+            ['UPDATE', 'DELETE'])
+        with self.app.app_context():
+            self.assertIsNone(db.session.get(Movie, movie_id))
+            self.assertEqual(Actor.query.filter(Actor.movie_id.is_(None)).count(),
+                             len(actor_ids))
+
+    def test_delete_movie_bumps_versions_in_name_order(self):
+        movie_id = self.seed_movies(1)[0]
+        self.seed_actors(2, movie_id)
+        bumped = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            if statement.lstrip().upper().startswith('UPDATE TABLE_VERSIONS'):
+                bumped.append(parameters[-1])
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res, _, _ = self.delete(f'/movies/{movie_id}')
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(bumped, ['actors', 'movies'])
+
+    def test_delete_movie_cascade(self):
+        self.app.config['MOVIE_DELETE_ACTORS'] = 'cascade'
+        movie_id, other_id = self.seed_movies(2)
+        self.seed_actors(10, movie_id)
+        self.seed_actors(2, other_id)
+        res, data, _ = self.delete(f'/movies/{movie_id}')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors_deleted'], 10)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 2)
+
+    def test_delete_movie_reject(self):
+        self.app.config['MOVIE_DELETE_ACTORS'] = 'reject'
+        movie_id, empty_id = self.seed_movies(2)
+        self.seed_actors(3, movie_id)
+        res, data, _ = self.delete(f'/movies/{movie_id}')
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['message'], f'Movie with id {movie_id} still has 3 actor(s)')
+        with self.app.app_context():
+            self.assertIsNotNone(db.session.get(Movie, movie_id))
+
+        res, data, _ = self.delete(f'/movies/{empty_id}')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data, {'success': True, 'deleted': empty_id})
+
+    def test_delete_missing_rows(self):
+        res, data, _ = self.delete('/movies/999')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['message'], 'Movie with id 999 not found')
+
+        res, data, _ = self.delete('/actors/999')
+        self.assertEqual(res.status_code, 404)
+
+    def test_delete_actors_by_filter(self):
+        movie_id, other_id = self.seed_movies(2)
+        cast = self.seed_actors(40, movie_id)
+        self.seed_actors(5, other_id)
+        res, data, statements = self.delete(f'/actors?movie_id={movie_id}')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(data['deleted']), cast)
+        self.assertEqual(data['total'], 40)
+        self.assertEqual(
+            len([s for s in statements if s.lstrip().upper().startswith('DELETE')]), 1)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 5)
+
+    def test_delete_actors_requires_filter(self):
+        self.seed_actors(3)
+        res, data, _ = self.delete('/actors')
+
+        self.assertEqual(res.status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 3)
+
+    def test_batch_follows_actor_policy(self):
+        self.app.config['MOVIE_DELETE_ACTORS'] = 'reject'
+        movie_id = self.seed_movies(1)[0]
+        self.seed_actors(2, movie_id)
+        res = self.client().post('/batch', json=[
+            {"op": "delete", "resource": "movies", "id": movie_id}],
+            headers=self.auth_header("Executive Producer"))
+
+        self.assertEqual(res.status_code, 409)
+
+        self.app.config['MOVIE_DELETE_ACTORS'] = 'cascade'
+        res = self.client().post('/batch', json=[
+            {"op": "delete", "resource": "movies", "id": movie_id}],
+            headers=self.auth_header("Executive Producer"))
+
+        self.assertEqual(res.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 0)
+
+
+class IdempotencyKeyTestCase(LocalAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        self.actor = {"name": "Retry", "age": 30, "gender": "F",
+                      "movie_id": self.seed_movies(1)[0]}
+
+    def post(self, body, key, role="Casting Director"):
+        headers = dict(self.auth_header(role), **{'Idempotency-Key': key})
+        return self.client().post('/actors', json=body, headers=headers)
+
+    def test_retry_replays_response(self):
+        first = self.post(self.actor, 'key-1')
+        with self.count_queries() as statements:
+            retry = self.post(self.actor, 'key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(json.loads(retry.data), json.loads(first.data))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertFalse([s for s in statements if 'actors' in s or 'movies' in s])
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 1)
+
+    def test_key_reused_with_different_request(self):
+        self.post(self.actor, 'key-1')
+        res = self.post(dict(self.actor, age=31), 'key-1')
+
+        self.assertEqual(res.status_code, 422)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 1)
+
+    def test_without_key_creates_each_time(self):
+        for _ in range(2):
+            self.client().post('/actors', json=self.actor,
+                               headers=self.auth_header("Casting Director"))
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 2)
+
+    def test_concurrent_duplicates_insert_once(self):
+        db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        db_file.close()
+        self.addCleanup(os.unlink, db_file.name)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_file.name,
+                          'AUTH0_JWKS_URL': self.jwks_url})
+        with app.app_context():
+            db.create_all()
+            db.session.add(Movie(title='Movie', release_date=datetime(2020, 1, 1)))
+            db.session.commit()
+        headers = dict(self.auth_header("Casting Director"),
+                       **{'Idempotency-Key': 'concurrent'})
+        responses = []
+
+        def send():
+            responses.append(app.test_client().post(
+                '/actors', json=self.actor, headers=headers))
+
+        threads = [threading.Thread(target=send) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([r.status_code for r in responses], [201] * 5)
+        self.assertEqual(len({json.loads(r.data)['created']['id'] for r in responses}), 1)
+        with app.app_context():
+            self.assertEqual(Actor.query.count(), 1)
+            db.engine.dispose()
+
+    def test_store_is_bounded(self):
+        for i in range(4):
+            self.post(self.actor, f'key-{i}')
+        with self.app.app_context():
+            prune_keys(2)
+            self.assertEqual(IdempotencyKey.query.count(), 2)
+
+        res = self.post(self.actor, 'key-3')
+        self.assertEqual(res.headers.get('Idempotent-Replayed'), 'true')
+
+
+class ReadReplicaTestCase(LocalAuthTestCase):
+    """
+    Runs the app on a primary and a replica SQLite file holding different actors,
+    so each response shows which database it was read from.
+    """
+    def setUp(self):
+        auth_module.token_cache = VerifiedTokenCache()
+        self.primary = self.database_file()
+        self.replica = self.database_file()
+        self.app = self.replica_app('sqlite:///' + self.replica)
+        self.client = self.app.test_client
+        with self.app.app_context():
+            db.create_all()
+            self.replica_engine = self.app.extensions['replica_engines'][0]
+            db.metadata.create_all(self.replica_engine)
+            self.movie_id = self.seed_movies(1)[0]
+            db.session.add(Actor(name='Primary', age=30, gender='F',
+                                 movie_id=self.movie_id))
+            db.session.commit()
+            with self.replica_engine.begin() as connection:
+                connection.execute(Actor.__table__.insert(), {
+                    'name': 'Replica', 'age': 40, 'gender': 'M'})
+
+    def tearDown(self):
+        super().tearDown()
+        with self.app.app_context():
+            db.engine.dispose()
+        self.replica_engine.dispose()
+
+    def replica_app(self, replica_url):
+        return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.primary,
+                           'DATABASE_REPLICA_URLS': replica_url,
+                           'RESPONSE_CACHE_BACKEND': 'none',
+                           'AUTH0_JWKS_URL': self.jwks_url})
+
+    def actor_names(self, client=None, sub='auth0|test'):
+        res = (client or self.client()).get(
+            '/actors', headers=self.auth_header("Casting Assistant", sub=sub))
+        self.assertEqual(res.status_code, 200)
+        return [actor['name'] for actor in json.loads(res.data)['actors']]
+
+    def test_reads_use_replica(self):
+        self.assertEqual(self.actor_names(), ['Replica'])
+        res = self.client().get(f'/movies/{self.movie_id}',
+                                headers=self.auth_header("Casting Assistant"))
+        self.assertEqual(res.status_code, 404)
+
+    def test_writes_use_primary_and_caller_reads_them(self):
+        res = self.client().post('/actors', json={
+            "name": "New", "age": 25, "gender": "F", "movie_id": self.movie_id},
+            headers=self.auth_header("Casting Director"))
+        self.assertEqual(res.status_code, 201)
+
+        self.assertEqual(self.actor_names(), ['Primary', 'New'])
+        self.assertEqual(self.actor_names(sub='auth0|other'), ['Replica'])
+
+    def test_failed_write_does_not_stick(self):
+        res = self.client().post('/actors', json={},
+                                 headers=self.auth_header("Casting Director"))
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(self.actor_names(), ['Replica'])
+
+    def test_sticky_writes_expire(self):
+        sticky = LocalStickyWrites(max_size=1)
+        sticky.mark('a', 0.05)
+        self.assertTrue(sticky.is_sticky('a'))
+        sticky.mark('b', 5)
+        self.assertFalse(sticky.is_sticky('a'))
+        time.sleep(0.05)
+        self.assertTrue(sticky.is_sticky('b'))
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        app = self.replica_app('sqlite:///' + os.path.join(self.primary, 'missing.db'))
+
+        self.assertEqual(self.actor_names(app.test_client()), ['Primary'])
+        self.assertEqual(self.actor_names(app.test_client()), ['Primary'])
+        health = json.loads(app.test_client().get('/health/db').data)
+        self.assertFalse(health['replicas'][0]['healthy'])
+        with app.app_context():
+            db.engine.dispose()
+
+    def test_dml_goes_to_primary_while_routed(self):
+        with self.app.app_context():
+            db.session.info['read_bind'] = self.replica_engine
+            db.session.execute(update(Actor).values(age=99))
+            db.session.commit()
+            self.assertEqual(db.session.scalar(select(Actor.age)), 40)
+            db.session.info.pop('read_bind')
+            self.assertEqual(db.session.scalar(select(Actor.age)), 99)
+
+
+class SearchTestCase(LocalAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            movie = Movie(title='Vizontele', release_date=datetime(2001, 2, 2))
+            db.session.add(movie)
+            db.session.flush()
+            for name in ['Cem Yilmaz', 'Ahmet Cem', 'Cemal Sureya', 'Bob', 'cem',
+                         'Tom Cem']:
+                db.session.add(Actor(name=name, age=40, gender='M',
+                                     movie_id=movie.id))
+            db.session.commit()
+
+    def get(self, path, permissions=None):
+        if permissions is None:
+            headers = self.auth_header("Casting Assistant")
+        else:
+            token = mint_token(self.private_pem, self.kid, permissions)
+            headers = {"Authorization": f'Bearer {token}'}
+        res = self.client().get(path, headers=headers)
+        return res, json.loads(res.data)
+
+    def test_actors_ranked_by_relevance_across_pages(self):
+        names, cursor = [], None
+        while True:
+            res, data = self.get('/actors?q=CEM&limit=2'
+                                 + (f'&after={cursor}' if cursor else ''))
+            self.assertEqual(res.status_code, 200)
+            names += [actor['name'] for actor in data['actors']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(names, ['cem', 'Cem Yilmaz', 'Cemal Sureya',
+                                 'Ahmet Cem', 'Tom Cem'])
+
+    def test_explicit_sort_overrides_relevance(self):
+        res, data = self.get('/actors?q=cem&sort=-name&fields=name')
+
+        self.assertEqual([actor['name'] for actor in data['actors']],
+                         ['cem', 'Tom Cem', 'Cemal Sureya', 'Cem Yilmaz', 'Ahmet Cem'])
+
+    def test_search_endpoint(self):
+        res, data = self.get('/search?q=cem&limit=1')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['cem'])
+        self.assertEqual(data['movies'], [])
+        self.assertIsNone(data['next_cursors']['movies'])
+
+        res, data = self.get(f"/actors?q=cem&after={data['next_cursors']['actors']}")
+        self.assertEqual(len(data['actors']), 4)
+
+        res, data = self.get('/search?q=vizon')
+        self.assertEqual(data['movies'][0]['title'], 'Vizontele')
+        self.assertEqual(len(data['movies'][0]['actors']), 6)
+
+    def test_search_endpoint_only_searches_viewable_resources(self):
+        res, data = self.get('/search?q=cem', ['view:actors'])
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('movies', data)
+        self.assertEqual(len(data['actors']), 5)
+
+        res, data = self.get('/search?q=cem', ['post:actors'])
+        self.assertEqual(res.status_code, 403)
+
+    def test_invalid_queries(self):
+        for path in ['/search', '/search?q=ce', '/actors?q=%20ce%20',
+                     '/movies?q=' + 'x' * 101]:
+            res, data = self.get(path)
+            self.assertEqual(res.status_code, 400, path)
+
+        res, data = self.get('/actors?q=%25%25%25')
+        self.assertEqual(data['actors'], [])
+
+
+class StatsTestCase(LocalAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            old = Movie(title='Old', release_date=datetime(1990, 1, 1))
+            new = Movie(title='New', release_date=datetime(2020, 1, 1))
+            empty = Movie(title='Empty', release_date=datetime(2021, 1, 1))
+            db.session.add_all([old, new, empty])
+            db.session.flush()
+            db.session.add_all([
+                Actor(name='A', age=25, gender='F', movie_id=old.id),
+                Actor(name='B', age=38, gender='M', movie_id=old.id),
+                Actor(name='C', age=31, gender='F', movie_id=old.id),
+                Actor(name='D', age=62, gender='M', movie_id=new.id),
+                Actor(name='E', age=None, gender=None, movie_id=new.id),
+                Actor(name='F', age=44, gender='F', movie_id=None)])
+            db.session.commit()
+            self.movie_ids = [old.id, new.id, empty.id]
+
+    def get(self, path):
+        res = self.client().get(path, headers=self.auth_header("Casting Assistant"))
+        return res, json.loads(res.data)
+
+    def test_movie_stats(self):
+        with self.count_queries() as statements:
+            res, data = self.get('/stats/movies')
+
+        self.assertEqual(res.status_code, 200)
+        old, new, empty = data['movies']
+        self.assertEqual(old['cast_size'], 3)
+        self.assertEqual(old['genders'], {'F': 2, 'M': 1})
+        self.assertEqual(old['ages'], {'min': 25, 'max': 38, 'average': 31.3})
+        self.assertEqual(new['genders'], {'M': 1, 'unknown': 1})
+        self.assertEqual(new['ages'], {'min': 62, 'max': 62, 'average': 62.0})
+        self.assertEqual(empty['cast_size'], 0)
+        self.assertEqual(empty['ages'], {'min': None, 'max': None, 'average': None})
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(len([s for s in statements if 'table_versions' not in s]), 1)
+
+    def test_movie_stats_pages_and_window(self):
+        res, data = self.get('/stats/movies?limit=2')
+        self.assertEqual([m['title'] for m in data['movies']], ['Old', 'New'])
+
+        res, data = self.get(f"/stats/movies?limit=2&after={data['next_cursor']}")
+        self.assertEqual([m['title'] for m in data['movies']], ['Empty'])
+
+        res, data = self.get('/stats/movies?released_after=2000-01-01')
+        self.assertEqual([m['title'] for m in data['movies']], ['New', 'Empty'])
+
+    def test_actor_stats(self):
+        with self.count_queries() as statements:
+            res, data = self.get('/stats/actors')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors'], 6)
+        self.assertEqual(data['genders'], {'F': 3, 'M': 2, 'unknown': 1})
+        self.assertEqual(data['ages']['decades'],
+                         {'20-29': 1, '30-39': 2, '40-49': 1, '60-69': 1, 'unknown': 1})
+        self.assertEqual(data['ages']['average'], 40.0)
+        self.assertEqual(data['movies'], 3)
+        self.assertEqual(data['cast_sizes'], {'0': 1, '2': 1, '3': 1})
+        self.assertEqual(len([s for s in statements if 'table_versions' not in s]), 2)
+
+    def test_actor_stats_in_release_window(self):
+        res, data = self.get('/stats/actors?released_before=2000-01-01')
+
+        self.assertEqual(data['actors'], 3)
+        self.assertEqual(data['ages'], {'min': 25, 'max': 38, 'average': 31.3,
+                                        'decades': {'20-29': 1, '30-39': 2}})
+        self.assertEqual(data['cast_sizes'], {'3': 1})
+
+    def test_cached_until_write(self):
+        self.get('/stats/actors')
+        with self.count_queries() as statements:
+            res, _ = self.get('/stats/actors')
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(len(statements), 1)
+
+        res = self.client().delete(f'/movies/{self.movie_ids[0]}',
+                                   headers=self.auth_header("Executive Producer"))
+        self.assertEqual(res.status_code, 200)
+
+        res, data = self.get('/stats/actors')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(data['movies'], 2)
+
+
+class MovieDocumentsTestCase(LocalAuthTestCase):
+    def setUp(self):
+        auth_module.token_cache = VerifiedTokenCache()
+        self.app = create_app(self.app_config(MOVIE_DOCUMENTS='serve',
+                                              RESPONSE_CACHE_BACKEND='none'))
+        self.client = self.app.test_client
+        with self.app.app_context():
+            db.create_all()
+
+    def request(self, method, path, role="Executive Producer", **kwargs):
+        res = self.client().open(path, method=method,
+                                 headers=self.auth_header(role), **kwargs)
+        self.assertLess(res.status_code, 300, res.data)
+        return json.loads(res.data)
+
+    def assert_documents_match_tables(self):
+        with self.app.app_context():
+            report = check_movie_documents()
+        self.assertEqual((report['missing'], report['stale'], report['orphaned']),
+                         ([], [], []))
+
+        served = self.client().get('/movies?sort=-title&limit=3',
+                                   headers=self.auth_header("Casting Assistant"))
+        self.app.config['MOVIE_DOCUMENTS'] = 'maintain'
+        joined = self.client().get('/movies?sort=-title&limit=3',
+                                   headers=self.auth_header("Casting Assistant"))
+        self.app.config['MOVIE_DOCUMENTS'] = 'serve'
+        self.assertEqual(served.data, joined.data)
+
+    def test_writes_keep_documents_in_step(self):
+        with self.app.app_context():
+            movies = [Movie(title, datetime(2000 + i, 1, 1))
+                      for i, title in enumerate(['First', 'Second'])]
+            for movie in movies:
+                movie.insert()
+            first, second = [movie.id for movie in movies]
+        actor = self.request('POST', '/actors', json={
+            'name': 'Ann', 'age': 30, 'gender': 'F', 'movie_id': first})['created']['id']
+        self.request('POST', '/actors/bulk', json=[
+            {'name': f'Bulk {i}', 'age': 40 + i, 'gender': 'M', 'movie_id': second}
+            for i in range(3)])
+        self.request('POST', '/movies/bulk', json=[
+            {'title': 'Third', 'release_date': '2003-01-01'}])
+        self.assert_documents_match_tables()
+
+        self.request('PATCH', f'/actors/{actor}', json={'movie_id': second})
+        self.request('PATCH', f'/movies/{second}', json={'title': 'Renamed'})
+        self.request('DELETE', '/actors?min_age=42')
+        self.request('POST', '/batch', json=[
+            {'op': 'create', 'resource': 'actors',
+             'data': {'name': 'Bob', 'age': 50, 'gender': 'M', 'movie_id': first}},
+            {'op': 'update', 'resource': 'actors', 'id': actor,
+             'data': {'movie_id': first}},
+            {'op': 'create', 'resource': 'movies',
+             'data': {'title': 'Fourth', 'release_date': '2004-01-01'}}])
+        self.assert_documents_match_tables()
+
+        self.request('DELETE', f'/actors/{actor}')
+        self.request('DELETE', f'/movies/{first}')
+        self.assert_documents_match_tables()
+        with self.app.app_context():
+            self.assertEqual(db.session.scalar(
+                select(MovieDocument.document).where(MovieDocument.id == second)),
+                json.dumps(db.session.get(Movie, second).format(), sort_keys=True,
+                           separators=(',', ':')))
+
+    def test_refreshing_a_stored_document_upserts_it(self):
+        with self.app.app_context():
+            movie = Movie('Original', datetime(2001, 1, 1))
+            movie.insert()
+            movie_id = movie.id
+            with self.count_queries() as statements:
+                refresh_movie_documents([movie_id])
+                refresh_movie_documents([movie_id])
+                db.session.commit()
+            movie.title = 'Renamed'
+            refresh_movie_documents([movie_id])
+            db.session.commit()
+            self.assertEqual(db.session.scalar(
+                select(MovieDocument.title).where(MovieDocument.id == movie_id)),
+                'Renamed')
+        self.assertFalse(any(s.lstrip().upper().startswith('DELETE')
+                             for s in statements))
+        self.assert_documents_match_tables()
+
+    def test_list_is_one_scan_of_documents(self):
+        self.request('POST', '/movies/bulk', json=[
+            {'title': f'Movie {i}', 'release_date': f'20{10 + i}-01-01'}
+            for i in range(5)])
+
+        titles, cursor = [], None
+        with self.count_queries() as statements:
+            while True:
+                data = self.request(
+                    'GET', '/movies?limit=2&sort=-release_date&released_after=2011-01-01'
+                    + (f'&after={cursor}' if cursor else ''), "Casting Assistant")
+                titles += [movie['title'] for movie in data['movies']]
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+
+        self.assertEqual(titles, ['Movie 4', 'Movie 3', 'Movie 2', 'Movie 1'])
+        reads = [s for s in statements if 'table_versions' not in s]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all('movie_documents' in s and 'actors' not in s
+                            for s in reads))
+
+    def test_search_and_fields_read_the_tables(self):
+        self.request('POST', '/movies/bulk', json=[{'title': 'Vizontele',
+                                                    'release_date': '2001-02-02'}])
+        with self.count_queries() as statements:
+            data = self.request('GET', '/movies?q=vizon&fields=title',
+                                "Casting Assistant")
+
+        self.assertEqual(data['movies'], [{'title': 'Vizontele'}])
+        self.assertFalse(any('movie_documents' in s for s in statements))
+
+    def test_rebuild_and_check_commands(self):
+        movie_id = self.seed_movies(3)[0]
+        self.seed_actors(2, movie_id)
+        runner = self.app.test_cli_runner()
+
+        result = runner.invoke(args=['documents', 'check'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('3 missing', result.output)
+
+        result = runner.invoke(args=['documents', 'rebuild', '--batch-size', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Rebuilt 3 movie documents', result.output)
+        self.assert_documents_match_tables()
+
+        with self.app.app_context():
+            db.session.execute(update(Movie).where(Movie.id == movie_id)
+                               .values(title='Changed behind the read model'))
+            db.session.add(MovieDocument(id=999, title='Gone', document='{}'))
+            db.session.commit()
+        result = runner.invoke(args=['documents', 'check'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn(f'1 stale: {movie_id}', result.output)
+        self.assertIn('1 orphaned: 999', result.output)
+
+    def test_off_does_not_write_documents(self):
+        self.app.config['MOVIE_DOCUMENTS'] = 'off'
+        self.request('POST', '/movies/bulk', json=[{'title': 'Untracked',
+                                                    'release_date': '2001-01-01'}])
+        with self.app.app_context():
+            self.assertEqual(MovieDocument.query.count(), 0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            create_app(self.app_config(MOVIE_DOCUMENTS='on'))
+
+
+class ConditionalGetTestCase(LocalAuthTestCase):
+    def test_unchanged_list_returns_304_without_list_query(self):
+        self.seed_movies(3)
+        header_obj = self.auth_header("Casting Assistant")
+        res = self.client().get('/movies', headers=header_obj)
+        etag = res.headers['ETag']
+
+        with self.count_queries() as statements:
+            res = self.client().get('/movies', headers={
+                **header_obj, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+    def test_write_changes_etag(self):
+        movie_id = self.seed_movies(1)[0]
+        header_obj = self.auth_header("Executive Producer")
+        etag = self.client().get('/movies', headers=header_obj).headers['ETag']
+
+        self.client().patch(f'/movies/{movie_id}', json={'title': 'Renamed'},
+                            headers=header_obj)
+        res = self.client().get('/movies', headers={
+            **header_obj, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_actor_write_changes_movie_list_etag(self):
+        movie_id = self.seed_movies(1)[0]
+        header_obj = self.auth_header("Executive Producer")
+        etag = self.client().get('/movies', headers=header_obj).headers['ETag']
+
+        self.client().post('/actors/bulk', headers=header_obj, json=[
+            {"name": "Actor", "age": 30, "gender": "F", "movie_id": movie_id}])
+        res = self.client().get('/movies', headers={
+            **header_obj, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_etag_depends_on_query(self):
+        self.seed_actors(3)
+        header_obj = self.auth_header("Casting Assistant")
+        first = self.client().get('/actors?limit=1', headers=header_obj)
+        second = self.client().get('/actors?limit=2', headers=header_obj)
+
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_item_endpoints(self):
+        movie_id = self.seed_movies(1)[0]
+        actor_id = self.seed_actors(1, movie_id)[0]
+        header_obj = self.auth_header("Casting Assistant")
+
+        res = self.client().get(f'/movies/{movie_id}', headers=header_obj)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movie']['actors'][0]['id'], actor_id)
+
+        res = self.client().get(f'/actors/{actor_id}', headers={
+            **header_obj, 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get(f'/actors/{actor_id}', headers={
+            **header_obj, 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    def test_item_not_found_404(self):
+        res = self.client().get('/actors/100',
+                                headers=self.auth_header("Casting Assistant"))
+
+        self.assertEqual(res.status_code, 404)
+        self.assertNotIn('ETag', res.headers)
+
+
+class ResponseCacheTestCase(LocalAuthTestCase):
+    def get(self, path, role="Casting Assistant"):
+        return self.client().get(path, headers=self.auth_header(role))
+
+    def test_repeat_request_served_from_cache(self):
+        self.seed_actors(3)
+        first = self.get('/actors')
+        with self.count_queries() as statements:
+            second = self.get('/actors')
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+    def test_write_invalidates_dependent_entries_only(self):
+        movie_id = self.seed_movies(1)[0]
+        self.get('/movies')
+        self.get('/actors')
+
+        res = self.client().patch(f'/movies/{movie_id}', json={'title': 'Renamed'},
+                                  headers=self.auth_header("Executive Producer"))
+        self.assertEqual(res.status_code, 200)
+
+        movies = self.get('/movies')
+        self.assertEqual(movies.headers['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(movies.data)['movies'][0]['title'], 'Renamed')
+        self.assertEqual(self.get('/actors').headers['X-Cache'], 'HIT')
+
+    def test_key_includes_query_and_permissions(self):
+        self.seed_actors(3)
+        self.get('/actors')
+
+        self.assertEqual(self.get('/actors?limit=1').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.get('/actors', "Casting Director").headers['X-Cache'],
+                         'MISS')
+
+    def test_expired_entry_served_stale_while_recomputed(self):
+        cache = self.app.extensions['response_cache']
+        cache.ttl = 0
+        calls = []
+        in_compute = threading.Event()
+        release = threading.Event()
+
+        def slow_compute():
+            calls.append(1)
+            in_compute.set()
+            release.wait(2)
+            return self.app.response_class(b'fresh', mimetype='text/plain')
+
+        with self.app.test_request_context('/'):
+            cache.get_or_compute('k', lambda: self.app.response_class(
+                b'old', mimetype='text/plain'))
+            results = []
+
+            def recompute():
+                with self.app.test_request_context('/'):
+                    results.append(cache.get_or_compute('k', slow_compute))
+
+            worker = threading.Thread(target=recompute)
+            worker.start()
+            in_compute.wait(2)
+            entry, outcome = cache.get_or_compute('k', slow_compute)
+            release.set()
+            worker.join()
+
+        self.assertEqual(outcome, 'STALE')
+        self.assertEqual(entry.body, b'old')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0][1], 'MISS')
+
+    def test_concurrent_misses_compute_once(self):
+        cache = self.app.extensions['response_cache']
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return self.app.response_class(b'body', mimetype='text/plain')
+
+        def request_entry():
+            with self.app.test_request_context('/'):
+                cache.get_or_compute('shared', compute)
+
+        threads = [threading.Thread(target=request_entry) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['hits'], 5)
+
+    def test_waiters_stop_when_first_request_stores_nothing(self):
+        cache = self.app.extensions['response_cache']
+        in_compute = threading.Event()
+
+        def failing_compute():
+            in_compute.set()
+            time.sleep(0.1)
+            return self.app.response_class(b'bad', status=400, mimetype='text/plain')
+
+        def request_entry():
+            with self.app.test_request_context('/'):
+                cache.get_or_compute('failing', failing_compute)
+
+        worker = threading.Thread(target=request_entry)
+        worker.start()
+        in_compute.wait(2)
+        started = time.monotonic()
+        with self.app.test_request_context('/'):
+            response, outcome = cache.get_or_compute('failing', failing_compute)
+        worker.join()
+
+        self.assertEqual((response.status_code, outcome), (400, 'MISS'))
+        self.assertLess(time.monotonic() - started, cache.wait_timeout / 2)
+
+    def test_hit_ratio(self):
+        self.seed_actors(1)
+        for _ in range(4):
+            self.get('/actors')
+
+        stats = self.app.extensions['response_cache'].stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.75)
+
+
+class StreamingExportTestCase(LocalAuthTestCase):
+    def read_lines(self, res):
+        return [json.loads(line) for line in res.data.decode().splitlines()]
+
+    def test_stream_actors_with_query_flag(self):
+        actor_ids = self.seed_actors(25)
+        self.app.config['MAX_PAGE_SIZE'] = 10
+        res = self.client().get('/actors?stream=1',
+                                headers=self.auth_header("Casting Assistant"))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([a['id'] for a in self.read_lines(res)], actor_ids)
+
+    def test_stream_with_accept_header_and_filters(self):
+        movie_ids = self.seed_movies(2)
+        cast = self.seed_actors(4, movie_ids[0])
+        self.seed_actors(3, movie_ids[1])
+        res = self.client().get(f'/actors?movie_id={movie_ids[0]}&sort=-id', headers={
+            **self.auth_header("Casting Assistant"),
+            'Accept': 'application/x-ndjson'})
+
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([a['id'] for a in self.read_lines(res)], cast[::-1])
+
+    def test_stream_movies_loads_cast_per_batch(self):
+        self.app.config['STREAM_BATCH_SIZE'] = 10
+        for movie_id in self.seed_movies(35):
+            self.seed_actors(2, movie_id)
+        with self.count_queries() as statements:
+            res = self.client().get('/movies?stream=1',
+                                    headers=self.auth_header("Casting Assistant"))
+            movies = self.read_lines(res)
+
+        self.assertEqual(len(movies), 35)
+        self.assertTrue(all(len(m['actors']) == 2 for m in movies))
+        data_queries = [s for s in statements if 'table_versions' not in s]
+        # One movie query plus one cast query per batch of ten movies.
+        self.assertLessEqual(len(data_queries), 1 + 4)
+
+    def test_stream_is_not_cached(self):
+        self.seed_actors(2)
+        header_obj = self.auth_header("Casting Assistant")
+        self.client().get('/actors?stream=1', headers=header_obj)
+        res = self.client().get('/actors?stream=1', headers=header_obj)
+
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(self.read_lines(res)), 2)
+
+
+class SparseFieldsetTestCase(LocalAuthTestCase):
+    def get_with_queries(self, path):
+        with self.count_queries() as statements:
+            res = self.client().get(path, headers=self.auth_header("Casting Assistant"))
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data), [s for s in statements
+                                      if 'table_versions' not in s]
+
+    def test_movie_titles_skip_cast(self):
+        movie_id = self.seed_movies(3)[0]
+        self.seed_actors(2, movie_id)
+        data, statements = self.get_with_queries('/movies?fields=id,title')
+
+        self.assertEqual(set(data['movies'][0]), {'id', 'title'})
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('release_date', statements[0])
+        self.assertNotIn('actors', statements[0])
+
+    def test_nested_actor_fields(self):
+        movie_id = self.seed_movies(1)[0]
+        self.seed_actors(2, movie_id)
+        data, statements = self.get_with_queries('/movies?fields=title,actors.name')
+
+        movie = data['movies'][0]
+        self.assertEqual(set(movie), {'title', 'actors'})
+        self.assertEqual([set(a) for a in movie['actors']], [{'name'}, {'name'}])
+        self.assertEqual(len(statements), 2)
+        self.assertNotIn('age', statements[1])
+
+    def test_actor_fields_with_sort(self):
+        self.seed_actors(5)
+        data, statements = self.get_with_queries(
+            '/actors?fields=name&sort=age&limit=2')
+
+        self.assertEqual(set(data['actors'][0]), {'name'})
+        self.assertIsNotNone(data['next_cursor'])
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('gender', statements[0])
+
+    def test_streamed_fields(self):
+        self.seed_actors(3)
+        res = self.client().get('/actors?stream=1&fields=id',
+                                headers=self.auth_header("Casting Assistant"))
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual([set(r) for r in rows], [{'id'}] * 3)
+
+    def test_unknown_field_400(self):
+        header_obj = self.auth_header("Casting Assistant")
+        for path in ['/movies?fields=budget', '/movies?fields=actors.salary',
+                     '/actors?fields=actors.name', '/actors?fields=']:
+            res = self.client().get(path, headers=header_obj)
+            self.assertEqual(res.status_code, 400, path)
+
+
+class SerializationTestCase(LocalAuthTestCase):
+    def make_movie(self):
+        movie = Movie(title="Yahşi Batı", release_date=datetime(2012, 5, 4))
+        movie.id = 2
+        actor = Actor(name="Cem Yılmaz", age=45, gender='M', movie_id=2)
+        actor.id = 6
+        movie.actors = [actor]
+        return movie
+
+    def test_format_writes_iso_dates(self):
+        self.assertEqual(self.make_movie().format(), {
+            'id': 2,
+            'title': "Yahşi Batı",
+            'release_date': '2012-05-04T00:00:00',
+            'actors': [{'id': 6, 'name': "Cem Yılmaz", 'age': 45, 'gender': 'M',
+                        'movie_id': 2}]
+        })
+
+    def test_serializer_compiled_once_per_field_set(self):
+        fields = {'title': None, 'actors': ['name']}
+        first = serializer_for(Movie, fields)
+
+        self.assertIs(serializer_for(Movie, dict(fields)), first)
+        self.assertIsNot(serializer_for(Movie), first)
+        self.assertEqual(first(self.make_movie()),
+                         {'title': "Yahşi Batı", 'actors': [{'name': "Cem Yılmaz"}]})
+
+    def test_provider_output_matches_stdlib_fallback(self):
+        payload = {"success": True, "movies": [self.make_movie().format()],
+                   "when": datetime(2020, 1, 2, 3, 4, 5)}
+        with self.app.app_context():
+            fast = json.loads(self.app.json.dumps(payload))
+            original = json_provider.orjson
+            json_provider.orjson = None
+            try:
+                fallback = json.loads(self.app.json.dumps(payload))
+            finally:
+                json_provider.orjson = original
+
+        self.assertEqual(fast, fallback)
+        self.assertEqual(fast['when'], '2020-01-02T03:04:05')
+
+    def test_int_keys_encoded_like_stdlib(self):
+        payload = {"success": True, "cast_sizes": {3: 1, 10: 2}}
+        with self.app.test_request_context('/'):
+            body = json.loads(self.app.json.response(payload).data)
+            fast = json.loads(self.app.json.dumps(payload))
+
+        self.assertEqual(body, {"success": True, "cast_sizes": {"3": 1, "10": 2}})
+        self.assertEqual(fast, json.loads(json.dumps(payload)))
+
+    def test_api_returns_iso_release_date(self):
+        self.seed_movies(1)
+        res = self.client().get('/movies', headers=self.auth_header("Casting Assistant"))
+        data = json.loads(res.data)
+
+        self.assertEqual(data['movies'][0]['release_date'], '2000-01-01T00:00:00')
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self._environ = dict(os.environ)
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.db_file.close()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        os.unlink(self.db_file.name)
+
+    def test_pool_options_from_environment(self):
+        os.environ.update({'DB_POOL_SIZE': '3', 'DB_MAX_OVERFLOW': '2',
+                           'DB_POOL_TIMEOUT': '1.5', 'DB_POOL_RECYCLE': '60',
+                           'DB_CONNECT_TIMEOUT': '4',
+                           'DB_STATEMENT_TIMEOUT_MS': '2500'})
+        options = engine_options('postgresql://u:p@localhost/capstone')
+
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 2)
+        self.assertEqual(options['pool_timeout'], 1.5)
+        self.assertEqual(options['pool_recycle'], 60)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {
+            'connect_timeout': 4, 'options': '-c statement_timeout=2500'})
+
+    def test_pgbouncer_transaction_mode_disables_local_pool(self):
+        os.environ.update({'DB_PGBOUNCER_MODE': 'transaction',
+                           'DB_STATEMENT_TIMEOUT_MS': '2500'})
+        options = engine_options('postgresql://u:p@localhost/capstone')
+
+        self.assertEqual(options, {'poolclass': NullPool,
+                                   'connect_args': {'connect_timeout': 10}})
+
+    def test_in_memory_sqlite_keeps_default_pool(self):
+        self.assertEqual(engine_options('sqlite://'), {})
+
+    def test_pool_stats_and_fork_reset(self):
+        os.environ.update({'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '0'})
+        app = Flask(__name__)
+        setup_db(app, 'sqlite:///' + self.db_file.name)
+        with app.app_context():
+            engine = db.engine
+            self.assertIsInstance(engine.pool, TimedQueuePool)
+            with engine.connect():
+                with engine.connect():
+                    stats = db_pool.pool_stats(engine)
+            self.assertEqual(stats['pool'], 'TimedQueuePool')
+            self.assertEqual(stats['size'], 2)
+            self.assertEqual(stats['checked_out'], 2)
+            self.assertEqual(stats['checkouts'], 2)
+            self.assertEqual(stats['timeouts'], 0)
+
+            pool = engine.pool
+            db_pool.reset_pools()
+            self.assertIsNot(engine.pool, pool)
+            self.assertEqual(db_pool.pool_stats(engine)['checkouts'], 0)
+
+    def test_pool_timeout_is_counted(self):
+        os.environ.update({'DB_POOL_SIZE': '1', 'DB_MAX_OVERFLOW': '0',
+                           'DB_POOL_TIMEOUT': '0.05'})
+        app = Flask(__name__)
+        setup_db(app, 'sqlite:///' + self.db_file.name)
+        with app.app_context():
+            with db.engine.connect():
+                with self.assertRaises(PoolTimeoutError):
+                    db.engine.connect()
+            self.assertEqual(db_pool.pool_stats(db.engine)['timeouts'], 1)
+
+    def test_health_endpoint_reports_pool(self):
+        res = create_app().test_client().get('/health/db')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['pid'], os.getpid())
+        self.assertIn('pool', data['pool'])
+
+
+class AsyncServingTestCase(LocalAuthTestCase):
+    """
+    Sends the same requests through the ASGI entry point and the Flask app,
+    both reading one SQLite file.
+    """
+    def setUp(self):
+        auth_module.token_cache = VerifiedTokenCache()
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.db_file.close()
+        self.loop = asyncio.new_event_loop()
+        self.asgi = create_asgi_app({
+            "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + self.db_file.name,
+            "AUTH0_JWKS_URL": self.jwks_url})
+        self.app = self.asgi.app
+        self.client = self.app.test_client
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        super().tearDown()
+        self.loop.run_until_complete(self.asgi.dispose())
+        self.loop.close()
+        os.unlink(self.db_file.name)
+
+    def asgi_request(self, method, path, headers=None, body=b'', asgi=None):
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'root_path': '',
+            'query_string': query_string.encode(), 'http_version': '1.1',
+            'scheme': 'http', 'server': ('localhost', 80),
+            'headers': [(k.lower().encode(), v.encode())
+                        for k, v in (headers or {}).items()]
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete((asgi or self.asgi)(scope, receive, send))
+        start = messages[0]
+        response_headers = {k.decode(): v.decode() for k, v in start['headers']}
+        data = b''.join(m.get('body', b'') for m in messages[1:])
+        return start['status'], response_headers, data
+
+    def test_async_reads_match_flask_responses(self):
+        movie_id = self.seed_movies(3)[0]
+        self.seed_actors(4, movie_id)
+        header_obj = self.auth_header("Casting Assistant")
+        paths = ['/movies', '/movies?limit=2&sort=-title',
+                 '/movies?fields=title,actors.name', '/actors?gender=F',
+                 f'/movies/{movie_id}', '/actors/2', '/actors/999',
+                 '/movies?sort=budget', '/actors?after=bogus',
+                 '/actors?q=actor&limit=2', '/movies?q=x']
+
+        for path in paths:
+            status, headers, data = self.asgi_request('GET', path, header_obj)
+            res = self.client().get(path, headers=header_obj)
+            self.assertEqual(status, res.status_code, path)
+            self.assertEqual(json.loads(data), json.loads(res.data), path)
+            self.assertEqual(headers.get('etag'), res.headers.get('ETag'), path)
+            self.assertEqual(headers['access-control-allow-methods'],
+                             res.headers['Access-Control-Allow-Methods'])
+
+    def test_async_reads_from_movie_documents(self):
+        movie_id = self.seed_movies(3)[0]
+        self.seed_actors(4, movie_id)
+        with self.app.app_context():
+            rebuild_movie_documents()
+        self.app.config['MOVIE_DOCUMENTS'] = 'serve'
+        header_obj = self.auth_header("Casting Assistant")
+
+        for path in ['/movies', '/movies?limit=2&sort=-title',
+                     '/movies?released_after=2001-01-01', '/movies?after=bogus']:
+            status, headers, data = self.asgi_request('GET', path, header_obj)
+            res = self.client().get(path, headers=header_obj)
+            self.assertEqual(status, res.status_code, path)
+            self.assertEqual(data, res.data, path)
+
+    def test_async_reads_use_replica_until_caller_writes(self):
+        movie_id = self.seed_movies(1)[0]
+        replica_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        replica_file.close()
+        self.addCleanup(os.unlink, replica_file.name)
+        asgi = create_asgi_app({
+            "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + self.db_file.name,
+            "DATABASE_REPLICA_URLS": 'sqlite:///' + replica_file.name,
+            "RESPONSE_CACHE_BACKEND": 'none',
+            "AUTH0_JWKS_URL": self.jwks_url})
+        replica_engine = asgi.app.extensions['replica_engines'][0]
+        db.metadata.create_all(replica_engine)
+        with replica_engine.begin() as connection:
+            connection.execute(Actor.__table__.insert(), {
+                'name': 'Replica', 'age': 40, 'gender': 'M'})
+        replica_engine.dispose()
+
+        def actor_names(sub):
+            status, _, data = self.asgi_request(
+                'GET', '/actors', self.auth_header("Casting Director", sub=sub),
+                asgi=asgi)
+            self.assertEqual(status, 200)
+            return [actor['name'] for actor in json.loads(data)['actors']]
+
+        try:
+            self.assertEqual(actor_names('auth0|writer'), ['Replica'])
+            header_obj = self.auth_header("Casting Director", sub='auth0|writer')
+            header_obj['Content-Type'] = 'application/json'
+            status, _, _ = self.asgi_request('POST', '/actors', header_obj, json.dumps({
+                'name': 'Primary', 'age': 30, 'gender': 'F',
+                'movie_id': movie_id}).encode(), asgi=asgi)
+            self.assertEqual(status, 201)
+
+            self.assertEqual(actor_names('auth0|writer'), ['Primary'])
+            self.assertEqual(actor_names('auth0|other'), ['Replica'])
+        finally:
+            self.loop.run_until_complete(asgi.dispose())
+            with asgi.app.app_context():
+                db.engine.dispose()
+
+    def test_async_auth_errors_match_flask_responses(self):
+        no_permission = {"Authorization": 'Bearer ' + mint_token(
+            self.private_pem, self.kid, [])}
+        for headers in [{}, {"Authorization": 'Token abc'}, no_permission]:
+            status, _, data = self.asgi_request('GET', '/actors', headers)
+            res = self.client().get('/actors', headers=headers)
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(json.loads(data), json.loads(res.data))
+
+    def test_async_auth_matches_requires_auth(self):
+        seen = []
+
+        async def view(payload):
+            seen.append((payload['sub'], g.jwt_payload['sub']))
+
+        headers = self.auth_header("Casting Assistant")
+        with self.app.test_request_context('/', headers=headers):
+            self.loop.run_until_complete(auth_module.requires_auth_async(None)(view)())
+            with self.assertRaises(auth_module.AuthError) as raised:
+                self.loop.run_until_complete(
+                    auth_module.requires_auth_async('delete:movies')(view)())
+
+        self.assertEqual(seen, [('auth0|test', 'auth0|test')])
+        self.assertEqual(raised.exception.status_code, 403)
+
+    def test_wsgi_threads_read_from_config(self):
+        asgi = create_asgi_app(self.app_config(ASGI_WSGI_THREADS=3))
+        self.addCleanup(asgi.executor.shutdown)
+        self.loop.run_until_complete(asgi.dispose())
+
+        self.assertEqual(asgi.executor._max_workers, 3)
+
+    def test_async_conditional_get(self):
+        self.seed_movies(2)
+        header_obj = self.auth_header("Casting Assistant")
+        status, headers, _ = self.asgi_request('GET', '/movies', header_obj)
+        header_obj['If-None-Match'] = headers['etag']
+        status, _, data = self.asgi_request('GET', '/movies', header_obj)
+
+        self.assertEqual(status, 304)
+        self.assertEqual(data, b'')
+
+    def test_writes_and_streams_are_served_by_flask_app(self):
+        movie_id = self.seed_movies(1)[0]
+        header_obj = self.auth_header("Executive Producer")
+        header_obj['Content-Type'] = 'application/json'
+        body = json.dumps({'name': 'New', 'age': 30, 'gender': 'F',
+                           'movie_id': movie_id}).encode()
+
+        status, _, data = self.asgi_request('POST', '/actors', header_obj, body)
+        self.assertEqual(status, 201)
+        self.assertEqual(json.loads(data)['created']['name'], 'New')
+
+        status, headers, data = self.asgi_request(
+            'GET', '/actors?stream=1', header_obj)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['name'] for line in data.splitlines()],
+                         ['New'])
+
+        _, _, data = self.asgi_request('GET', '/actors', header_obj)
+        self.assertEqual([a['name'] for a in json.loads(data)['actors']], ['New'])
+
+
+class MetricsTestCase(LocalAuthTestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_request_metrics_are_recorded(self):
+        movie_id = self.seed_movies(2)[0]
+        self.seed_actors(3, movie_id)
+        route = {'method': 'GET', 'route': '/movies'}
+        before = {
+            'requests': self.sample('http_request_duration_seconds_count',
+                                    status='200', **route),
+            'statements': self.sample('http_request_sql_statements_sum', **route),
+            'verifications': self.sample('auth_jwt_verify_seconds_count'),
+            'serializations': self.sample('serialization_seconds_count',
+                                          route='/movies')
+        }
+
+        res = self.client().get('/movies', headers=self.auth_header("Casting Assistant"))
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count',
+                                     status='200', **route), before['requests'] + 1)
+        # Table versions, movies and the cast.
+        self.assertEqual(self.sample('http_request_sql_statements_sum', **route),
+                         before['statements'] + 3)
+        self.assertEqual(self.sample('auth_jwt_verify_seconds_count'),
+                         before['verifications'] + 1)
+        self.assertEqual(self.sample('serialization_seconds_count', route='/movies'),
+                         before['serializations'] + 1)
+
+    def test_failed_statement_does_not_skew_timings(self):
+        route = {'method': 'GET', 'route': '/movies'}
+        before = self.sample('http_request_sql_statements_sum', **route)
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                with self.assertRaises(DBAPIError):
+                    connection.exec_driver_sql('SELECT * FROM missing_table')
+                connection.rollback()
+                connection.exec_driver_sql('SELECT 1')
+                self.assertEqual(connection.info.get('query_started', []), [])
+
+        self.client().get('/movies', headers=self.auth_header("Casting Assistant"))
+        self.assertEqual(self.sample('http_request_sql_statements_sum', **route),
+                         before + 2)
+
+    def test_response_cache_lookups_are_counted(self):
+        self.seed_movies(1)
+        labels = {'route': '/movies'}
+        before = {result: self.sample('response_cache_lookups_total',
+                                      result=result, **labels)
+                  for result in ('hit', 'miss')}
+
+        for _ in range(3):
+            self.client().get('/movies', headers=self.auth_header("Casting Assistant"))
+
+        self.assertEqual(self.sample('response_cache_lookups_total', result='miss',
+                                     **labels), before['miss'] + 1)
+        self.assertEqual(self.sample('response_cache_lookups_total', result='hit',
+                                     **labels), before['hit'] + 2)
+
+    def test_server_timing_header(self):
+        self.seed_movies(1)
+        res = self.client().get('/movies', headers=self.auth_header("Casting Assistant"))
+        timings = dict(entry.strip().split(';dur=')
+                       for entry in res.headers['Server-Timing'].split(','))
+
+        self.assertEqual(set(timings), {'jwt', 'db', 'serialize', 'total'})
+        self.assertGreater(float(timings['total']), 0)
+
+    def test_metrics_endpoint(self):
+        self.client().get('/')
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn(b'http_request_duration_seconds_bucket{', res.data)
+        self.assertIn(b'route="/"', res.data)
+
+
+class PublicKeyTestCase(LocalAuthTestCase):
+    def test_public_key_parsed_once_per_key_set(self):
+        store = auth_module.jwks_store
+        key = store.get_key(self.kid)
+        public_key = store.get_public_key(key, 'RS256')
+
+        self.assertIs(store.get_public_key(key, 'RS256'), public_key)
+        self.assertEqual(type(public_key).__name__, 'CryptographyRSAKey')
+
+        store.clear()
+        refetched = store.get_key(self.kid)
+        self.assertIsNot(store.get_public_key(refetched, 'RS256'), public_key)
+
+    def test_verification_errors_unchanged(self):
+        valid = self.auth_header("Casting Assistant")['Authorization'].split()[1]
+        header, claims, signature = valid.split('.')
+        tampered = '.'.join([header, claims, signature[::-1]])
+        expired = mint_token(self.private_pem, self.kid, ['view:actors'], -10)
+        other_audience = jwt.encode(
+            {**jwt.get_unverified_claims(valid), 'aud': 'another-api'},
+            self.private_pem, algorithm='RS256', headers={'kid': self.kid})
+
+        cases = [(tampered, 400, 'Unable to parse authentication token.'),
+                 (expired, 401, 'Token expired.'),
+                 (other_audience, 401,
+                  'Incorrect claims. Please, check the audience and issuer.')]
+        for token, status, message in cases:
+            res = self.client().get('/actors',
+                                    headers={"Authorization": f'Bearer {token}'})
+            self.assertEqual(res.status_code, status)
+            self.assertEqual(json.loads(res.data)['message'], message)
+
+
+class AppFactoryTestCase(unittest.TestCase):
+    """
+    Importing the app has no side effects; configuration is resolved by
+    create_app().
+    """
+    def test_import_without_environment(self):
+        code = ('import flaskr, models, auth.auth as a, sys; '
+                'assert a.jwks_store is None; '
+                'assert "alembic" not in sys.modules and "jose" not in sys.modules')
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True,
+            env={'PATH': os.environ.get('PATH', '')},
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_test_config_overrides_environment(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                          'AUTH0_JWKS_URL': 'file:///nonexistent/jwks.json',
+                          'JWKS_CACHE_TTL': 5, 'TOKEN_CACHE_SIZE': 7})
+
+        self.assertEqual(app.config['SQLALCHEMY_DATABASE_URI'], 'sqlite://')
+        self.assertEqual(auth_module.jwks_store.url, 'file:///nonexistent/jwks.json')
+        self.assertEqual(auth_module.jwks_store.ttl, 5)
+        self.assertEqual(auth_module.token_cache.max_size, 7)
+
+    def test_missing_database_url(self):
+        with self.assertRaises(RuntimeError):
+            create_app({'DATABASE_URL': None})
+
+
+class GunicornConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self._environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+    def load_config(self, **environ):
+        os.environ.update(environ)
+        return runpy.run_path(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+
+    def test_defaults_size_threads_from_pool(self):
+        config = self.load_config(DB_POOL_SIZE='7')
+
+        self.assertEqual(config['worker_class'], 'gthread')
+        self.assertEqual(config['threads'], 7)
+        self.assertGreaterEqual(config['workers'], 2)
+        self.assertTrue(config['preload_app'])
+        self.assertEqual(config['graceful_timeout'], 30)
+
+    def test_environment_overrides(self):
+        config = self.load_config(GUNICORN_WORKER_CLASS='sync',
+                                  WEB_CONCURRENCY='3', GUNICORN_PRELOAD='false')
+
+        self.assertEqual(config['workers'], 3)
+        self.assertNotIn('threads', config)
+        self.assertFalse(config['preload_app'])
+
+    def test_post_fork_replaces_auth_caches(self):
+        create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                    'AUTH0_JWKS_URL': 'file:///nonexistent/jwks.json'})
+        store, cache = auth_module.jwks_store, auth_module.token_cache
+
+        self.load_config()['post_fork'](None, None)
+
+        self.assertIsNot(auth_module.jwks_store, store)
+        self.assertEqual(auth_module.jwks_store.url, store.url)
+        self.assertIsNot(auth_module.token_cache, cache)
+        self.assertEqual(auth_module.token_cache.max_size, cache.max_size)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file